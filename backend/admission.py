@@ -0,0 +1,145 @@
+"""
+Admission control for upstream LLM calls.
+
+A classroom burst (30 students clicking "Generate Quiz" at once) used to turn
+into 30 simultaneous Gemini calls, rate-limit errors and long tail latency for
+everyone. Calls now go through an `AdmissionController`:
+
+- at most `LLM_MAX_CONCURRENCY` calls run at once; the rest wait in a queue
+  ordered by `Priority`, so interactive chat goes ahead of summaries and
+  speculative quiz pre-generation,
+- once `LLM_MAX_QUEUE` calls are waiting, new ones are shed with a 503 and a
+  Retry-After estimate instead of piling up (speculative work is shed earlier,
+  as soon as the queue is half full),
+- each session gets a token bucket of `SESSION_RATE_PER_MINUTE` calls with bursts
+  of up to `SESSION_BURST`; going over it is answered with a 429. The buckets are
+  kept in the `shared` state, so the limit holds across all uvicorn workers.
+
+The concurrency slots and the queue are per worker.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+
+from shared import InMemorySharedState, SharedState
+
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "64"))
+SESSION_RATE_PER_MINUTE = float(os.environ.get("SESSION_RATE_PER_MINUTE", "30"))
+SESSION_BURST = int(os.environ.get("SESSION_BURST", "10"))
+
+
+class Priority(IntEnum):
+    """Lower values are admitted first."""
+    INTERACTIVE = 0  # /chat
+    REVIEW = 1  # /verify_code, /submit_quiz
+    BATCH = 2  # /summarize, /generate_quiz
+    SPECULATIVE = 3  # quiz prefetch, background summary folding
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed; carries the HTTP status and Retry-After seconds to answer with."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdmissionController:
+    def __init__(self, capacity: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 rate_per_minute: float = SESSION_RATE_PER_MINUTE, burst: int = SESSION_BURST,
+                 state: Optional[SharedState] = None):
+        """`state` holds the per-session token buckets; by default they are kept in this worker."""
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.rate_per_second = rate_per_minute / 60
+        self.burst = burst
+        self.active = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self.state = state if state is not None else InMemorySharedState(maxsize=100_000)
+        # A bucket untouched this long has refilled completely, so it can be forgotten
+        self._bucket_ttl = max(burst / self.rate_per_second, 60)
+        # Moving average of how long a call holds its slot, for Retry-After estimates
+        self._hold_seconds = 5.0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.rate_limited = 0
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, waiter in self._queue if not waiter.done())
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._hold_seconds * (self.queue_depth() + 1) / self.capacity))
+
+    def check(self, priority: Priority, session_id: Optional[str] = None) -> None:
+        """Raises `Overloaded` if the call would be rate limited or shed; consumes a session token otherwise."""
+        limit = self.max_queue // 2 if priority >= Priority.SPECULATIVE else self.max_queue
+        if self.active >= self.capacity and self.queue_depth() >= limit:
+            self.shed += 1
+            raise Overloaded(503, self._retry_after(), "The tutor is busy right now, please try again shortly.")
+        if session_id is not None:
+            wait = self.state.take_token("rate_limit", session_id, self.rate_per_second, self.burst, self._bucket_ttl)
+            if wait > 0:
+                self.rate_limited += 1
+                raise Overloaded(429, math.ceil(wait), "Too many requests for this session, please slow down.")
+
+    async def _acquire(self, priority: Priority) -> None:
+        if self.active < self.capacity and not self.queue_depth():
+            self.active += 1
+            return
+        limit = self.max_queue // 2 if priority >= Priority.SPECULATIVE else self.max_queue
+        if self.queue_depth() >= limit:
+            self.shed += 1
+            raise Overloaded(503, self._retry_after(), "The tutor is busy right now, please try again shortly.")
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), waiter))
+        self.queued += 1
+        try:
+            # The releasing call hands its slot over, so `active` is not incremented here
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority):
+        """Holds one of the concurrency slots for the duration of the block."""
+        await self._acquire(priority)
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * (time.monotonic() - started)
+            self._release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self.active,
+            "capacity": self.capacity,
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited,
+        }
@@ -0,0 +1,239 @@
+"""
+Local pre-analysis of code submitted to /verify_code.
+
+Runs before any LLM call and costs well under a millisecond for typical snippets:
+- code that doesn't parse is answered right away from the `SyntaxError`,
+- a fingerprint of the normalized AST (formatting, comments and docstrings
+  don't change it) keys a cache of reviews, so resubmitting the same code is
+  answered from the cache instead of going upstream,
+- cheap facts (loop nesting depth, obvious quadratic patterns, unused
+  variables) are extracted and handed to the model so it doesn't have to work
+  them out itself.
+"""
+import ast
+import hashlib
+import os
+from typing import Dict, List, Optional, Set
+
+from cachetools import TTLCache
+
+from shared import SharedState
+
+REVIEW_CACHE_SIZE = int(os.environ.get("REVIEW_CACHE_SIZE", "2048"))
+REVIEW_CACHE_TTL_SECONDS = int(os.environ.get("REVIEW_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+MAX_FACTS = 8
+
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+_LINEAR_LIST_METHODS = {"index", "count", "remove"}
+
+
+class CodeAnalysis:
+    def __init__(self, code: str):
+        self.syntax_error: Optional[SyntaxError] = None
+        self.fingerprint: Optional[str] = None
+        self.facts: List[str] = []
+        # Top-level functions, in definition order
+        self.functions: List[str] = []
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError) as e:
+            # ValueError: source containing null bytes
+            self.syntax_error = e if isinstance(e, SyntaxError) else SyntaxError(str(e))
+            return
+        self.functions = [node.name for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+        collector = _FactCollector()
+        collector.visit(tree)
+        self.facts = collector.facts[:MAX_FACTS]
+        self.fingerprint = hashlib.sha256(ast.dump(_strip_docstrings(tree)).encode("utf-8")).hexdigest()
+
+    def syntax_feedback(self) -> str:
+        """A Socratic answer pointing at the syntax error, without asking the model."""
+        error = self.syntax_error
+        if not error.lineno:
+            return f"Python can't run this code yet: it reports \"{error.msg}\". What in your code might Python not expect?"
+        line = f"\n\n```python\n{error.text.rstrip()}\n```" if error.text and error.text.strip() else ""
+        return (f"Python can't run this code yet: it reports \"{error.msg}\" on line {error.lineno}.{line}\n\n"
+                "What do you notice about that line, or the one just before it, that Python might not expect?")
+
+
+def analyze(code: str) -> CodeAnalysis:
+    return CodeAnalysis(code)
+
+
+def _strip_docstrings(tree: ast.AST) -> ast.AST:
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) \
+                    and isinstance(first.value.value, str):
+                node.body = node.body[1:] or [ast.Pass()]
+    return tree
+
+
+def _names(target: ast.AST) -> List[str]:
+    return [node.id for node in ast.walk(target) if isinstance(node, ast.Name)]
+
+
+class _FactCollector(ast.NodeVisitor):
+    """Walks the tree once, one function scope at a time, collecting facts worth telling the reviewer."""
+
+    def __init__(self):
+        self.facts: List[str] = []
+        self._enter("the top-level code")
+
+    def _enter(self, scope: str) -> None:
+        self.scope = scope
+        self.loops: List[int] = []
+        self.deepest: List[int] = []
+        self.lists: Set[str] = set()
+        self.strings: Set[str] = set()
+
+    def _fact(self, fact: str) -> None:
+        if fact not in self.facts:
+            self.facts.append(fact)
+
+    def _report_nesting(self) -> None:
+        if len(self.deepest) >= 2:
+            lines = ", ".join(str(line) for line in self.deepest)
+            self._fact(f"{self.scope} has loops nested {len(self.deepest)} deep (lines {lines}): "
+                       f"O(n^{len(self.deepest)}) if each runs over the input.")
+
+    def visit_Module(self, node: ast.Module) -> None:
+        self.generic_visit(node)
+        self._report_nesting()
+
+    def visit_FunctionDef(self, node) -> None:
+        saved = (self.scope, self.loops, self.deepest, self.lists, self.strings)
+        self._enter(f"`{node.name}`")
+        self.generic_visit(node)
+        self._report_nesting()
+        self._report_unused(node)
+        self.scope, self.loops, self.deepest, self.lists, self.strings = saved
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _loop(self, node: ast.AST) -> None:
+        self.loops.append(node.lineno)
+        if len(self.loops) > len(self.deepest):
+            self.deepest = list(self.loops)
+        self.generic_visit(node)
+        self.loops.pop()
+
+    visit_For = visit_AsyncFor = visit_While = _loop
+
+    def _comprehension(self, node) -> None:
+        for _ in node.generators:
+            self.loops.append(node.lineno)
+        if len(self.loops) > len(self.deepest):
+            self.deepest = list(self.loops)
+        self.generic_visit(node)
+        del self.loops[len(self.loops) - len(node.generators):]
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _comprehension
+
+    def visit_Assign(self, node: ast.Assign) -> None:
+        value = node.value
+        is_list = isinstance(value, (ast.List, ast.ListComp)) or (
+            isinstance(value, ast.Call) and isinstance(value.func, ast.Name) and value.func.id == "list")
+        is_string = isinstance(value, ast.Constant) and isinstance(value.value, str)
+        for target in node.targets:
+            for name in _names(target):
+                (self.lists.add if is_list else self.lists.discard)(name)
+                (self.strings.add if is_string else self.strings.discard)(name)
+        self.generic_visit(node)
+
+    def visit_Compare(self, node: ast.Compare) -> None:
+        if self.loops:
+            for op, right in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.In, ast.NotIn)) and isinstance(right, ast.Name) and right.id in self.lists:
+                    self._fact(f"Line {node.lineno} in {self.scope} checks `in {right.id}` inside a loop; "
+                               f"`{right.id}` is a list, so each check scans it: O(n) per check.")
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        if self.loops and isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) \
+                and func.value.id in self.lists:
+            front = node.args and isinstance(node.args[0], ast.Constant) and node.args[0].value == 0
+            if func.attr in _LINEAR_LIST_METHODS or (func.attr in ("insert", "pop") and front):
+                self._fact(f"Line {node.lineno} in {self.scope} calls `{func.value.id}.{func.attr}(...)` inside a loop; "
+                           "on a list that is O(n) per call.")
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node: ast.AugAssign) -> None:
+        if self.loops and isinstance(node.op, ast.Add) and isinstance(node.target, ast.Name) \
+                and node.target.id in self.strings:
+            self._fact(f"Line {node.lineno} in {self.scope} builds the string `{node.target.id}` with += inside a loop, "
+                       "copying it every time.")
+        self.generic_visit(node)
+
+    def _report_unused(self, function) -> None:
+        assigned: Dict[str, int] = {}
+        declared: Set[str] = set()
+        for arg in function.args.posonlyargs + function.args.args + function.args.kwonlyargs:
+            if arg.arg not in ("self", "cls"):
+                assigned.setdefault(arg.arg, arg.lineno)
+        stack = list(function.body)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (ast.Global, ast.Nonlocal)):
+                declared.update(node.names)
+            elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                assigned.setdefault(node.id, node.lineno)
+            if not isinstance(node, _SCOPES):
+                stack.extend(ast.iter_child_nodes(node))
+        used = {node.id for node in ast.walk(function) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+        used.update(node.target.id for node in ast.walk(function)
+                    if isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name))
+        for name, line in sorted(assigned.items(), key=lambda item: item[1]):
+            if name not in used and name not in declared and not name.startswith("_"):
+                self._fact(f"`{name}` (line {line}) in {self.scope} is never used.")
+
+
+class ReviewCache:
+    """
+    Reviews keyed by the fingerprint of the reviewed code and what else shaped the
+    review (see `review_key` in main). With a `state` shared by the workers, a
+    review cached by one worker is served by all of them.
+    """
+
+    def __init__(self, maxsize: int = REVIEW_CACHE_SIZE, ttl_seconds: int = REVIEW_CACHE_TTL_SECONDS,
+                 state: Optional[SharedState] = None):
+        self.ttl_seconds = ttl_seconds
+        self._reviews = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._state = state
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.syntax_errors = 0
+
+    def get(self, key: str) -> Optional[str]:
+        review = self._reviews.get(key)
+        if review is not None:
+            self.hits += 1
+            return review
+        if self._state is not None:
+            review = self._state.get("review", key)
+        if review is None:
+            self.misses += 1
+        else:
+            self.shared_hits += 1
+            self._reviews[key] = review
+        return review
+
+    def put(self, key: str, review: str) -> None:
+        self._reviews[key] = review
+        if self._state is not None:
+            self._state.set("review", key, review, self.ttl_seconds)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            "syntax_errors": self.syntax_errors,
+            "keys": len(self._reviews),
+            "max_keys": self._reviews.maxsize,
+        }
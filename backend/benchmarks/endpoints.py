@@ -0,0 +1,255 @@
+"""
+End-to-end benchmark of the tutoring endpoints.
+
+Simulates a classroom against the fake provider: `--students` concurrent
+sessions each chat for `--turns` turns, get their code reviewed every few turns,
+take a quiz half way through and ask for a summary at the end. Then, one
+request at a time against a zero-latency model, every endpoint is profiled at
+growing history lengths so the backend's own overhead shows up on its own.
+
+Reports throughput, p50/p95/p99 latency, request/response sizes and CPU time per
+request as JSON, e.g. to keep a baseline and fail CI when a change regresses it:
+    python -m benchmarks.endpoints --output baseline.json
+    python -m benchmarks.endpoints --baseline baseline.json --tolerance 0.25
+
+Run from the backend directory.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import platform
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+import llm
+import main
+from admission import AdmissionController
+from providers import FakeProvider
+
+TOPICS = ["Two Sum", "Binary Search", "Linked List Cycle", "Merge Intervals"]
+CODE = """def two_sum(nums, target):
+    for i in range(len(nums)):
+        for j in range(i + 1, len(nums)):
+            if nums[i] + nums[j] == target:
+                return [i, j]
+"""
+QUESTIONS = [{"question": f"Question {i} about the topic?"} for i in range(1, 5)]
+
+
+class TutorFake(FakeProvider):
+    """Fake provider answering quiz prompts with quiz JSON and everything else with `answer_words` words."""
+
+    def __init__(self, answer_words: int, **kwargs):
+        super().__init__(**kwargs)
+        self.answer_words = answer_words
+
+    def respond(self, prompt: str) -> str:
+        if "creating a quiz" in prompt:
+            return json.dumps(QUESTIONS)
+        words = "What happens to the running time of that loop when the input doubles in size?".split()
+        return " ".join(words[i % len(words)] for i in range(self.answer_words))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[Dict[str, float]]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def post(self, client: httpx.AsyncClient, path: str, body: Dict) -> Optional[Dict]:
+        payload = json.dumps(body).encode("utf-8")
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        response = await client.post(path, content=payload, headers={"Content-Type": "application/json"})
+        sample = {
+            "seconds": time.perf_counter() - started,
+            # Only meaningful when requests run one at a time, as in the profile pass
+            "cpu_seconds": time.process_time() - cpu_started,
+            "request_bytes": len(payload),
+            "response_bytes": len(response.content),
+        }
+        if response.status_code != 200:
+            self.errors[path] += 1
+            return None
+        self.samples[path].append(sample)
+        return response.json()
+
+    def report(self, elapsed: Optional[float] = None, cpu: bool = False) -> Dict[str, Dict]:
+        report = {}
+        for path in sorted(set(self.samples) | set(self.errors)):
+            samples = self.samples[path]
+            latencies = [s["seconds"] for s in samples] or [0.0]
+            entry = {
+                "requests": len(samples),
+                "errors": self.errors[path],
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "request_bytes": statistics.mean(s["request_bytes"] for s in samples) if samples else 0,
+                "response_bytes": statistics.mean(s["response_bytes"] for s in samples) if samples else 0,
+            }
+            if elapsed:
+                entry["throughput_rps"] = len(samples) / elapsed
+            if cpu and samples:
+                entry["cpu_ms"] = statistics.mean(s["cpu_seconds"] for s in samples) * 1000
+            report[path] = entry
+        return report
+
+
+async def student(client: httpx.AsyncClient, recorder: Recorder, number: int, turns: int, use_sessions: bool):
+    """One simulated student's session, either through a server-side session or resending the full history."""
+    topic = TOPICS[number % len(TOPICS)]
+    history: List[Dict[str, str]] = []
+    session_id = None
+    if use_sessions:
+        session_id = (await client.post("/sessions")).json()["session_id"]
+    synced = 0
+
+    def context(new: List[Dict[str, str]]) -> Dict:
+        nonlocal synced
+        if not use_sessions:
+            return {"conversation_history": history + new}
+        body = {"session_id": session_id, "new_messages": new, "history_offset": synced}
+        synced += len(new)
+        return body
+
+    for turn in range(1, turns + 1):
+        message = {"role": "user", "content": f"Turn {turn}: I think I could loop over the array twice, would that work?"}
+        data = await recorder.post(client, "/chat", {"topic": topic, **context([message])})
+        history.append(message)
+        if data is not None:
+            history.append({"role": "agent", "content": data["answer"]})
+            synced += 1  # the server records its own reply
+        if turn % 5 == 0:
+            await recorder.post(client, "/verify_code", {"code": CODE, **context([])})
+        if turn == turns // 2:
+            quiz = await recorder.post(client, "/generate_quiz", {"topic": topic, "grade": "Undergraduate", **context([])})
+            if quiz is not None:
+                answers = {q["question"]: "By using a hash map." for q in quiz["questions"]}
+                await recorder.post(client, "/submit_quiz", {"topic": topic, "questions": quiz["questions"],
+                                                              "answers": answers, **context([])})
+    await recorder.post(client, "/summarize", {"topic": topic, **context([])})
+
+
+async def load_pass(client: httpx.AsyncClient, args) -> Dict:
+    recorder = Recorder()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(*(student(client, recorder, i, args.turns, not args.full_history)
+                           for i in range(args.students)))
+    elapsed = time.perf_counter() - started
+    requests = sum(len(samples) for samples in recorder.samples.values())
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": requests,
+        "throughput_rps": requests / elapsed,
+        "cpu_ms_per_request": (time.process_time() - cpu_started) / max(requests, 1) * 1000,
+        "endpoints": recorder.report(elapsed),
+    }
+
+
+async def profile_pass(client: httpx.AsyncClient, args) -> Dict:
+    """Every endpoint, one request at a time, with full histories of growing length."""
+    profile = {}
+    for length in args.history_lengths:
+        history = [{"role": "user" if i % 2 == 0 else "agent",
+                    "content": f"Message {i} about nested loops, hash maps and their time complexity."}
+                   for i in range(length)]
+        recorder = Recorder()
+        for _ in range(args.profile_repeats):
+            # A fresh topic and function name each time, so the quiz and review caches and
+            # coalescing don't skip the work
+            unique = time.perf_counter_ns()
+            topic = f"Profile {length} {unique}"
+            code = CODE.replace("two_sum", f"two_sum_{unique}")
+            await recorder.post(client, "/chat", {"topic": topic, "conversation_history": history})
+            await recorder.post(client, "/verify_code", {"code": code, "conversation_history": history})
+            await recorder.post(client, "/generate_quiz", {"topic": topic, "grade": "Undergraduate",
+                                                           "conversation_history": history})
+            await recorder.post(client, "/submit_quiz", {"topic": topic, "questions": QUESTIONS,
+                                                         "answers": {}, "conversation_history": history})
+            await recorder.post(client, "/summarize", {"topic": topic, "conversation_history": history})
+        profile[str(length)] = recorder.report(cpu=True)
+    return profile
+
+
+def regressions(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Latency and CPU figures that got worse than the baseline by more than `tolerance` (and over a millisecond)."""
+    found = []
+    for section in ("load", "profile"):
+        current, previous = result[section], baseline.get(section, {})
+        pairs = [(path, current["endpoints"][path], previous.get("endpoints", {}).get(path))
+                 for path in current["endpoints"]] if section == "load" else \
+            [(f"{path} @ {length} messages", entry, previous.get(length, {}).get(path))
+             for length, endpoints in current.items() for path, entry in endpoints.items()]
+        for name, entry, old in pairs:
+            for metric in ("p95_ms", "cpu_ms"):
+                if old and old.get(metric) and metric in entry and entry[metric] > old[metric] * (1 + tolerance) \
+                        and entry[metric] - old[metric] > 1:
+                    found.append(f"{section} {name} {metric}: {old[metric]:.1f} -> {entry[metric]:.1f}")
+    return found
+
+
+async def run(args) -> Dict:
+    # Measure the endpoints, not the per-session rate limit or speculative quiz generation
+    llm.admission = main.admission = AdmissionController(rate_per_minute=1e9, burst=10 ** 9)
+    main.quiz_prefetcher.enabled = args.prefetch
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        llm.set_provider(TutorFake(args.answer_words, latency=args.latency, jitter=args.latency / 2,
+                                   tokens_per_second=args.tokens_per_second, seed=args.seed))
+        load = await load_pass(client, args)
+        llm.set_provider(TutorFake(args.answer_words, latency=0, seed=args.seed))
+        profile = await profile_pass(client, args)
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "python": platform.python_version(),
+        "load": load,
+        "profile": profile,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=16, help="concurrent simulated sessions")
+    parser.add_argument("--turns", type=int, default=20, help="chat turns per session")
+    parser.add_argument("--full-history", action="store_true",
+                        help="resend the whole conversation every call instead of using server-side sessions")
+    parser.add_argument("--prefetch", action="store_true", help="keep speculative quiz prefetching on")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="fake generation speed")
+    parser.add_argument("--answer-words", type=int, default=40, help="words per fake answer")
+    parser.add_argument("--history-lengths", type=int, nargs="+", default=[0, 10, 40, 160],
+                        help="history lengths, in messages, of the profile pass")
+    parser.add_argument("--profile-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare with; exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    # The endpoints log to stdout; keep it for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,151 @@
+"""
+Fault-injection test of the retry, timeout, circuit breaker and hedging policy.
+
+Drives `llm.generate` against the fake provider with injected transient failures
+and latency spikes, once without and once with hedging, and reports success
+rate and latency percentiles. Latency spikes alone are run without and with
+hedging too, since with failures the tail is mostly retry backoff. Then the fake
+upstream goes down completely to show the circuit breaker failing calls fast,
+and comes back to show the breaker closing again after its reset time.
+
+Checks that retries rescued failed calls, that hedging launched winning hedges
+and cut the tail latency of the spikes, that the breaker opened during the
+outage and closed again after it, and exits with 1 when one of them doesn't
+hold, so it can run in CI. Run from the backend directory:
+    python -m benchmarks.fault_injection --failure-rate 0.2 --slow-rate 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import llm
+from admission import Overloaded, Priority
+from providers import FakeProvider
+from resilience import ResilientCaller
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_scenario(name: str, provider: FakeProvider, caller: ResilientCaller, calls: int,
+                       concurrency: int) -> Dict:
+    llm.set_provider(provider)
+    llm.resilient = caller
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures, fast_failures = [], 0, 0
+
+    async def one(i: int):
+        nonlocal failures, fast_failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                # Distinct prompts, so single-flight coalescing doesn't hide upstream calls
+                await llm.generate(f"{name} call {i}", priority=Priority.INTERACTIVE)
+                latencies.append(time.perf_counter() - started)
+            except Overloaded:
+                fast_failures += 1
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    print(f"\n== {name} ({elapsed:.1f}s)")
+    print(f"succeeded {len(latencies)}/{calls}, failed {failures}, rejected by breaker {fast_failures}, "
+          f"upstream calls {provider.calls}")
+    if latencies:
+        print(f"latency p50 {statistics.median(latencies) * 1000:.0f} ms, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+    print(f"policy {caller.stats()}")
+    return {
+        "calls": calls,
+        "succeeded": len(latencies),
+        "failed": failures,
+        "rejected": fast_failures,
+        "upstream_calls": provider.calls,
+        "p99_seconds": percentile(latencies, 0.99) if latencies else None,
+        "policy": caller.stats(),
+    }
+
+
+def check(results: Dict[str, Dict], min_success: float) -> List[str]:
+    """The expected outcomes that didn't happen."""
+    found = []
+    retried = results["retries only"]
+    spikes, hedged = results["latency spikes"], results["latency spikes + hedging"]
+    outage, trial, recovery = results["upstream outage"], results["recovery trial"], results["recovery"]
+    for name in ("retries only", "retries + hedging"):
+        rate = results[name]["succeeded"] / results[name]["calls"]
+        if rate < min_success:
+            found.append(f"{name}: {rate:.1%} of calls succeeded, expected at least {min_success:.0%}")
+    if not retried["policy"]["retries"]:
+        found.append("retries only: no failed call was retried")
+    if not hedged["policy"]["hedges"] or not hedged["policy"]["hedge_wins"]:
+        found.append(f"latency spikes + hedging: {hedged['policy']['hedges']} hedges, "
+                     f"{hedged['policy']['hedge_wins']} won; expected hedges that beat the original call")
+    if None not in (spikes["p99_seconds"], hedged["p99_seconds"]) and \
+            hedged["p99_seconds"] >= spikes["p99_seconds"]:
+        found.append(f"hedging didn't cut the tail: p99 {hedged['p99_seconds'] * 1000:.0f} ms with it, "
+                     f"{spikes['p99_seconds'] * 1000:.0f} ms without")
+    if not outage["policy"]["circuit_opened"] or not outage["rejected"]:
+        found.append("upstream outage: the circuit breaker didn't open and reject calls")
+    elif outage["upstream_calls"] >= outage["calls"]:
+        found.append(f"upstream outage: {outage['upstream_calls']} upstream calls for {outage['calls']} requests; "
+                     "the breaker didn't fail calls fast")
+    if trial["succeeded"] != 1 or trial["policy"]["circuit"] != "closed":
+        found.append(f"recovery: the trial call after the reset time left the circuit {trial['policy']['circuit']}")
+    if recovery["succeeded"] != recovery["calls"]:
+        found.append(f"recovery: {recovery['succeeded']}/{recovery['calls']} calls succeeded once the circuit "
+                     "closed; expected all of them")
+    return found
+
+
+async def main(args) -> Dict[str, Dict]:
+    faults = dict(latency=args.latency, jitter=args.latency / 2, slow_rate=args.slow_rate,
+                  slow_latency=args.latency * 10, failure_rate=args.failure_rate, seed=args.seed)
+    results = {}
+    results["retries only"] = await run_scenario("retries only", FakeProvider(**faults), ResilientCaller(hedge=False),
+                                                 args.calls, args.concurrency)
+    results["retries + hedging"] = await run_scenario("retries + hedging", FakeProvider(**faults),
+                                                      ResilientCaller(hedge=True), args.calls, args.concurrency)
+    spikes = dict(latency=args.latency, jitter=args.latency / 2, slow_rate=args.slow_rate,
+                  slow_latency=args.latency * 10, failure_rate=0.0, seed=args.seed)
+    results["latency spikes"] = await run_scenario("latency spikes", FakeProvider(**spikes),
+                                                   ResilientCaller(hedge=False), args.calls, args.concurrency)
+    results["latency spikes + hedging"] = await run_scenario("latency spikes + hedging", FakeProvider(**spikes),
+                                                             ResilientCaller(hedge=True), args.calls, args.concurrency)
+    down = FakeProvider(latency=args.latency, failure_rate=1.0, seed=args.seed)
+    caller = ResilientCaller(hedge=False)
+    caller.breaker.reset_seconds = args.breaker_reset
+    results["upstream outage"] = await run_scenario("upstream outage", down, caller, args.calls, args.concurrency)
+    # Upstream is back; once the reset time is over a single trial call closes the circuit again
+    await asyncio.sleep(args.breaker_reset)
+    up = FakeProvider(latency=args.latency, seed=args.seed)
+    results["recovery trial"] = await run_scenario("recovery trial", up, caller, 1, 1)
+    results["recovery"] = await run_scenario("recovery", up, caller, args.calls, args.concurrency)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="base seconds per fake call")
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="fraction of calls failing transiently")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fraction of calls taking 10x longer")
+    parser.add_argument("--breaker-reset", type=float, default=1.0,
+                        help="seconds the circuit stays open in the outage scenario")
+    parser.add_argument("--min-success", type=float, default=0.95,
+                        help="fraction of calls that must succeed despite the injected failures")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    found = check(asyncio.run(main(args)), args.min_success)
+    for line in found:
+        print(f"FAILED {line}", file=sys.stderr)
+    sys.exit(1 if found else 0)
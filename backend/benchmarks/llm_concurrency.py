@@ -0,0 +1,66 @@
+"""
+Load test for the non-blocking LLM call layer.
+
+Swaps Gemini for the fake provider, which sleeps for a fixed latency, then
+fires batches of /chat requests at the app at increasing concurrency levels.
+With a blocking handler throughput stays flat at ~1/latency requests per second
+no matter the concurrency; with the thread pool it should scale with it.
+
+Run from the backend directory:
+    python -m benchmarks.llm_concurrency --latency 0.2 --requests 64
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import llm
+import providers
+from main import app, quiz_prefetcher
+from providers import FakeProvider
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, total: int) -> float:
+    """Sends `total` /chat requests, at most `concurrency` at a time, and returns requests/second."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            response = await client.post("/chat", json={
+                "topic": f"Two Sum #{i}",
+                "conversation_history": [],
+                "end_conversation": False
+            })
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def main(args):
+    llm.set_provider(FakeProvider(args.latency))
+    # Every request uses a new topic; keep quiz prefetching from adding upstream calls of its own
+    quiz_prefetcher.enabled = False
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"fake latency {args.latency * 1000:.0f} ms, {args.requests} requests per level, "
+              f"LLM_MAX_WORKERS={providers.LLM_MAX_WORKERS}, LLM_MAX_CONCURRENCY={llm.admission.capacity}")
+        print(f"{'concurrency':>12} {'req/s':>10} {'speedup':>10}")
+        baseline = None
+        for concurrency in args.levels:
+            throughput = await run_level(client, concurrency, args.requests)
+            baseline = baseline or throughput
+            print(f"{concurrency:>12} {throughput:>10.1f} {throughput / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="seconds the fake provider blocks per call")
+    parser.add_argument("--requests", type=int, default=64,
+                        help="requests sent at each concurrency level")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 32],
+                        help="concurrency levels to measure")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,155 @@
+"""
+Startup benchmark and import-time budget of a backend worker.
+
+A worker added while a class logs in only helps once it is ready, so this
+measures, in fresh interpreters:
+- how long `import main` takes (the part every uvicorn worker pays on boot),
+  and which modules cost the most, from `python -X importtime`;
+- that no LLM SDK is imported on the way (the provider is built lazily);
+- how long a `uvicorn main:app` process takes until /healthz answers and until
+  /readyz reports it warmed up.
+
+Exits with 1 when a budget is exceeded, so it can run in CI:
+    python -m benchmarks.startup --import-budget 1.0 --ready-budget 2.0
+
+Run from the backend directory.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+# Modules that must only be imported once a model is actually needed
+LAZY_MODULES = ["google.generativeai"]
+
+
+def worker_env(**overrides: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    # A placeholder key: the configuration checks pass and nothing is sent anywhere
+    env.update({"LLM_PROVIDER": "gemini", "GEMINI_API_KEY": "startup-benchmark"})
+    env.update(overrides)
+    return env
+
+
+def measure_import(env: Dict[str, str]) -> Dict:
+    """Wall time of `import main` in a fresh interpreter, and the lazy modules it imported anyway."""
+    code = ("import json, sys, time; started = time.perf_counter(); import main; "
+            "print(json.dumps({'seconds': time.perf_counter() - started, "
+            f"'eager': [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))")
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Dict]:
+    """The `top` modules with the highest cumulative import time under `import main`."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=env,
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "cumulative_ms": int(cumulative) / 1000})
+    return sorted(modules, key=lambda module: -module["cumulative_ms"])[:top]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_ready(env: Dict[str, str], timeout: float) -> Dict:
+    """Seconds from spawning a uvicorn worker until /healthz answers and until /readyz returns 200."""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                "--log-level", "warning"], env=env)
+    result = {"live_seconds": None, "ready_seconds": None}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            while time.perf_counter() - started < timeout and process.poll() is None:
+                try:
+                    if result["live_seconds"] is None and client.get("/healthz").status_code == 200:
+                        result["live_seconds"] = time.perf_counter() - started
+                    ready = client.get("/readyz")
+                    if ready.status_code == 200:
+                        result["ready_seconds"] = time.perf_counter() - started
+                        result["readiness"] = client.get("/stats").json()["readiness"]
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def run(args) -> Dict:
+    imports = [measure_import(worker_env()) for _ in range(args.repeats)]
+    seconds = [entry["seconds"] for entry in imports]
+    # The ready check starts a real worker, so it runs against the local fake model
+    with tempfile.TemporaryDirectory() as directory:
+        ready_env = worker_env(LLM_PROVIDER="fake", JOB_DB_PATH=os.path.join(directory, "jobs.db"),
+                               EVENTS_DB_PATH=os.path.join(directory, "events.db"))
+        ready = [measure_ready(ready_env, args.timeout) for _ in range(args.ready_repeats)]
+    live_seconds = [entry["live_seconds"] for entry in ready if entry["live_seconds"] is not None]
+    ready_seconds = [entry["ready_seconds"] for entry in ready if entry["ready_seconds"] is not None]
+    return {
+        "python": platform.python_version(),
+        "import": {
+            "median_seconds": statistics.median(seconds),
+            "max_seconds": max(seconds),
+            "eager_modules": sorted({name for entry in imports for name in entry["eager"]}),
+            "slowest_modules": slowest_imports(worker_env(), args.top),
+        },
+        "worker": {
+            "median_live_seconds": statistics.median(live_seconds) if live_seconds else None,
+            "median_ready_seconds": statistics.median(ready_seconds) if ready_seconds else None,
+            "not_ready": len(ready) - len(ready_seconds),
+            "last": ready[-1],
+        },
+    }
+
+
+def over_budget(result: Dict, import_budget: float, ready_budget: float) -> List[str]:
+    found = []
+    if result["import"]["median_seconds"] > import_budget:
+        found.append(f"import main took {result['import']['median_seconds']:.3f}s, budget {import_budget:g}s")
+    for name in result["import"]["eager_modules"]:
+        found.append(f"{name} is imported by `import main`; it should be imported lazily")
+    ready = result["worker"]["median_ready_seconds"]
+    if ready is None or result["worker"]["not_ready"]:
+        found.append("a worker never reported ready")
+    elif ready > ready_budget:
+        found.append(f"a worker took {ready:.3f}s to become ready, budget {ready_budget:g}s")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeats", type=int, default=5, help="fresh interpreters timing `import main`")
+    parser.add_argument("--ready-repeats", type=int, default=3, help="uvicorn workers started and timed")
+    parser.add_argument("--import-budget", type=float, default=1.0, help="allowed median seconds for `import main`")
+    parser.add_argument("--ready-budget", type=float, default=2.0,
+                        help="allowed median seconds from spawning a worker until /readyz is 200")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a worker to become ready")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    found = over_budget(result, args.import_budget, args.ready_budget)
+    for line in found:
+        print(f"OVER BUDGET {line}", file=sys.stderr)
+    sys.exit(1 if found else 0)
@@ -0,0 +1,161 @@
+"""
+Throughput of the backend as the number of uvicorn worker processes grows.
+
+For each worker count, starts `uvicorn main:app --workers N` against the fake
+model, with the workers sharing their state through `SHARED_STATE_PATH`, and has
+`--students` concurrent sessions chat and get their code reviewed for
+`--seconds`. Every request of a session may land on a different worker, so
+requests failing because a worker doesn't know the session are counted
+separately; with `--no-shared-state` they show what happens without it.
+
+Reports requests per second, latency percentiles and the speedup over the first
+worker count as JSON:
+    python -m benchmarks.workers --workers 1 2 4
+
+The model answers instantly by default (`--latency 0`), so what is measured is
+the backend's own CPU work, which is what extra workers add capacity for. Run
+from the backend directory, on a machine with at least as many cores as workers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+CODE = """def two_sum(nums, target):
+    for i in range(len(nums)):
+        for j in range(i + 1, len(nums)):
+            if nums[i] + nums[j] == target:
+                return [i, j]
+"""
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values) or [0.0]
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"the backend wasn't ready after {timeout:g}s")
+
+
+async def student(client: httpx.AsyncClient, number: int, stop_at: float, latencies: List[float],
+                  outcomes: Counter) -> None:
+    session_id = (await client.post("/sessions")).json()["session_id"]
+    synced, turn = 0, 0
+    while time.perf_counter() < stop_at:
+        turn += 1
+        message = {"role": "user", "content": f"Turn {turn}: would looping over the array twice work?"}
+        requests = [("/chat", {"topic": f"Problem {number % 8}", "session_id": session_id,
+                               "new_messages": [message], "history_offset": synced})]
+        if turn % 4 == 0:
+            requests.append(("/verify_code", {"code": CODE, "session_id": session_id}))
+        for path, body in requests:
+            started = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code == 200:
+                outcomes["ok"] += 1
+            elif response.status_code == 404:
+                # The session is unknown to the worker that got the request
+                outcomes["session_not_found"] += 1
+            else:
+                outcomes[f"status_{response.status_code}"] += 1
+            if path == "/chat" and response.status_code == 200:
+                synced += 2  # the message and the server-recorded reply
+
+
+async def measure(workers: int, args, directory: str) -> Dict:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({"LLM_PROVIDER": "fake", "FAKE_LLM_LATENCY": str(args.latency),
+                "JOB_DB_PATH": os.path.join(directory, f"jobs-{workers}.db"),
+                "EVENTS_DB_PATH": os.path.join(directory, f"events-{workers}.db"),
+                "SESSION_DB_PATH": os.path.join(directory, f"sessions-{workers}.db"),
+                # Measure throughput, not the per-session rate limit or speculative work
+                "SESSION_RATE_PER_MINUTE": "1000000", "SESSION_BURST": "1000000", "QUIZ_PREFETCH_ENABLED": "0"})
+    if args.shared_state:
+        env["SHARED_STATE_PATH"] = os.path.join(directory, f"shared-{workers}.db")
+    else:
+        env.pop("SHARED_STATE_PATH", None)
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                "--workers", str(workers), "--log-level", "warning"], env=env)
+    try:
+        limits = httpx.Limits(max_connections=args.students * 2)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits) as client:
+            await wait_ready(client, args.timeout)
+            # Give every worker the time to boot before the clock starts
+            await asyncio.sleep(args.settle)
+            latencies: List[float] = []
+            outcomes: Counter = Counter()
+            started = time.perf_counter()
+            await asyncio.gather(*(student(client, i, started + args.seconds, latencies, outcomes)
+                                   for i in range(args.students)))
+            elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "throughput_rps": outcomes["ok"] / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "outcomes": dict(outcomes),
+    }
+
+
+async def run(args) -> Dict:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in args.workers:
+            result = await measure(workers, args, directory)
+            print(f"{workers} workers: {result['throughput_rps']:.1f} req/s, {result['outcomes']}", file=sys.stderr)
+            results.append(result)
+    for result in results:
+        result["speedup"] = result["throughput_rps"] / results[0]["throughput_rps"] if results[0]["throughput_rps"] \
+            else 0.0
+    return {
+        "config": vars(args),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to measure")
+    parser.add_argument("--students", type=int, default=32, help="concurrent simulated sessions")
+    parser.add_argument("--seconds", type=float, default=10, help="length of each measurement")
+    parser.add_argument("--latency", type=float, default=0, help="fake seconds to first token")
+    parser.add_argument("--no-shared-state", dest="shared_state", action="store_false",
+                        help="run the workers without SHARED_STATE_PATH")
+    parser.add_argument("--settle", type=float, default=2, help="seconds given to the workers to boot")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for the first worker")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
@@ -0,0 +1,112 @@
+"""
+Single-flight coalescing of identical in-flight LLM calls.
+
+Double-clicking "Submit Code for Review" or a Streamlit rerun re-firing a call
+used to send the very same prompt to Gemini twice. While a call for a prompt is
+in flight, further calls with the same (whitespace-normalized) prompt now wait
+for that call and share its result instead of going upstream. Streams are shared
+too: a late subscriber first replays the chunks produced so far, then follows live.
+Once every subscriber of a stream has left, its upstream call is cancelled.
+"""
+import asyncio
+import hashlib
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(" ".join(prompt.split()).encode("utf-8")).hexdigest()
+
+
+class _SharedStream:
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.producer: Optional[asyncio.Task] = None
+        self.abandoned = False
+
+    async def produce(self, chunks: AsyncIterator[str]) -> None:
+        try:
+            async for text in chunks:
+                async with self.changed:
+                    self.chunks.append(text)
+                    self.changed.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+    def subscribe(self) -> AsyncIterator[str]:
+        # Counted right away, so the upstream call isn't cancelled before this subscriber starts reading
+        self.subscribers += 1
+        return self._follow()
+
+    async def _follow(self) -> AsyncIterator[str]:
+        position = 0
+        try:
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: position < len(self.chunks) or self.done)
+                    available = self.chunks[position:]
+                    finished = self.done
+                for text in available:
+                    yield text
+                position += len(available)
+                if finished and position == len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                # Nobody reads the rest of the answer, so stop generating it
+                self.abandoned = True
+                self.producer.cancel()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        """Runs `call()` unless a call with the same key is already in flight, in which case its result is shared."""
+        task = self._calls.get(key)
+        if task is None:
+            self.upstream_calls += 1
+            task = self._calls[key] = asyncio.ensure_future(call())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced_calls += 1
+        # Shielded so one waiter disconnecting doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def stream(self, key: str, call: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Streaming counterpart of `do`."""
+        shared = self._streams.get(key)
+        if shared is None or shared.abandoned:
+            self.upstream_calls += 1
+            shared = self._streams[key] = _SharedStream()
+            shared.producer = asyncio.ensure_future(shared.produce(call()))
+            shared.producer.add_done_callback(lambda _: self._end_stream(key, shared))
+        else:
+            self.coalesced_calls += 1
+        return shared.subscribe()
+
+    def _end_stream(self, key: str, shared: _SharedStream) -> None:
+        # An abandoned stream may already have been replaced by a new call for the same key
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced_calls": self.coalesced_calls,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
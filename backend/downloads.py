@@ -0,0 +1,151 @@
+"""
+Downloadable exports of conversation summaries (/export).
+
+The Summary tab used to build the PDF in Streamlit on every rerun and inline it
+into the page as a base64 data URI. Instead, the Streamlit server registers the
+summary once with POST /export, fetches GET /export/{id}.pdf itself and keeps
+the bytes for that summary, handing them to `st.download_button`; the browser
+only ever talks to Streamlit, so the backend needn't be reachable from it.
+GET /export/{id}.txt serves the plain text the same way to other clients.
+
+The export id is a hash of the summary text, so registering the same summary
+again is free. Each format is rendered at most once per id and worker and the
+bytes are kept in an LRU with a TTL; concurrent downloads of a file that is
+still being rendered share that render. The texts are kept in the `SharedState`
+when there is one, so a download can be served by any worker. The files carry
+an ETag, so an HTTP client that kept a copy can revalidate it cheaply.
+
+PDFs are set in a TrueType font, so any Unicode text renders: `EXPORT_FONT_PATH`,
+or else the first of `FONT_CANDIDATES` that exists (DejaVu Sans ships with most
+Linux distributions). Without one, the built-in Helvetica is used and the
+characters it lacks are replaced with `?`.
+"""
+import asyncio
+import hashlib
+import os
+from typing import Dict, Iterator, Optional
+
+from cachetools import TTLCache
+
+from coalesce import SingleFlight
+from shared import InMemorySharedState, SharedState
+
+EXPORT_FONT_PATH = os.environ.get("EXPORT_FONT_PATH")
+EXPORT_CACHE_SIZE = int(os.environ.get("EXPORT_CACHE_SIZE", "256"))
+EXPORT_TTL_SECONDS = int(os.environ.get("EXPORT_TTL_SECONDS", str(24 * 60 * 60)))
+# Size of the pieces a download is streamed in
+CHUNK_BYTES = 64 * 1024
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/local/share/fonts/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "txt": "text/plain; charset=utf-8",
+}
+
+
+def export_id(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def font_path() -> Optional[str]:
+    """The TrueType font PDFs are set in, or None if there is none on this host."""
+    if EXPORT_FONT_PATH:
+        return EXPORT_FONT_PATH
+    return next((path for path in FONT_CANDIDATES if os.path.exists(path)), None)
+
+
+def render_pdf(text: str, title: str = "Conversation Summary") -> bytes:
+    """Blocking; lays `text` out on A4 pages under `title`."""
+    # Imported here, so starting a worker doesn't pay for it
+    from fpdf import FPDF
+
+    pdf = FPDF(format="A4")
+    pdf.set_title(title)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    font = font_path()
+    if font is not None:
+        pdf.add_font("Body", fname=font)
+        family = "Body"
+    else:
+        family = "Helvetica"
+        title = title.encode("latin-1", "replace").decode("latin-1")
+        text = text.encode("latin-1", "replace").decode("latin-1")
+    pdf.set_font(family, size=16)
+    pdf.multi_cell(0, 10, title)
+    pdf.ln(2)
+    pdf.set_font(family, size=11)
+    pdf.multi_cell(0, 6, text)
+    return bytes(pdf.output())
+
+
+def render(text: str, file_format: str) -> bytes:
+    if file_format == "pdf":
+        return render_pdf(text)
+    if file_format == "txt":
+        return text.encode("utf-8")
+    raise ValueError(f"Unknown export format: {file_format}")
+
+
+def chunks(data: bytes) -> Iterator[bytes]:
+    for start in range(0, len(data), CHUNK_BYTES):
+        yield data[start:start + CHUNK_BYTES]
+
+
+class ExportCache:
+    def __init__(self, maxsize: int = EXPORT_CACHE_SIZE, ttl_seconds: int = EXPORT_TTL_SECONDS,
+                 state: Optional[SharedState] = None):
+        """`state` holds the registered texts; by default they are kept in this worker."""
+        self.ttl_seconds = ttl_seconds
+        self._texts = state if state is not None else InMemorySharedState(maxsize=maxsize)
+        self._files: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._renders = SingleFlight()
+        self.registered = 0
+        self.renders = 0
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, text: str) -> str:
+        """Keeps `text` available for download and returns its export id."""
+        key = export_id(text)
+        # Re-registering refreshes the TTL
+        self._texts.set("export", key, text, self.ttl_seconds)
+        self.registered += 1
+        return key
+
+    async def get(self, key: str, file_format: str) -> Optional[bytes]:
+        """The file, rendered on first use; None if the export id is unknown or expired."""
+        data = self._files.get((key, file_format))
+        if data is not None:
+            self.hits += 1
+            return data
+        text = self._texts.get("export", key)
+        if text is None:
+            self.misses += 1
+            return None
+        return await self._renders.do(f"{key}.{file_format}", lambda: self._render(key, text, file_format))
+
+    async def _render(self, key: str, text: str, file_format: str) -> bytes:
+        data = await asyncio.get_running_loop().run_in_executor(None, render, text, file_format)
+        self._files[(key, file_format)] = data
+        self.renders += 1
+        return data
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "registered": self.registered,
+            "renders": self.renders,
+            "hits": self.hits,
+            "misses": self.misses,
+            "files": len(self._files),
+            "unicode_font": int(font_path() is not None),
+        }
@@ -0,0 +1,216 @@
+"""
+Append-only store of what happens in each session, for analytics.
+
+Conversation messages, code reviews, graded quizzes and per-request latencies are
+recorded as events. Recording only puts the event on an in-memory queue; a
+writer thread inserts them into a SQLite file (`EVENTS_DB_PATH`, WAL mode) in
+batches, so requests never wait on the disk. If the writer falls behind by more
+than `EVENTS_QUEUE_SIZE` events, new ones are dropped and counted rather than
+slowing requests down.
+
+`export` is the compaction job: it moves the events recorded since the last
+export into Parquet files, one dataset per kind, partitioned by day:
+    <EVENTS_EXPORT_DIR>/transcripts/date=2024-05-01/part-000000001234.parquet
+so cohort-wide analytics can read columns directly (pyarrow, DuckDB, pandas)
+instead of scanning JSON rows. Run it from the backend directory, e.g. nightly:
+    python events.py export
+"""
+import argparse
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+EVENTS_ENABLED = os.environ.get("EVENTS_ENABLED", "1") == "1"
+EVENTS_DB_PATH = os.environ.get("EVENTS_DB_PATH", "events.db")
+EVENTS_EXPORT_DIR = os.environ.get("EVENTS_EXPORT_DIR", "exports")
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "10000"))
+EVENTS_BATCH_SIZE = int(os.environ.get("EVENTS_BATCH_SIZE", "500"))
+EVENTS_FLUSH_SECONDS = float(os.environ.get("EVENTS_FLUSH_SECONDS", "1"))
+# Events read from SQLite per Parquet file written
+EXPORT_CHUNK_SIZE = 50000
+
+# Event kind -> (exported dataset, its columns besides seq/ts/session_id, as pyarrow type names)
+DATASETS: Dict[str, Tuple[str, Dict[str, str]]] = {
+    "message": ("transcripts", {"role": "string", "content": "string"}),
+    "code_review": ("code_reviews", {"fingerprint": "string", "cached": "bool", "feedback": "string"}),
+    "quiz": ("quiz_scores", {"topic": "string", "questions": "int32", "answered": "int32", "results": "string"}),
+    "request": ("latency", {"method": "string", "route": "string", "status": "int32", "seconds": "float64",
+                            "request_bytes": "int64", "response_bytes": "int64"}),
+}
+DATASETS_BY_NAME = {dataset: columns for dataset, columns in DATASETS.values()}
+
+
+class EventStore:
+    def __init__(self, path: str = EVENTS_DB_PATH, queue_size: int = EVENTS_QUEUE_SIZE,
+                 batch_size: int = EVENTS_BATCH_SIZE, flush_seconds: float = EVENTS_FLUSH_SECONDS,
+                 enabled: bool = EVENTS_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=queue_size)
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            with self._db:
+                self._db.execute("PRAGMA journal_mode=WAL")
+                # Durable enough for analytics; a crash may lose the last batch, never corrupt the file
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS events ("
+                    "seq INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, session_id TEXT, "
+                    "kind TEXT NOT NULL, data TEXT NOT NULL)")
+        return self._db
+
+    def start(self) -> None:
+        if not self.enabled or self._writer is not None:
+            return
+        with self._lock:
+            self._connect()
+        self._writer = threading.Thread(target=self._write_loop, name="events", daemon=True)
+        self._writer.start()
+
+    def shutdown(self) -> None:
+        """Writes out the queued events and stops the writer."""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def record(self, kind: str, session_id: Optional[str] = None, **data: Any) -> None:
+        """Queues an event; never blocks."""
+        if not self.enabled:
+            return
+        if self._writer is None:
+            self.start()
+        try:
+            self._queue.put_nowait((time.time(), session_id, kind, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_request(self, method: str, route: str, status: int, seconds: float,
+                       request_bytes: int, response_bytes: int) -> None:
+        self.record("request", method=method, route=route, status=status, seconds=seconds,
+                    request_bytes=request_bytes, response_bytes=response_bytes)
+
+    def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    event = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if event is None:
+                    stopping = True
+                    # Whatever is still queued goes into this last batch
+                    while True:
+                        try:
+                            event = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if event is not None:
+                            batch.append(event)
+                    break
+                batch.append(event)
+            if batch:
+                self._insert(batch)
+
+    def _insert(self, batch: List[tuple]) -> None:
+        rows = [(ts, session_id, kind, json.dumps(data, default=str)) for ts, session_id, kind, data in batch]
+        try:
+            with self._lock, self._db:
+                self._db.executemany("INSERT INTO events (ts, session_id, kind, data) VALUES (?, ?, ?, ?)", rows)
+            self.written += len(rows)
+            self.batches += 1
+        except sqlite3.Error as e:
+            print(f"Error writing events: {e}")
+            self.dropped += len(rows)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+    def export(self, out_dir: str = EVENTS_EXPORT_DIR, keep: bool = False) -> Dict[str, int]:
+        """
+        Writes the events recorded since the last export to Parquet, then deletes
+        them from SQLite unless `keep`. Returns the number of rows exported per dataset.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        exported: Dict[str, int] = defaultdict(int)
+        with self._lock, self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS export_state (id INTEGER PRIMARY KEY CHECK (id = 0), seq INTEGER)")
+            row = db.execute("SELECT seq FROM export_state WHERE id = 0").fetchone()
+        watermark = row[0] if row else 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT seq, ts, session_id, kind, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (watermark, EXPORT_CHUNK_SIZE)).fetchall()
+            if not rows:
+                break
+            # (dataset, day) -> column -> values
+            partitions: Dict[Tuple[str, str], Dict[str, list]] = defaultdict(lambda: defaultdict(list))
+            for seq, ts, session_id, kind, data in rows:
+                if kind not in DATASETS:
+                    continue
+                dataset, columns = DATASETS[kind]
+                day = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).date().isoformat()
+                values = json.loads(data)
+                partition = partitions[(dataset, day)]
+                partition["seq"].append(seq)
+                partition["ts"].append(int(ts * 1000))
+                partition["session_id"].append(session_id)
+                for column in columns:
+                    partition[column].append(values.get(column))
+            for (dataset, day), partition in partitions.items():
+                columns = DATASETS_BY_NAME[dataset]
+                schema = pa.schema([("seq", pa.int64()), ("ts", pa.timestamp("ms", tz="UTC")),
+                                    ("session_id", pa.string())] +
+                                   [(column, pa.type_for_alias(type_name)) for column, type_name in columns.items()])
+                table = pa.Table.from_pydict(dict(partition), schema=schema)
+                directory = os.path.join(out_dir, dataset, f"date={day}")
+                os.makedirs(directory, exist_ok=True)
+                # Named after the first event, so rerunning an interrupted export overwrites instead of duplicating
+                pq.write_table(table, os.path.join(directory, f"part-{partition['seq'][0]:012d}.parquet"))
+                exported[dataset] += table.num_rows
+            watermark = rows[-1][0]
+            with self._lock, self._db:
+                self._db.execute("INSERT OR REPLACE INTO export_state (id, seq) VALUES (0, ?)", (watermark,))
+                if not keep:
+                    self._db.execute("DELETE FROM events WHERE seq <= ?", (watermark,))
+        return dict(exported)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--db", default=EVENTS_DB_PATH, help="event store to read")
+    parser.add_argument("--out", default=EVENTS_EXPORT_DIR, help="directory the Parquet datasets are written to")
+    parser.add_argument("--keep", action="store_true", help="keep the exported events in SQLite")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    counts = EventStore(args.db).export(args.out, keep=args.keep)
+    print(json.dumps({"exported": counts, "seconds": time.perf_counter() - started}, indent=2))
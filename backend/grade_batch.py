@@ -0,0 +1,210 @@
+"""
+Offline grading of a whole class's quiz submissions.
+
+Reads submissions shaped like /submit_quiz requests (`topic`, `questions`,
+`answers`, optionally `conversation_history`, plus an `id` identifying the
+student; the line number is used without one), one JSON object per line, and
+appends `{"id", "topic", "results"}` lines to the output file as each grade
+comes in. Run from the backend directory:
+    python grade_batch.py submissions.jsonl results.jsonl
+
+Submissions of the same quiz without a conversation history are graded
+`--batch-size` at a time in one prompt; if the model's answer to a batched
+prompt can't be split up, its submissions are graded one by one instead.
+`--concurrency` prompts are in flight at once, at BATCH priority, so the usual
+admission control and retry policy apply.
+
+The output doubles as the checkpoint: running the same command again skips the
+submissions already in it, so an interrupted run picks up where it stopped and
+failed submissions get another try.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, Iterator, List, Set
+
+from dotenv import load_dotenv
+
+# Loaded before the local modules below, which read their settings from the environment on import
+load_dotenv()
+
+from tqdm import tqdm
+
+import prompts
+from admission import Overloaded, Priority
+from llm import generate
+
+OVERLOADED_ATTEMPTS = 5
+
+
+def read_submissions(path: str, report: bool = True) -> Iterator[Dict]:
+    """The input's submissions, one at a time; malformed lines are skipped (and reported, with `report`)."""
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                submission = json.loads(line)
+                if not isinstance(submission.get("topic"), str) or not isinstance(submission.get("questions"), list) \
+                        or not isinstance(submission.get("answers"), dict):
+                    raise ValueError("needs `topic`, `questions` and `answers`")
+            except (json.JSONDecodeError, AttributeError, ValueError) as e:
+                if report:
+                    print(f"Skipping line {number} of {path}: {e}", file=sys.stderr)
+                continue
+            submission["id"] = str(submission.get("id", number))
+            yield submission
+
+
+def graded_ids(path: str) -> Set[str]:
+    """Ids already in the output file, from an earlier run."""
+    ids = set()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    ids.add(str(json.loads(line)["id"]))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    pass  # e.g. a line cut short when the earlier run was killed
+    except FileNotFoundError:
+        pass
+    return ids
+
+
+def split_feedback(response_text: str, count: int) -> List[str]:
+    """The per-student feedback in a batched answer; raises ValueError if it doesn't hold exactly `count`."""
+    try:
+        parsed = json.loads(response_text.replace("```json", "").replace("```", "").strip())
+    except json.JSONDecodeError as e:
+        raise ValueError(f"not JSON: {e}")
+    if not isinstance(parsed, list) or len(parsed) != count:
+        raise ValueError(f"expected a list of {count} feedback strings")
+    return [item if isinstance(item, str) else json.dumps(item) for item in parsed]
+
+
+class BatchGrader:
+    def __init__(self, output, progress: tqdm, concurrency: int, batch_size: int):
+        self.output = output
+        self.progress = progress
+        self.batch_size = batch_size
+        self._slots = asyncio.Semaphore(concurrency)
+        self._groups: Dict[str, List[Dict]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.prompts = 0
+        self.batched_prompts = 0
+        self.graded = 0
+        self.failed = 0
+
+    async def add(self, submission: Dict) -> None:
+        if submission.get("conversation_history"):
+            await self._dispatch([submission])
+            return
+        key = json.dumps([submission["topic"], submission["questions"]], sort_keys=True)
+        group = self._groups.setdefault(key, [])
+        group.append(submission)
+        if len(group) >= self.batch_size:
+            await self._dispatch(self._groups.pop(key))
+
+    async def finish(self) -> None:
+        """Grades the partly filled batches and waits for everything in flight."""
+        for group in self._groups.values():
+            await self._dispatch(group)
+        self._groups = {}
+        await asyncio.gather(*self._tasks)
+
+    async def _dispatch(self, group: List[Dict]) -> None:
+        # Waiting for a free slot here also stops reading the input while all slots are busy
+        await self._slots.acquire()
+        task = asyncio.create_task(self._grade(group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _grade(self, group: List[Dict]) -> None:
+        try:
+            if len(group) > 1:
+                try:
+                    first = group[0]
+                    response_text = await self._call(prompts.build_batch_submit_quiz_prompt(
+                        first["topic"], first["questions"], [submission["answers"] for submission in group]))
+                    feedback = split_feedback(response_text, len(group))
+                    # Only counted once the answer could be split; otherwise the group is graded one by one
+                    self.batched_prompts += 1
+                    for submission, text in zip(group, feedback):
+                        self._write(submission, text)
+                    return
+                except Exception as e:
+                    print(f"Grading a batch of {len(group)} one by one instead: {e}", file=sys.stderr)
+            for submission in group:
+                await self._grade_one(submission)
+        finally:
+            self._slots.release()
+
+    async def _grade_one(self, submission: Dict) -> None:
+        try:
+            prompt = prompts.build_submit_quiz_prompt(submission["topic"], submission["questions"],
+                                                      submission["answers"],
+                                                      submission.get("conversation_history") or [])
+            self._write(submission, await self._call(prompt))
+        except Exception as e:
+            print(f"Error grading submission {submission['id']}: {e}", file=sys.stderr)
+            self.failed += 1
+            self.progress.update(1)
+
+    async def _call(self, prompt: str) -> str:
+        self.prompts += 1
+        for attempt in range(1, OVERLOADED_ATTEMPTS + 1):
+            try:
+                return await generate(prompt, priority=Priority.BATCH)
+            except Overloaded as e:
+                if attempt == OVERLOADED_ATTEMPTS:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    def _write(self, submission: Dict, feedback: str) -> None:
+        self.output.write(json.dumps({"id": submission["id"], "topic": submission["topic"], "results": feedback}) + "\n")
+        # Flushed per line, so a crash loses at most the grades still in flight
+        self.output.flush()
+        self.graded += 1
+        self.progress.update(1)
+
+
+async def grade(args) -> Dict:
+    done = graded_ids(args.output)
+    # Malformed lines are skipped, so they don't count towards the progress bar
+    total = sum(1 for _ in read_submissions(args.input, report=False))
+    started = time.perf_counter()
+    skipped = 0
+    with open(args.output, "a") as output, tqdm(total=total, unit="submission", file=sys.stderr) as progress:
+        grader = BatchGrader(output, progress, args.concurrency, args.batch_size)
+        for submission in read_submissions(args.input):
+            if submission["id"] in done:
+                skipped += 1
+                progress.update(1)
+                continue
+            await grader.add(submission)
+        await grader.finish()
+    elapsed = time.perf_counter() - started
+    return {
+        "submissions": total,
+        "graded": grader.graded,
+        "already_graded": skipped,
+        "failed": grader.failed,
+        "prompts": grader.prompts,
+        "batched_prompts": grader.batched_prompts,
+        "elapsed_seconds": elapsed,
+        "submissions_per_second": grader.graded / elapsed if elapsed else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input", help="JSONL file of quiz submissions")
+    parser.add_argument("output", help="JSONL file the grades are appended to; also the checkpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="prompts in flight at once")
+    parser.add_argument("--batch-size", type=int, default=8, help="submissions of the same quiz graded per prompt")
+    args = parser.parse_args()
+    report = asyncio.run(grade(args))
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["failed"] else 0)
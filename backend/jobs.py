@@ -0,0 +1,236 @@
+"""
+Background jobs for slow, non-interactive work.
+
+Grading a quiz or summarizing a long conversation can take longer than a client
+wants to hold an HTTP request open. Instead the request is queued as a job and
+answered with its id right away; the client then polls GET /jobs/{id} for the
+status and, once it is `done`, the result.
+
+Jobs are kept in a SQLite file at `JOB_DB_PATH`, so queued work survives a
+restart: jobs that were running when the backend stopped are queued again when
+it starts. Several uvicorn workers can share the file; each job is claimed by
+one of them, and only the jobs of worker processes that are gone are requeued.
+`JOB_WORKERS` jobs run at a time, separately from (and at a lower priority
+than) interactive chat. Jobs shed by admission control are retried after the
+Retry-After delay, up to `JOB_MAX_ATTEMPTS` times. Finished jobs are deleted
+after `JOB_RESULT_TTL_SECONDS`.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from admission import Overloaded
+
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_RESULT_TTL_SECONDS = int(os.environ.get("JOB_RESULT_TTL_SECONDS", str(24 * 60 * 60)))
+# How often idle workers look for jobs whose retry delay has passed
+JOB_POLL_SECONDS = 1.0
+# Longest pause of a worker after errors reaching the job file (e.g. "database is locked")
+JOB_ERROR_BACKOFF_SECONDS = 30.0
+
+STATUSES = ("queued", "running", "done", "failed")
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+def _alive(pid: int) -> bool:
+    """Whether a process with this id is running on the host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class UnknownJobKind(ValueError):
+    """Raised when a job is submitted for a kind no handler was registered for."""
+
+
+class JobQueue:
+    def __init__(self, path: str = JOB_DB_PATH, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 ttl_seconds: int = JOB_RESULT_TTL_SECONDS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.ttl_seconds = ttl_seconds
+        self._handlers: Dict[str, Handler] = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.errors = 0
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created REAL NOT NULL, updated REAL NOT NULL, run_after REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, run_after, created)")
+            # Job files created before several workers could share them lack the claiming process
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """`handler(payload)` runs jobs of `kind`; whatever it returns (JSON-serializable) is the job's result."""
+        self._handlers[kind] = handler
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        # Nothing runs here yet, so a job "running" under this process id is from an earlier process
+        self._requeue_orphans(own=True)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def _requeue_orphans(self, own: bool = False) -> None:
+        with self._lock, self._db:
+            # Left running by a process that stopped before finishing them; other live workers keep theirs
+            owners = [owner for owner, in self._db.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status = 'running'").fetchall()]
+            for owner in owners:
+                if owner is None or (own if owner == os.getpid() else not _alive(owner)):
+                    self._db.execute("UPDATE jobs SET status = 'queued', updated = ? WHERE status = 'running' "
+                                     "AND owner IS ?", (time.time(), owner))
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        if kind not in self._handlers:
+            raise UnknownJobKind(kind)
+        self.evict_expired()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created, updated, run_after) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)", (job_id, kind, json.dumps(payload), now, now, now))
+        if not self._tasks:
+            # First job since startup (or no lifespan, e.g. under a test client)
+            self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT kind, status, result, error, attempts, created, updated FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None:
+            return None
+        kind, status, result, error, attempts, created, updated = row
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "attempts": attempts,
+            "created": created,
+            "updated": updated,
+        }
+
+    def _claim(self) -> Optional[tuple]:
+        """Marks the oldest job that is due as running and returns (id, kind, payload, attempts)."""
+        now = time.time()
+        with self._lock, self._db:
+            return self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ?, owner = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? ORDER BY created LIMIT 1) "
+                "RETURNING id, kind, payload, attempts", (now, os.getpid(), now)).fetchone()
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None,
+                run_after: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ?, run_after = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, now, run_after or now, job_id))
+
+    async def _work(self) -> None:
+        # A job claimed by this worker whose outcome couldn't be written; it is queued again
+        unfinished = None
+        failures = 0
+        while True:
+            job = None
+            try:
+                if unfinished is not None:
+                    self._finish(unfinished, "queued")
+                    unfinished = None
+                job = self._claim()
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        # Picks up the jobs of a worker process that died meanwhile
+                        self._requeue_orphans()
+                else:
+                    await self._run(*job)
+                failures = 0
+            except Exception as e:
+                # Typically the job file being locked by other worker processes; keep the worker alive
+                self.errors += 1
+                failures += 1
+                if job is not None:
+                    unfinished = job[0]
+                delay = min(JOB_POLL_SECONDS * 2 ** (failures - 1), JOB_ERROR_BACKOFF_SECONDS)
+                print(f"Error in job worker, retrying in {delay:g}s: {e}")
+                await asyncio.sleep(delay)
+
+    async def _run(self, job_id: str, kind: str, payload: str, attempts: int) -> None:
+        handler = self._handlers.get(kind)
+        if handler is None:
+            self.failed += 1
+            self._finish(job_id, "failed", error=f"No handler for job kind {kind}")
+            return
+        try:
+            result = await handler(json.loads(payload))
+        except asyncio.CancelledError:
+            # Shutting down; the next start picks it up again
+            self._finish(job_id, "queued")
+            raise
+        except Overloaded as e:
+            if attempts < self.max_attempts:
+                self.retried += 1
+                self._finish(job_id, "queued", error=e.detail, run_after=time.time() + e.retry_after)
+            else:
+                self.failed += 1
+                self._finish(job_id, "failed", error=e.detail)
+        except Exception as e:
+            print(f"Error during job {kind}: {e}")
+            self.failed += 1
+            self._finish(job_id, "failed", error=getattr(e, "detail", None) or str(e))
+        else:
+            self.completed += 1
+            self._finish(job_id, "done", result=result)
+
+    def evict_expired(self) -> int:
+        deadline = time.time() - self.ttl_seconds
+        with self._lock, self._db:
+            return self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated <= ?", (deadline,)).rowcount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        stats = {status: counts.get(status, 0) for status in STATUSES}
+        stats.update({"workers": len(self._tasks), "completed": self.completed, "failed_total": self.failed,
+                      "retried": self.retried, "errors": self.errors})
+        return stats
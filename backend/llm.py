@@ -0,0 +1,149 @@
+"""
+Non-blocking access to the LLM.
+
+Model calls are blocking network calls, so calling them directly from an
+`async def` handler freezes the whole event loop until the model answers. All
+endpoints go through `generate` / `stream` instead, which run the configured
+provider's calls on a bounded thread pool (see `providers`) and let the worker
+keep serving other students meanwhile.
+
+The provider is built on first use rather than on import (importing and
+configuring the Gemini SDK alone takes about half a second), so a new worker
+starts serving right away; `main`'s warm-up builds it ahead of the first request.
+"""
+import asyncio
+import threading
+import time
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+
+import metrics
+from admission import AdmissionController, Priority
+from coalesce import SingleFlight, prompt_key
+from prompts import count_tokens
+from providers import LLMProvider, get_provider
+from resilience import LLM_DEADLINES, ResilientCaller
+from shared import get_shared_state
+
+load_dotenv()
+
+# Gemini by default, or the local fake with LLM_PROVIDER=fake; built by `current_provider`
+provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+# Identical prompts in flight at the same time share one upstream call
+single_flight = SingleFlight()
+# Bounds, prioritizes and sheds the calls that do go upstream; session rate limits hold across workers
+admission = AdmissionController(state=get_shared_state())
+# Deadlines, retries, circuit breaker and hedging for each upstream call
+resilient = ResilientCaller()
+
+
+def set_provider(new_provider: LLMProvider):
+    """Swaps the provider used by `generate` and `stream`, e.g. for a `FakeProvider` in the benchmarks."""
+    global provider
+    provider = new_provider
+
+
+def current_provider() -> LLMProvider:
+    """The provider, built on the first call; blocking, so async code uses `load_provider`."""
+    global provider
+    if provider is None:
+        with _provider_lock:
+            if provider is None:
+                provider = get_provider()
+    return provider
+
+
+async def load_provider() -> LLMProvider:
+    """`current_provider` without blocking the event loop while the provider is built."""
+    if provider is not None:
+        return provider
+    return await asyncio.get_running_loop().run_in_executor(None, current_provider)
+
+
+async def generate(prompt: str, priority: Priority = Priority.BATCH, session_id: Optional[str] = None) -> str:
+    """
+    Runs the prompt through the provider and returns the answer text.
+    Raises `admission.Overloaded` if the call is rate limited or shed, or the
+    circuit breaker is open.
+    """
+    resilient.breaker.reject_if_open()
+    admission.check(priority, session_id)
+    started = time.perf_counter()
+    try:
+        return await single_flight.do(prompt_key(prompt), lambda: _admitted_generate(prompt, priority))
+    finally:
+        if priority != Priority.SPECULATIVE:
+            metrics.add_phase("llm", time.perf_counter() - started)
+
+
+def stream(prompt: str, priority: Priority = Priority.BATCH, session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Yields the model's answer chunk by chunk as the model produces it.
+    Concurrent identical prompts share a single upstream stream. Admission is
+    checked right away, so an overloaded backend can still answer with a 429/503
+    before the streaming response starts.
+    """
+    resilient.breaker.reject_if_open()
+    admission.check(priority, session_id)
+    chunks = single_flight.stream(prompt_key(prompt), lambda: _admitted_stream(prompt, priority))
+    return chunks if priority == Priority.SPECULATIVE else _timed(chunks)
+
+
+async def _timed(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Attributes the time spent waiting for chunks to the current request's `llm` phase."""
+    while True:
+        started = time.perf_counter()
+        try:
+            text = await chunks.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            metrics.add_phase("llm", time.perf_counter() - started)
+        yield text
+
+
+def _record_call(prompt: str, answer: str, priority: Priority, kind: str, started: float) -> None:
+    label = priority.name.lower()
+    metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, priority=label, kind=kind)
+    metrics.LLM_PROMPT_TOKENS.observe(count_tokens(prompt), priority=label)
+    metrics.LLM_RESPONSE_TOKENS.observe(count_tokens(answer), priority=label)
+    metrics.LLM_PROMPT_CHARS.inc(len(prompt), priority=label)
+    metrics.LLM_RESPONSE_CHARS.inc(len(answer), priority=label)
+
+
+async def _admitted_generate(prompt: str, priority: Priority) -> str:
+    queued = time.perf_counter()
+    async with admission.slot(priority):
+        started = time.perf_counter()
+        metrics.LLM_QUEUE_SECONDS.observe(started - queued, priority=priority.name.lower())
+        try:
+            model = await load_provider()
+            answer = await resilient.call(lambda: model.generate(prompt), LLM_DEADLINES[priority])
+        except Exception as e:
+            metrics.LLM_ERRORS.inc(priority=priority.name.lower(), error=type(e).__name__)
+            raise
+        _record_call(prompt, answer, priority, "generate", started)
+        return answer
+
+
+async def _admitted_stream(prompt: str, priority: Priority) -> AsyncIterator[str]:
+    queued = time.perf_counter()
+    async with admission.slot(priority):
+        started = time.perf_counter()
+        metrics.LLM_QUEUE_SECONDS.observe(started - queued, priority=priority.name.lower())
+        parts = []
+        try:
+            model = await load_provider()
+            async for text in resilient.stream(lambda: model.stream(prompt), LLM_DEADLINES[priority]):
+                if not parts:
+                    metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started,
+                                                            priority=priority.name.lower())
+                parts.append(text)
+                yield text
+        except Exception as e:
+            metrics.LLM_ERRORS.inc(priority=priority.name.lower(), error=type(e).__name__)
+            raise
+        _record_call(prompt, "".join(parts), priority, "stream", started)
@@ -1,22 +1,103 @@
+import asyncio
+import hashlib
 import json
-from fastapi import FastAPI
-from pydantic import BaseModel
-from dotenv import load_dotenv
-from starlette.middleware.cors import CORSMiddleware
-import google.generativeai as genai
-import os
-
+import time
+from contextlib import asynccontextmanager
 
-from typing import List, Dict, Union, Literal
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.middleware.cors import CORSMiddleware
+from dotenv import load_dotenv
 
-# Configure Gemini API
+# Loaded before the local modules below, which read their settings from the environment on import
 load_dotenv()
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 
-# Initialize Gemini Model
-model = genai.GenerativeModel('gemini-2.5-flash')
-
-app = FastAPI()
+import metrics
+import prompts
+import sandbox
+from admission import Overloaded, Priority
+from analysis import CodeAnalysis, ReviewCache, analyze
+from downloads import MEDIA_TYPES, ExportCache, chunks
+from events import EventStore
+from jobs import JobQueue
+import llm
+from llm import admission, generate, resilient, single_flight, stream
+from providers import config_problems
+from quiz_cache import QuizCache, quiz_key
+from quiz_parser import QuestionStream, parse_quiz, parse_stats
+from quiz_prefetch import QuizPrefetcher
+from retrieval import HistoryIndex, HistoryRetriever
+from sandbox import SANDBOX_ENABLED, SANDBOX_SIZES, SandboxPool
+from sessions import SessionNotFound, get_session_store
+from shared import get_shared_state
+from summaries import RollingSummarizer
+from warmup import Readiness
+
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple, Union, Literal
+
+# Set with SHARED_STATE_PATH, so several uvicorn workers serve students consistently
+shared_state = get_shared_state()
+sandbox_pool = SandboxPool()
+job_queue = JobQueue()
+event_store = EventStore()
+readiness = Readiness()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the sandbox workers up front, so the first /run_code doesn't wait for them
+    if SANDBOX_ENABLED and sandbox.available():
+        sandbox_pool.start()
+    # Also resumes the jobs a previous run left unfinished
+    job_queue.start()
+    event_store.start()
+    # Serving from here on; the warm-up continues in the background
+    readiness.start()
+    yield
+    await readiness.shutdown()
+    await job_queue.shutdown()
+    sandbox_pool.shutdown()
+    event_store.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+sessions = get_session_store()
+summarizer = RollingSummarizer(sessions, generate, stream)
+quiz_cache = QuizCache()
+review_cache = ReviewCache(state=shared_state)
+export_cache = ExportCache(state=shared_state)
+retriever = HistoryRetriever()
+
+
+def warm_up_provider() -> None:
+    llm.current_provider().warm_up()
+
+
+def warm_up_retrieval() -> None:
+    # The first NumPy calls on a new worker are noticeably slower than the later ones
+    index = HistoryIndex()
+    index.update([{"role": "user", "content": "How do I warm up?"}])
+    index.scores("warm up")
+
+
+readiness.add_check("llm", config_problems)
+readiness.add_step("provider", warm_up_provider)
+if SANDBOX_ENABLED and sandbox.available():
+    readiness.add_step("sandbox", sandbox_pool.warm_up)
+readiness.add_step("retrieval", warm_up_retrieval)
+
+# Load balancers probe every worker every few seconds; those would swamp the latency records
+PROBE_ROUTES = ("/healthz", "/readyz")
+
+
+def record_request(method: str, route: str, *args) -> None:
+    if route not in PROBE_ROUTES:
+        event_store.record_request(method, route, *args)
+
+
+app.add_middleware(metrics.MetricsMiddleware, on_request=record_request)
 
 # CORS Middleware
 app.add_middleware(
@@ -28,190 +109,669 @@ app.add_middleware(
 )
 
 
-class CodeVerificationRequest(BaseModel):
-    code: str
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Sheds load with a 429 (session over its rate) or 503 (backend saturated) and a Retry-After hint."""
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+def sse_response(chunks: AsyncIterator[Any], key: str = "text") -> StreamingResponse:
+    """
+    Forwards model output to the client as server-sent events.
+    Each chunk is sent as `data: {"text": ...}` (or under `key`) as soon as Gemini produces it,
+    followed by a final `done` event, or an `error` event if generation fails midway.
+    """
+    async def events():
+        try:
+            async for item in chunks:
+                yield f"data: {json.dumps({key: item})}\n\n"
+        except Exception as e:
+            print(f"Error during streaming: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class SessionRequest(BaseModel):
+    """
+    Base for requests that carry conversation context.
+    Clients either send the full `conversation_history`, or a `session_id` from
+    POST /sessions plus only the `new_messages` since their last call, starting at
+    position `history_offset` of the session log.
+    """
     conversation_history: List[Dict[str, str]] = []
+    session_id: Optional[str] = None
+    new_messages: List[Dict[str, str]] = []
+    history_offset: Optional[int] = None
 
 
-@app.post("/verify_code")
-async def verify_code(request: CodeVerificationRequest):
-    prompt = f"""You are a \"Socratic TA\" helping a student with a coding problem.
-The student has submitted the following Python code:
+def resolve_history(request: SessionRequest) -> None:
+    """Appends the new messages to the request's session and loads the full log into `conversation_history`."""
+    if request.session_id is None:
+        return
+    try:
+        if request.new_messages:
+            for message in sessions.append(request.session_id, request.new_messages, request.history_offset):
+                event_store.record("message", request.session_id, role=message["role"], content=message["content"])
+        request.conversation_history = sessions.history(request.session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+
+
+def record_reply(request: SessionRequest, content: str) -> None:
+    """Adds the agent's reply to the request's session, if it has one."""
+    if request.session_id is not None:
+        try:
+            sessions.append(request.session_id, [{"role": "agent", "content": content}])
+            event_store.record("message", request.session_id, role="agent", content=content)
+        except SessionNotFound:
+            pass
+
+
+def history_context(request: SessionRequest, query: Optional[str] = None) -> Dict:
+    """
+    The history arguments for the prompt builders: the conversation plus, for
+    sessions, the running summary they can use in place of older messages.
+    With a `query`, long conversations are cut down to the messages relevant to it.
+    """
+    context = {"history": request.conversation_history}
+    if request.session_id is not None:
+        try:
+            context["summary"], context["summarized"] = sessions.get_summary(request.session_id)
+        except SessionNotFound:
+            pass
+    if query is not None:
+        kept = retriever.relevant(request.conversation_history, query, request.session_id)
+        if len(kept) < len(request.conversation_history):
+            context["history"] = [request.conversation_history[i] for i in kept]
+            if "summarized" in context:
+                context["summarized"] = sum(1 for i in kept if i < context["summarized"])
+    return context
+
+
+async def recorded(request: SessionRequest, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Passes a stream through and records the complete reply in the session once it ends."""
+    parts = []
+    async for text in chunks:
+        parts.append(text)
+        yield text
+    record_reply(request, "".join(parts))
+
+
+@app.post("/sessions")
+async def create_session():
+    return {"session_id": sessions.create()}
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    try:
+        return {"session_id": session_id, "conversation_history": sessions.history(session_id)}
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+
+
+class CodeVerificationRequest(SessionRequest):
+    code: str
+    # Also run the code in the sandbox (against `tests`, or tests the model writes) and tell the reviewer how it did
+    run_tests: bool = False
+    tests: List[Dict[str, Any]] = []
+    function: Optional[str] = None
+    problem: str = ""
+
+
+class RunCodeRequest(BaseModel):
+    """
+    Runs `function` of `code` against `tests` ({"args": [...], "expected": ...})
+    and, given `make_input` source defining `make_input(n)`, times it at the
+    input `sizes`. Without tests or `make_input`, the model writes them from `problem`.
+    """
+    code: str
+    function: Optional[str] = None
+    tests: List[Dict[str, Any]] = []
+    make_input: Optional[str] = None
+    sizes: List[int] = []
+    problem: str = ""
+    session_id: Optional[str] = None
+
+
+async def generate_test_cases(code: str, function: str, problem: str,
+                              session_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Test cases and `make_input` source written by the model; empty if its answer can't be parsed."""
+    response_text = await generate(prompts.build_test_cases_prompt(code, function, problem),
+                                   priority=Priority.REVIEW, session_id=session_id)
+    try:
+        parsed = json.loads(response_text.replace("```json", "").replace("```", "").strip())
+        tests = [test for test in parsed.get("tests", []) if isinstance(test, dict)]
+        make_input = parsed.get("make_input")
+        return tests, make_input if isinstance(make_input, str) else None
+    except (json.JSONDecodeError, AttributeError, TypeError):
+        return [], None
+
+
+async def run_submission(code: str, analysis: CodeAnalysis, function: Optional[str] = None,
+                         tests: List[Dict[str, Any]] = (), make_input: Optional[str] = None,
+                         sizes: List[int] = (), problem: str = "", session_id: Optional[str] = None) -> Dict:
+    """Runs parsed code in the sandbox; the function defaults to the last one the code defines."""
+    if not SANDBOX_ENABLED:
+        raise HTTPException(status_code=403, detail="Running code is disabled on this server (SANDBOX_ENABLED)")
+    if not sandbox.available():
+        raise HTTPException(status_code=501, detail="Running code needs a Linux host")
+    function = function or (analysis.functions[-1] if analysis.functions else None)
+    if function is not None and not tests and not make_input:
+        tests, make_input = await generate_test_cases(code, function, problem, session_id)
+    result = await sandbox_pool.run(code, function, tests, make_input, sizes or SANDBOX_SIZES)
+    result["function"] = function
+    return result
+
+
+@app.post("/run_code")
+async def run_code(request: RunCodeRequest):
+    analysis = analyze(request.code)
+    if analysis.syntax_error is not None:
+        return {"status": "syntax_error", "error": analysis.syntax_feedback()}
+    return await run_submission(request.code, analysis, request.function, request.tests, request.make_input,
+                                request.sizes, request.problem, request.session_id)
+
+
+def review_key(request: CodeVerificationRequest, analysis: CodeAnalysis) -> Optional[str]:
+    """
+    The cache key of a review: the code's fingerprint and the problem, plus what the
+    code was run against. A review written with a conversation in the prompt may
+    quote it, so it is keyed to that session too, and not cached at all without one.
+    Call after resolve_history().
+    """
+    keyed = [analysis.fingerprint, request.problem]
+    if request.run_tests:
+        keyed += [request.tests, request.function]
+    if request.conversation_history:
+        if request.session_id is None:
+            return None
+        keyed.append(request.session_id)
+    return hashlib.sha256(json.dumps(keyed, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
 
-```python
-{request.code}
-```
+def record_review(request: CodeVerificationRequest, key: Optional[str], feedback: str, cached: bool) -> None:
+    event_store.record("code_review", request.session_id, fingerprint=key, cached=cached, feedback=feedback)
 
-Your task is to review the code and provide constructive feedback without directly giving the solution.
-Focus on logical errors, inefficiencies, or areas where the code doesn't align with the problem's requirements.
-Ask leading questions to guide the student to discover and correct their own mistakes.
-Consider the following conversation history for context (if any):
 
-"""
+# Put before the review when the student asked for test cases but the sandbox is off
+NO_SANDBOX_NOTE = "*Your code wasn't run against test cases: running code is turned off on this server.*\n\n"
 
-    for message in request.conversation_history:
-        prompt += f"{message["role"]}: {message["content"]}\n"
-    prompt += f"\nBased on the above, please provide feedback on the student's submitted code using leading questions."
 
-    response = model.generate_content(prompt)
-    feedback = response.text
-    return {"feedback": feedback}
+def skip_tests_if_unavailable(request: CodeVerificationRequest) -> str:
+    """Turns `run_tests` off when code can't be run here, so a plain review is given; returns the note to show then."""
+    if request.run_tests and not (SANDBOX_ENABLED and sandbox.available()):
+        request.run_tests = False
+        return NO_SANDBOX_NOTE
+    return ""
+
+
+async def prepare_review(request: CodeVerificationRequest) -> Tuple[Optional[str], Optional[str], str]:
+    """
+    Either a ready review (for code that doesn't parse, or was reviewed before),
+    or the cache key (None if the review mustn't be cached) and prompt to ask the model for a new one.
+    """
+    resolve_history(request)
+    analysis = analyze(request.code)
+    if analysis.syntax_error is not None:
+        review_cache.syntax_errors += 1
+        record_review(request, None, analysis.syntax_feedback(), cached=False)
+        return analysis.syntax_feedback(), "", ""
+    key = review_key(request, analysis)
+    cached = review_cache.get(key) if key is not None else None
+    if cached is not None:
+        record_review(request, key, cached, cached=True)
+        return cached, key, ""
+    facts = list(analysis.facts)
+    if request.run_tests:
+        run = await run_submission(request.code, analysis, request.function, request.tests,
+                                   problem=request.problem, session_id=request.session_id)
+        facts.extend(sandbox.summarize(run))
+    prompt = prompts.build_verify_code_prompt(request.code, facts=facts,
+                                              **history_context(request, query=f"{request.problem}\n{request.code}"))
+    return None, key, prompt
+
+
+async def text_chunks(text: str) -> AsyncIterator[str]:
+    """A ready answer as a one-chunk stream, for streaming endpoints that don't need the model."""
+    yield text
+
+
+async def cached_review(request: CodeVerificationRequest, key: Optional[str],
+                        chunks: AsyncIterator[str], note: str = "") -> AsyncIterator[str]:
+    """Passes a review stream through, after `note`, and caches the complete review once it ends."""
+    if note:
+        yield note
+    parts = []
+    async for text in chunks:
+        parts.append(text)
+        yield text
+    if key is not None:
+        review_cache.put(key, "".join(parts))
+    record_review(request, key, "".join(parts), cached=False)
 
 
-class QuizRequest(BaseModel):
+@app.post("/verify_code")
+async def verify_code(request: CodeVerificationRequest):
+    """
+    Code that doesn't parse is answered locally, and code whose normalized AST was
+    reviewed before for the same problem (and conversation) gets the cached review;
+    only new code goes to Gemini.
+    """
+    note = skip_tests_if_unavailable(request)
+    ready, key, prompt = await prepare_review(request)
+    if ready is not None:
+        return {"feedback": note + ready}
+    feedback = await generate(prompt, priority=Priority.REVIEW, session_id=request.session_id)
+    if key is not None:
+        review_cache.put(key, feedback)
+    record_review(request, key, feedback, cached=False)
+    return {"feedback": note + feedback}
+
+
+@app.post("/verify_code/stream")
+async def verify_code_stream(request: CodeVerificationRequest):
+    note = skip_tests_if_unavailable(request)
+    ready, key, prompt = await prepare_review(request)
+    if ready is not None:
+        return sse_response(text_chunks(note + ready))
+    chunks = stream(prompt, priority=Priority.REVIEW, session_id=request.session_id)
+    return sse_response(cached_review(request, key, chunks, note))
+
+
+class QuizRequest(SessionRequest):
     topic: str
     grade: str
-    conversation_history: List[Dict[str, str]] = []
 
 
-class QuizSubmissionRequest(BaseModel):
+class QuizSubmissionRequest(SessionRequest):
     topic: str
     questions: List[Dict[str, str]]
     answers: Dict[str, str]
-    conversation_history: List[Dict[str, str]] = []
 
 
-@app.post("/generate_quiz")
-async def generate_quiz(request: QuizRequest):
-    prompt = f"""You are a Socratic TA creating a quiz for a student.
-Based on the topic: {request.topic} and grade level: {request.grade}, generate 3-5 short answer quiz questions.
-Provide only the questions and no answers. Format each question as a JSON object with a 'question' key.
-"""
-
-    response = model.generate_content(prompt)
-    # Assuming the response text can be parsed as JSON directly or needs some cleaning
-    questions_text = response.text.replace(
-        "```json", "").replace("```", "").strip()
-    try:
-        questions = json.loads(questions_text)
-    except json.JSONDecodeError:
-        # Fallback for malformed JSON, try to extract questions heuristically or return an error
-        questions = [
-            {"question": f"Could not parse quiz question: {questions_text}"}]
-    return {"questions": questions}
+async def produce_quiz(topic: str, grade: str, priority: Priority = Priority.BATCH,
+                       session_id: Optional[str] = None) -> Tuple[List[Dict[str, str]], bool]:
+    """
+    Generates a quiz with Gemini and adds it to the quiz cache.
+    Returns the questions and whether the model's output could be parsed.
+    """
+    response_text = await generate(prompts.build_quiz_prompt(topic, grade), priority=priority, session_id=session_id)
+    # Near-valid JSON (fences, trailing commas, cut off mid-way) is repaired rather than regenerated
+    questions = parse_quiz(response_text)
+    if questions is None:
+        return [{"question": f"Could not parse quiz question: {response_text.strip()}"}], False
+    quiz_cache.put(quiz_key(topic, grade), questions)
+    return questions, True
 
 
-@app.post("/submit_quiz")
-async def submit_quiz(request: QuizSubmissionRequest):
-    prompt = f"""You are a Socratic TA evaluating a student's quiz answers.
-Topic: {request.topic}
-Questions and provided answers:
-"""
-    for q_data in request.questions:
-        question = q_data["question"]
-        answer = request.answers.get(question, "No answer provided")
-        prompt += f"\nQuestion: {question}\nStudent Answer: {answer}\n"
-
-    prompt += f"""\nBased on these answers and the conversation history, provide constructive feedback.\n
-Identify areas where the student is lacking and suggest 2-3 specific topics or concepts they should review.\n
-Do not give direct answers but guide them with leading questions."""
-
-    for message in request.conversation_history:
-        prompt += f"{message["role"]}: {message["content"]}\n"
-
-    response = model.generate_content(prompt)
-    results = response.text
-    return {"results": results}
+async def prefetch_quiz(topic: str, grade: str) -> Optional[List[Dict[str, str]]]:
+    questions, parsed = await produce_quiz(topic, grade, priority=Priority.SPECULATIVE)
+    return questions if parsed else None
 
 
-class ChatRequest(BaseModel):
-    topic: str
-    conversation_history: List[Dict[str, str]] = []
-    end_conversation: bool = False
+quiz_prefetcher = QuizPrefetcher(prefetch_quiz, state=shared_state)
 
 
 @app.post("/generate_quiz")
 async def generate_quiz(request: QuizRequest):
-    prompt = f"""You are a Socratic TA creating a quiz for a student.
-Based on the topic: {request.topic} and grade level: {request.grade}, generate 3-5 short answer quiz questions.
-Provide only the questions and no answers. Format each question as a JSON object with a 'question' key.
-"""
-
-    response = model.generate_content(prompt)
-    # Assuming the response text can be parsed as JSON directly or needs some cleaning
-    questions_text = response.text.replace(
-        "```json", "").replace("```", "").strip()
-    try:
-        questions = json.loads(questions_text)
-    except json.JSONDecodeError:
-        # Fallback for malformed JSON, try to extract questions heuristically or return an error
-        questions = [
-            {"question": f"Could not parse quiz question: {questions_text}"}]
+    resolve_history(request)
+    prefetched = await quiz_prefetcher.take(request.topic, request.grade)
+    if prefetched is not None:
+        return {"questions": prefetched}
+    cached = quiz_cache.get(quiz_key(request.topic, request.grade))
+    if cached is not None:
+        return {"questions": cached}
+
+    # The student is waiting; a prefetch still running for this quiz lands in the cache for the next one
+    questions, _ = await produce_quiz(request.topic, request.grade, priority=Priority.INTERACTIVE,
+                                      session_id=request.session_id)
     return {"questions": questions}
 
 
+async def ready_questions(questions: List[Dict[str, str]]) -> AsyncIterator[Dict[str, str]]:
+    """A prefetched or cached quiz as a stream, for /generate_quiz/stream."""
+    for question in questions:
+        yield question
+
+
+async def stream_quiz(request: QuizRequest, chunks: AsyncIterator[str]) -> AsyncIterator[Dict[str, str]]:
+    """Yields the quiz's questions from the model's answer, each as soon as it has finished writing it."""
+    parser = QuestionStream()
+    async for text in chunks:
+        for question in parser.feed(text):
+            yield question
+    # Whatever the incremental parse couldn't make out, the repair of the whole answer may
+    questions = parse_quiz(parser.text) or parser.questions
+    if not questions:
+        yield {"question": f"Could not parse quiz question: {parser.text.strip()}"}
+        return
+    for question in questions[len(parser.questions):]:
+        yield question
+    quiz_cache.put(quiz_key(request.topic, request.grade), questions)
+
+
+@app.post("/generate_quiz/stream")
+async def generate_quiz_stream(request: QuizRequest):
+    """
+    Same as /generate_quiz, but streams the questions as `data: {"question": {...}}` events:
+    all at once when the quiz was prefetched or cached, otherwise one at a time.
+    """
+    resolve_history(request)
+    ready = await quiz_prefetcher.take(request.topic, request.grade) or \
+        quiz_cache.get(quiz_key(request.topic, request.grade))
+    if ready is not None:
+        return sse_response(ready_questions(ready), key="question")
+    # Called before the response starts, so an overload is still answered with 429/503
+    chunks = stream(prompts.build_quiz_prompt(request.topic, request.grade), priority=Priority.INTERACTIVE,
+                    session_id=request.session_id)
+    return sse_response(stream_quiz(request, chunks), key="question")
+
+
+@app.get("/stats")
+async def stats():
+    """Counters for sizing the backend's caches and seeing how much upstream quota they save."""
+    return {
+        "quiz_cache": quiz_cache.stats(),
+        "quiz_prefetch": quiz_prefetcher.stats(),
+        "quiz_parse": dict(parse_stats),
+        "review_cache": review_cache.stats(),
+        "sandbox": sandbox_pool.stats(),
+        "retrieval": retriever.stats(),
+        "coalescing": single_flight.stats(),
+        "admission": admission.stats(),
+        "resilience": resilient.stats(),
+        "jobs": job_queue.stats(),
+        "events": event_store.stats(),
+        "readiness": readiness.stats(),
+        "exports": export_cache.stats(),
+        "shared_state": shared_state.stats() if shared_state is not None else None,
+    }
+
+
+metrics.register_stats("quiz_cache", quiz_cache.stats)
+metrics.register_stats("quiz_prefetch", quiz_prefetcher.stats)
+metrics.register_stats("quiz_parse", lambda: parse_stats)
+metrics.register_stats("review_cache", review_cache.stats)
+metrics.register_stats("sandbox", sandbox_pool.stats)
+metrics.register_stats("retrieval", retriever.stats)
+metrics.register_stats("coalescing", single_flight.stats)
+metrics.register_stats("admission", admission.stats)
+metrics.register_stats("resilience", resilient.stats)
+metrics.register_stats("jobs", job_queue.stats)
+metrics.register_stats("events", event_store.stats)
+metrics.register_stats("readiness", readiness.stats)
+metrics.register_stats("exports", export_cache.stats)
+if shared_state is not None:
+    metrics.register_stats("shared_state", shared_state.stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Request, LLM and cache metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the worker is up and its event loop answers."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once started, configured and warmed up, 503 until then (or while misconfigured)."""
+    status = readiness.status()
+    return JSONResponse(status_code=200 if status["status"] == "ready" else 503, content=status)
+
+
+async def grade_quiz(request: QuizSubmissionRequest, priority: Priority = Priority.REVIEW) -> str:
+    resolve_history(request)
+    quiz = "\n".join(f"{q['question']}\n{request.answers.get(q['question'], '')}" for q in request.questions)
+    prompt = prompts.build_submit_quiz_prompt(
+        request.topic, request.questions, request.answers, **history_context(request, query=quiz))
+    results = await generate(prompt, priority=priority, session_id=request.session_id)
+    answered = sum(1 for q in request.questions if request.answers.get(q["question"], "").strip())
+    event_store.record("quiz", request.session_id, topic=request.topic, questions=len(request.questions),
+                       answered=answered, results=results)
+    return results
+
+
 @app.post("/submit_quiz")
 async def submit_quiz(request: QuizSubmissionRequest):
-    prompt = f"""You are a Socratic TA evaluating a student's quiz answers.
-Topic: {request.topic}
-Questions and provided answers:
-"""
-    for q_data in request.questions:
-        question = q_data["question"]
-        answer = request.answers.get(question, "No answer provided")
-        prompt += f"\nQuestion: {question}\nStudent Answer: {answer}\n"
-
-    prompt += f"""\nBased on these answers and the conversation history, provide constructive feedback.
-Identify areas where the student is lacking and suggest 2-3 specific topics or concepts they should review.
-Do not give direct answers but guide them with leading questions."""
-
-    for message in request.conversation_history:
-        prompt += f"{message["role"]}: {message["content"]}\n"
-
-    response = model.generate_content(prompt)
-    results = response.text
+    results = await grade_quiz(request)
     return {"results": results}
 
 
-class ChatRequest(BaseModel):
+class ChatRequest(SessionRequest):
     topic: str
-    conversation_history: List[Dict[str, str]] = []
     end_conversation: bool = False
 
 
+def build_chat_prompt(request: ChatRequest) -> str:
+    if request.end_conversation:
+        # Summarization logic using Gemini
+        return prompts.build_end_conversation_prompt(request.topic, **history_context(request))
+    # LLM interaction using Gemini
+    return prompts.build_chat_prompt(request.topic, **history_context(request))
+
+
+def start_background_work(request: ChatRequest) -> None:
+    """Kicks off the speculative work a new chat turn makes worthwhile."""
+    quiz_prefetcher.prefetch(request.topic)
+    if request.session_id is not None:
+        summarizer.maybe_fold(request.session_id, request.topic)
+
+
 @app.post("/chat")
 async def chat(request: ChatRequest):
+    resolve_history(request)
     if request.end_conversation:
-        # Summarization logic using Gemini
-        prompt = f"Please summarize the following conversation about {request.topic}:\n\n"
-        for message in request.conversation_history:
-            prompt += f"{message["role"]}: {message["content"]}\n"
-        response = model.generate_content(prompt)
-        summary = response.text
-        return {"summary": summary, "conversation_ended": True}
-    else:
-        # LLM interaction using Gemini
-        initial_prompt = f"""You are a "Socratic TA," a friendly and expert guide for a Data Structures and Algorithms course that specializes in {request.topic}.
-A student has given you a problem and is asking for help to build their intuition.
-Your goal is to guide them to the optimal solution by **asking a series of small, leading questions.**
-
-**Your Strict Rules:**
-1.  **NEVER** give the final answer or the optimal code. Your purpose is to make the student *think*.
-2.  **ALWAYS** respond with only **one** small, leading question at a time to guide them.
-3.  Start by guiding them to a simple brute-force solution (e.g., "How would you solve this if you had no concerns about speed?").
-4.  Once they have a brute-force idea, ask questions to help them identify the *bottleneck* or *inefficiency* (e.g., "What is the time complexity of that? Can we do better?").
-5.  Use their answers to guide them, step-by-step, toward the more optimal solution.
-6.  Be encouraging! Use phrases like "Exactly!", "That's a great observation.", "You're on the right track."
-7.  If the student says that "they are not sure" or "they do not know the answer" to your given hints and help **DO not** start explaining the problem from the start
-8.  If the student says that "i have understood the concept" you can stop explaining
-
-You are currently in a conversation with the student. Here is the full chat history.
-Formulate your *next* guiding question based on this history."""
-
-        # Format conversation history for Gemini
-        formatted_history = []
-        for message in request.conversation_history:
-            formatted_history.append(message)
-
-        # Add current user message
-        if not request.conversation_history:
-            user_message = f"Hello! I want to talk about {request.topic}."
+        if request.session_id is not None:
+            summary = await summarizer.summary(request.session_id, request.topic)
         else:
-            user_message = request.conversation_history[-1].get("content", "")
+            summary = await generate(build_chat_prompt(request), session_id=request.session_id)
+        return {"summary": summary, "conversation_ended": True}
+    start_background_work(request)
+    response_text = await generate(build_chat_prompt(request), priority=Priority.INTERACTIVE,
+                                   session_id=request.session_id)
+    record_reply(request, response_text)
+    return {"answer": response_text}
 
-        response = model.generate_content(initial_prompt + user_message)
-        answer = response.text
-        return {"answer": answer}
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Same as /chat, but streams the answer (or the summary, when ending the conversation)."""
+    resolve_history(request)
+    if request.end_conversation:
+        if request.session_id is not None:
+            return sse_response(await summarizer.stream_summary(request.session_id, request.topic))
+        return sse_response(stream(build_chat_prompt(request), session_id=request.session_id))
+    start_background_work(request)
+    chunks = stream(build_chat_prompt(request), priority=Priority.INTERACTIVE, session_id=request.session_id)
+    return sse_response(recorded(request, chunks))
+
+
+WS_FRAME_TYPES = ("message", "end_conversation", "mode", "ping")
+
+
+class ChatSocket:
+    """
+    One /ws/chat connection: answers the client's frames and pushes a notification
+    when background work started by its turns (quiz prefetch, summary folds) finishes.
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str):
+        self.websocket = websocket
+        self.session_id = session_id
+        # Pushes from the watchers must not interleave with the frames of a streamed answer
+        self._send_lock = asyncio.Lock()
+        # Background task being watched -> its watcher
+        self._watchers: Dict[asyncio.Task, asyncio.Task] = {}
+
+    async def send(self, frame: Dict, turn: Any = None) -> None:
+        """Sends a frame; replies to a client frame carry its `turn`, so the client can tell them apart."""
+        if turn is not None:
+            frame = {**frame, "turn": turn}
+        async with self._send_lock:
+            await self.websocket.send_json(frame)
+        metrics.WS_FRAMES.inc(direction="out", type=frame["type"])
+
+    async def error(self, status: int, detail: str, retry_after: Optional[int] = None, turn: Any = None) -> None:
+        frame = {"type": "error", "status": status, "detail": detail}
+        if retry_after is not None:
+            frame["retry_after"] = retry_after
+        await self.send(frame, turn)
+
+    async def handle(self, frame: Dict) -> None:
+        """Answers one client frame; failures are reported as `error` frames and leave the connection open."""
+        kind = frame.get("type")
+        turn = frame.get("turn")
+        if kind == "ping":
+            await self.send({"type": "pong"}, turn)
+            return
+        if kind not in WS_FRAME_TYPES:
+            await self.error(400, f"Unknown frame type: {kind}", turn=turn)
+            return
+        try:
+            request = ChatRequest(topic=frame.get("topic") or "", session_id=self.session_id,
+                                  new_messages=frame.get("new_messages", []),
+                                  history_offset=frame.get("history_offset"),
+                                  end_conversation=kind == "end_conversation")
+        except ValidationError as e:
+            await self.error(422, str(e), turn=turn)
+            return
+        chunks = None
+        try:
+            resolve_history(request)
+            if kind == "mode":
+                await self.send({"type": "ack", "mode": frame.get("mode"),
+                                 "history_length": len(request.conversation_history)}, turn)
+                return
+            if request.end_conversation:
+                chunks = await summarizer.stream_summary(self.session_id, request.topic) \
+                    if request.conversation_history else text_chunks(EMPTY_CONVERSATION_SUMMARY)
+            else:
+                start_background_work(request)
+                self.watch(request.topic)
+                chunks = recorded(request, stream(build_chat_prompt(request), priority=Priority.INTERACTIVE,
+                                                  session_id=self.session_id))
+            parts = []
+            async for text in chunks:
+                parts.append(text)
+                await self.send({"type": "token", "text": text}, turn)
+            await self.send({"type": "done", "content": "".join(parts),
+                             "history_length": len(sessions.history(self.session_id))}, turn)
+        except WebSocketDisconnect:
+            raise
+        except HTTPException as e:
+            await self.error(e.status_code, e.detail, turn=turn)
+        except Overloaded as e:
+            await self.error(e.status_code, e.detail, e.retry_after, turn)
+        except SessionNotFound:
+            await self.error(404, "Unknown or expired session", turn=turn)
+        except Exception as e:
+            print(f"Error during streaming: {e}")
+            await self.error(500, str(e), turn=turn)
+        finally:
+            # A client that left mid-answer doesn't get it recorded, and the model stops writing it
+            if chunks is not None:
+                await chunks.aclose()
+
+    def watch(self, topic: str) -> None:
+        """Starts watching the background work a turn started, unless it is already watched."""
+        quizzes = [task for task in quiz_prefetcher.pending(topic) if task not in self._watchers]
+        if quizzes:
+            self._spawn(quizzes, self._quiz_ready(topic, quizzes))
+        fold = summarizer.background(self.session_id)
+        if fold is not None and fold not in self._watchers:
+            self._spawn([fold], self._summary_ready(fold))
+
+    def _spawn(self, tasks: List[asyncio.Task], watcher) -> None:
+        watching = asyncio.create_task(watcher)
+        for task in tasks:
+            self._watchers[task] = watching
+        watching.add_done_callback(lambda _: self._unwatch(tasks, watching))
+
+    def _unwatch(self, tasks: List[asyncio.Task], watching: asyncio.Task) -> None:
+        for task in tasks:
+            self._watchers.pop(task, None)
+        # A push to a client that has just gone away is not worth a log line
+        if not watching.cancelled():
+            watching.exception()
+
+    async def _quiz_ready(self, topic: str, tasks: List[asyncio.Task]) -> None:
+        await asyncio.wait(tasks)
+        grades = quiz_prefetcher.ready_grades(topic)
+        if grades:
+            await self.send({"type": "quiz_ready", "topic": topic, "grades": grades})
+
+    async def _summary_ready(self, fold: asyncio.Task) -> None:
+        await asyncio.wait([fold])
+        try:
+            _, summarized = sessions.get_summary(self.session_id)
+        except SessionNotFound:
+            return
+        await self.send({"type": "summary_ready", "summarized": summarized})
+
+    def close(self) -> None:
+        # Only the watchers; the background work itself carries on for the next connection
+        for watcher in set(self._watchers.values()):
+            watcher.cancel()
+
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, session_id: Optional[str] = None):
+    """
+    The conversation tab over one long-lived connection instead of a POST per turn.
+
+    On connect the server sends `{"type": "session", "session_id", "history_length"}`,
+    reusing `session_id` if it is still live and opening a new session otherwise.
+    The client then sends JSON frames carrying only its new messages, as with sessions
+    over HTTP (`new_messages` starting at `history_offset`), and optionally a `turn` id
+    that every frame answering it carries too:
+    - `message` (with `topic`): a chat turn; the answer streams back as `token` frames,
+    - `end_conversation` (with `topic`): streams the conversation summary the same way,
+    - `mode` (with `mode`: "code" or "discussion"): records a switch and its messages, answered with `ack`,
+    - `ping`, answered with `pong`.
+    Streamed answers end with a `done` frame holding the full text and the session's new
+    length; failures send an `error` frame with the status the HTTP endpoints would use.
+    The server also pushes `quiz_ready` when the speculative quizzes for the topic are
+    ready and `summary_ready` when a background summary fold completes.
+    """
+    await websocket.accept()
+    try:
+        history_length = len(sessions.history(session_id)) if session_id else None
+    except SessionNotFound:
+        history_length = None
+    if history_length is None:
+        session_id, history_length = sessions.create(), 0
+    channel = ChatSocket(websocket, session_id)
+    try:
+        await channel.send({"type": "session", "session_id": session_id, "history_length": history_length})
+        while True:
+            text = await websocket.receive_text()
+            started = time.perf_counter()
+            try:
+                frame = json.loads(text)
+            except json.JSONDecodeError:
+                frame = None
+            if not isinstance(frame, dict):
+                await channel.error(400, "Frames must be JSON objects")
+                continue
+            kind = frame.get("type") if frame.get("type") in WS_FRAME_TYPES else "unknown"
+            metrics.WS_FRAMES.inc(direction="in", type=kind)
+            await channel.handle(frame)
+            metrics.WS_TURN_SECONDS.observe(time.perf_counter() - started, type=kind)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        channel.close()
 
 
 class ChatMessage(BaseModel):
@@ -225,7 +785,7 @@ class SummarizeRequest(BaseModel):
     conversation_history: List[ChatMessage]
 
 
-def get_summary_from_llm(history: ChatRequest) -> str:
+async def get_summary_from_llm(history: ChatRequest) -> str:
     """
     Placeholder function for generating a summary.
     Replace this with your actual summarization model call.
@@ -236,18 +796,8 @@ def get_summary_from_llm(history: ChatRequest) -> str:
         return "The conversation was empty. No summary could be generated."
 
     # LLM interaction using Gemini
-    prompt = "You are a summarization assistant. Summarize the conversation history in the simplest manner possible with respect to the topic {history.topic}. Highlight important concepts and learning tips for the " \
-        "student"
-
-    for message in history.conversation_history:
-        prompt += f"{message["role"]}: {message["content"]}\n"
-
-    # Combine the conversation into a single string for the LLM
-
-    summary = model.generate_content(prompt)
-    print(summary)
-    print(summary.text)
-    results = summary.text
+    results = await generate(prompts.build_summarize_prompt(history.topic, history.conversation_history))
+    print(results)
 
     # --- START: Replace this mock logic ---
     # This is where you would call your LLM.
@@ -276,34 +826,135 @@ def get_summary_from_llm(history: ChatRequest) -> str:
     return {"summary": results}
 
 
+EMPTY_CONVERSATION_SUMMARY = "The conversation was empty. No summary could be generated."
+
+
+async def summarize(request: ChatRequest) -> str:
+    """The conversation's summary; for sessions, their rolling summary brought up to date."""
+    if request.session_id is not None:
+        return await summarizer.summary(request.session_id, request.topic)
+    return await generate(prompts.build_summarize_prompt(request.topic, **history_context(request)),
+                          session_id=request.session_id)
+
+
 @app.post("/summarize")
 async def summarize_conversation(request: ChatRequest):
     """
     Receives conversation history and returns a summary.
     This endpoint is called from the "Summary" tab in the Streamlit app.
+    Requests with a session are served from its rolling summary, so only the
+    messages added since the last summary are sent to Gemini.
     """
+    resolve_history(request)
     if not request.conversation_history:
-        return "The conversation was empty. No summary could be generated."
+        return EMPTY_CONVERSATION_SUMMARY
     try:
-
-        # LLM interaction using Gemini
-        prompt = "You are a summarization assistant. Summarize the conversation history in the simplest manner possible with respect to the topic {request.topic}. Highlight important concepts and learning tips for the " \
-            "student." \
-            "Restrict yourself from using any bold words."
-
-        for message in request.conversation_history:
-            prompt += f"{message["role"]}: {message["content"]}\n"
-
-    # Combine the conversation into a single string for the LLM
-
-        summary = model.generate_content(prompt)
-        print(summary)
-        print(summary.text)
-        results = summary.text
+        results = await summarize(request)
+        print(results)
 
         return {"summary": results}
 
+    except Overloaded:
+        raise
     except Exception as e:
         # Log the error and return a 500 status
         print(f"Error during summarization: {e}")
         return {"summary": "An error occurred while generating the summary."}, 500
+
+
+@app.post("/summarize/stream")
+async def summarize_conversation_stream(request: ChatRequest):
+    """Streaming variant of /summarize used by the Summary tab."""
+    resolve_history(request)
+    if not request.conversation_history:
+        return sse_response(text_chunks(EMPTY_CONVERSATION_SUMMARY))
+    if request.session_id is not None:
+        return sse_response(await summarizer.stream_summary(request.session_id, request.topic))
+    return sse_response(stream(prompts.build_summarize_prompt(request.topic, **history_context(request)),
+                               session_id=request.session_id))
+
+
+class ExportRequest(BaseModel):
+    text: str
+
+
+@app.post("/export")
+async def create_export(request: ExportRequest):
+    """
+    Registers a summary for download and returns the paths of its PDF and TXT
+    versions, which the frontend fetches server-side. The id is a hash of the text,
+    so the same summary always gets the same paths.
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Nothing to export")
+    export_id = export_cache.register(request.text)
+    return {"export_id": export_id,
+            "urls": {file_format: f"/export/{export_id}.{file_format}" for file_format in MEDIA_TYPES}}
+
+
+@app.get("/export/{export_id}.{file_format}")
+async def download_export(export_id: str, file_format: str, request: Request):
+    """Streams the export as a file download; a client holding a copy revalidates it with its ETag (304)."""
+    if file_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail=f"Unknown export format: {file_format}")
+    etag = f'"{export_id}.{file_format}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    data = await export_cache.get(export_id, file_format)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Export not found or expired, please export again")
+    headers.update({"Content-Disposition": f'attachment; filename="conversation_summary.{file_format}"',
+                    "Content-Length": str(len(data))})
+    return StreamingResponse(chunks(data), media_type=MEDIA_TYPES[file_format], headers=headers)
+
+
+def queue_job(kind: str, request: SessionRequest) -> Dict:
+    """
+    Records the request's new messages in its session right away, so the client's
+    history offset stays valid, and queues the rest of the request as a job.
+    """
+    resolve_history(request)
+    if request.session_id is not None:
+        # The job reloads the conversation from the session when it runs
+        payload = request.model_dump(exclude={"conversation_history", "new_messages", "history_offset"})
+    else:
+        payload = request.model_dump(exclude={"new_messages", "history_offset"})
+    return {"job_id": job_queue.submit(kind, payload), "status": "queued"}
+
+
+async def quiz_job(payload: Dict) -> Dict:
+    return {"results": await grade_quiz(QuizSubmissionRequest(**payload), priority=Priority.BATCH)}
+
+
+async def summary_job(payload: Dict) -> Dict:
+    request = ChatRequest(**payload)
+    resolve_history(request)
+    if not request.conversation_history:
+        return {"summary": EMPTY_CONVERSATION_SUMMARY}
+    return {"summary": await summarize(request)}
+
+
+job_queue.register("submit_quiz", quiz_job)
+job_queue.register("summarize", summary_job)
+
+
+@app.post("/jobs/submit_quiz", status_code=202)
+async def submit_quiz_job(request: QuizSubmissionRequest):
+    """Queues /submit_quiz as a background job; poll GET /jobs/{job_id} for `{"results": ...}`."""
+    return queue_job("submit_quiz", request)
+
+
+@app.post("/jobs/summarize", status_code=202)
+async def summarize_job(request: ChatRequest):
+    """Queues /summarize as a background job; poll GET /jobs/{job_id} for `{"summary": ...}`."""
+    return queue_job("summarize", request)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """The job's `status` (queued, running, done or failed), plus its `result` once done or `error` once failed."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
@@ -0,0 +1,206 @@
+"""
+Prometheus-style metrics, served as text by GET /metrics.
+
+A small in-process registry (no client library needed) with counters and
+histograms, plus the counters the caches, admission control and resilience
+policy already keep, exported as gauges at scrape time.
+
+Each HTTP request also gets a breakdown of where its time went: waiting on the
+LLM (`llm`), assembling the prompt (`prompt`) and everything else (`other`:
+request parsing, session lookups, serialization). Speculative LLM calls running
+in the background aren't attributed to the request that happened to start them.
+"""
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: observations per bucket (the last one is +Inf), sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total[0])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "tutor_http_request_duration_seconds", "HTTP request latency, until the last byte of the response.",
+    ("method", "route", "status"))
+HTTP_REQUEST_PHASE_SECONDS = Histogram(
+    "tutor_http_request_phase_seconds", "Time each HTTP request spent waiting on the LLM, building prompts, or elsewhere.",
+    ("route", "phase"))
+HTTP_REQUEST_BYTES = Histogram(
+    "tutor_http_request_size_bytes", "HTTP request body size.", ("route",), BYTE_BUCKETS)
+HTTP_RESPONSE_BYTES = Histogram(
+    "tutor_http_response_size_bytes", "HTTP response body size.", ("route",), BYTE_BUCKETS)
+PROMPT_BUILD_SECONDS = Histogram(
+    "tutor_prompt_build_seconds", "Time spent fitting conversation history into a prompt.")
+LLM_QUEUE_SECONDS = Histogram(
+    "tutor_llm_queue_wait_seconds", "Time upstream calls waited for an admission slot.", ("priority",))
+LLM_REQUEST_SECONDS = Histogram(
+    "tutor_llm_request_duration_seconds", "Upstream LLM call latency, retries included.", ("priority", "kind"))
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "tutor_llm_time_to_first_token_seconds", "Time until a streamed LLM answer produced its first chunk.",
+    ("priority",))
+LLM_PROMPT_TOKENS = Histogram(
+    "tutor_llm_prompt_tokens", "Estimated tokens per prompt sent upstream.", ("priority",), TOKEN_BUCKETS)
+LLM_RESPONSE_TOKENS = Histogram(
+    "tutor_llm_response_tokens", "Estimated tokens per LLM answer.", ("priority",), TOKEN_BUCKETS)
+LLM_PROMPT_CHARS = Counter(
+    "tutor_llm_prompt_chars_total", "Characters sent upstream in prompts.", ("priority",))
+LLM_RESPONSE_CHARS = Counter(
+    "tutor_llm_response_chars_total", "Characters received from the LLM.", ("priority",))
+LLM_ERRORS = Counter(
+    "tutor_llm_errors_total", "Upstream LLM calls that failed, by error type.", ("priority", "error"))
+WS_FRAMES = Counter(
+    "tutor_ws_frames_total", "JSON frames exchanged on /ws/chat.", ("direction", "type"))
+WS_TURN_SECONDS = Histogram(
+    "tutor_ws_turn_duration_seconds", "Time from a /ws/chat frame arriving until its answer was sent.", ("type",))
+
+_METRICS = [value for value in list(globals().values()) if isinstance(value, (Counter, Histogram))]
+_stats_sources: Dict[str, Callable[[], Dict[str, object]]] = {}
+
+_request_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_phases", default=None)
+
+
+def register_stats(component: str, stats: Callable[[], Dict[str, object]]) -> None:
+    """Exports the numeric values of `stats()` as `tutor_<component>_<key>` gauges."""
+    _stats_sources[component] = stats
+
+
+def add_phase(phase: str, seconds: float) -> None:
+    """Attributes `seconds` of the current HTTP request to `phase`."""
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def render() -> str:
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    for component, stats in _stats_sources.items():
+        for key, value in stats().items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"tutor_{component}_{key}"
+            lines.extend([f"# HELP {name} {component} {key}, see GET /stats.", f"# TYPE {name} gauge",
+                          f"{name} {_number(value)}"])
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request and measuring its body sizes.
+    `on_request(method, route, status, seconds, request_bytes, response_bytes)`, if
+    given, is also called for each request, e.g. to keep latency records.
+    """
+
+    def __init__(self, app, on_request: Optional[Callable[..., None]] = None):
+        self.app = app
+        self.on_request = on_request
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        phases: Dict[str, float] = {}
+        token = _request_phases.set(phases)
+        started = time.perf_counter()
+        status = 500
+        sizes = {"request": 0, "response": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            _request_phases.reset(token)
+            elapsed = time.perf_counter() - started
+            # The route template rather than the path, so /sessions/{session_id} is one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status)
+            HTTP_REQUEST_BYTES.observe(sizes["request"], route=route)
+            HTTP_RESPONSE_BYTES.observe(sizes["response"], route=route)
+            accounted = 0.0
+            for phase in ("llm", "prompt"):
+                seconds = phases.get(phase, 0.0)
+                accounted += seconds
+                HTTP_REQUEST_PHASE_SECONDS.observe(seconds, route=route, phase=phase)
+            HTTP_REQUEST_PHASE_SECONDS.observe(max(elapsed - accounted, 0.0), route=route, phase="other")
+            if self.on_request is not None:
+                self.on_request(scope["method"], route, status, elapsed, sizes["request"], sizes["response"])
@@ -0,0 +1,237 @@
+"""
+Prompt assembly for every endpoint.
+
+Conversation history used to be appended message by message with no limit, so
+prompts grew with every turn until long sessions became slow, expensive and
+eventually too large for the model. All prompts are now built here, and the
+history part of each prompt is fitted into a token budget:
+
+- the instructions of the prompt are always kept as they are,
+- the most recent messages are kept verbatim,
+- older messages are replaced by the session's running summary when one covers
+  them, otherwise shortened to their first `PROMPT_COMPACT_CHARS` characters,
+- whatever still doesn't fit is dropped, oldest first.
+
+Tokens are estimated locally (roughly 4 characters per token), which is close
+enough to budget with and costs nothing.
+"""
+import math
+import os
+import re
+import time
+from typing import Dict, List
+
+import metrics
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_COMPACT_CHARS = int(os.environ.get("PROMPT_COMPACT_CHARS", "200"))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count: words are split into ~4 character pieces, punctuation counts as one."""
+    return sum(math.ceil(len(piece) / 4) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def _compact(line: str) -> str:
+    if len(line) <= PROMPT_COMPACT_CHARS:
+        return line
+    return line[:PROMPT_COMPACT_CHARS].rstrip() + " [...]\n"
+
+
+def format_history(history: List[Dict[str, str]], budget: int, summary: str = "", summarized: int = 0) -> str:
+    """
+    Renders the conversation as `role: content` lines using at most ~`budget` tokens.
+    `summary` is a running summary of the first `summarized` messages, used in their
+    place when the whole history doesn't fit.
+    """
+    lines = [f"{message['role']}: {message['content']}\n" for message in history]
+    costs = [count_tokens(line) for line in lines]
+    if sum(costs) <= budget:
+        return "".join(lines)
+
+    summary_block = f"Summary of the earlier conversation:\n{summary}\n\n" if summary and summarized else ""
+    remaining = budget - count_tokens(summary_block)
+    if remaining <= 0:
+        summary_block, remaining = "", budget
+
+    # Most recent messages verbatim. The latest one is always included, cut down if it alone is over budget.
+    start = len(lines)
+    while start > 0 and costs[start - 1] <= remaining:
+        start -= 1
+        remaining -= costs[start]
+    if start == len(lines):
+        start -= 1
+        lines[start] = lines[start][:max(remaining, 1) * 4] + " [...]\n"
+        remaining = 0
+    recent = lines[start:]
+
+    # Older messages not covered by the summary, shortened, newest first while they fit
+    covered = min(summarized, start) if summary_block else 0
+    older = []
+    first_kept = start
+    while first_kept > covered:
+        line = _compact(lines[first_kept - 1])
+        cost = count_tokens(line)
+        if cost > remaining:
+            break
+        older.append(line)
+        remaining -= cost
+        first_kept -= 1
+    older.reverse()
+
+    parts = [summary_block]
+    if first_kept > covered:
+        parts.append(f"({first_kept - covered} earlier messages omitted)\n")
+    return "".join(parts + older + recent)
+
+
+def _with_history(instructions: str, history: List[Dict[str, str]], closing: str = "",
+                  summary: str = "", summarized: int = 0) -> str:
+    started = time.perf_counter()
+    budget = PROMPT_TOKEN_BUDGET - count_tokens(instructions) - count_tokens(closing)
+    prompt = "".join([instructions, format_history(history, max(budget, 0), summary, summarized), closing])
+    elapsed = time.perf_counter() - started
+    metrics.PROMPT_BUILD_SECONDS.observe(elapsed)
+    metrics.add_phase("prompt", elapsed)
+    return prompt
+
+
+def build_verify_code_prompt(code: str, history: List[Dict[str, str]], summary: str = "", summarized: int = 0,
+                             facts: List[str] = ()) -> str:
+    """`facts` are findings of the local static analysis (see `analysis`), listed so the model can build on them."""
+    facts_block = ""
+    if facts:
+        facts_block = "Static analysis already established (use these facts rather than re-deriving them):\n" + \
+            "".join(f"- {fact}\n" for fact in facts) + "\n"
+    instructions = f"""You are a \"Socratic TA\" helping a student with a coding problem.
+The student has submitted the following Python code:
+
+```python
+{code}
+```
+
+{facts_block}Your task is to review the code and provide constructive feedback without directly giving the solution.
+Focus on logical errors, inefficiencies, or areas where the code doesn't align with the problem's requirements.
+Ask leading questions to guide the student to discover and correct their own mistakes.
+Consider the following conversation history for context (if any):
+
+"""
+    closing = "\nBased on the above, please provide feedback on the student's submitted code using leading questions."
+    return _with_history(instructions, history, closing, summary, summarized)
+
+
+def build_test_cases_prompt(code: str, function: str, problem: str = "") -> str:
+    """Asks for test cases and an input generator for timing `function`, as JSON."""
+    task = f"The problem being solved: {problem}\n" if problem else \
+        "Infer what the function is meant to do from its name, parameters and code.\n"
+    return f"""You are writing tests for a student's solution to a coding problem.
+{task}
+```python
+{code}
+```
+
+Respond with only a JSON object, no explanations, with two keys:
+- "tests": 4 to 6 test cases for `{function}`, each {{"args": [positional arguments], "expected": correct return value}}, covering typical and edge cases. The expected values must be what a correct solution returns, even if the student's code gets them wrong.
+- "make_input": Python source defining `make_input(n)`, which returns the list of positional arguments for a valid input of size n, to measure how the running time grows. Use only the standard library.
+"""
+
+
+def build_quiz_prompt(topic: str, grade: str) -> str:
+    return f"""You are a Socratic TA creating a quiz for a student.
+Based on the topic: {topic} and grade level: {grade}, generate 3-5 short answer quiz questions.
+Provide only the questions and no answers. Format each question as a JSON object with a 'question' key.
+Respond with only a JSON array of these objects, without markdown or any other text, exactly in this form:
+[{{"question": "..."}}, {{"question": "..."}}]
+"""
+
+
+_QUIZ_FEEDBACK = """Identify areas where the student is lacking and suggest 2-3 specific topics or concepts they should review.\n
+Do not give direct answers but guide them with leading questions."""
+
+
+def _quiz_answers(questions: List[Dict[str, str]], answers: Dict[str, str]) -> str:
+    parts = []
+    for q_data in questions:
+        question = q_data["question"]
+        answer = answers.get(question, "No answer provided")
+        parts.append(f"\nQuestion: {question}\nStudent Answer: {answer}\n")
+    return "".join(parts)
+
+
+def build_submit_quiz_prompt(topic: str, questions: List[Dict[str, str]], answers: Dict[str, str],
+                             history: List[Dict[str, str]], summary: str = "", summarized: int = 0) -> str:
+    parts = [f"""You are a Socratic TA evaluating a student's quiz answers.
+Topic: {topic}
+Questions and provided answers:
+"""]
+    parts.append(_quiz_answers(questions, answers))
+    parts.append("""\nBased on these answers and the conversation history, provide constructive feedback.\n
+""" + _QUIZ_FEEDBACK)
+    return _with_history("".join(parts), history, summary=summary, summarized=summarized)
+
+
+def build_batch_submit_quiz_prompt(topic: str, questions: List[Dict[str, str]],
+                                   submissions: List[Dict[str, str]]) -> str:
+    """
+    Several students' answers to the same quiz in one prompt, each graded as by
+    `build_submit_quiz_prompt` (without conversation history). Asks for a JSON
+    array holding one feedback string per submission, in order.
+    """
+    parts = [f"""You are a Socratic TA evaluating the quiz answers of {len(submissions)} students, independently of each other.
+Topic: {topic}
+"""]
+    for number, answers in enumerate(submissions, 1):
+        parts.append(f"\n--- Student {number} ---\nQuestions and provided answers:\n")
+        parts.append(_quiz_answers(questions, answers))
+    parts.append("""\nFor each student, based only on their own answers, provide constructive feedback.\n
+""" + _QUIZ_FEEDBACK + f"""\n
+Respond with only a JSON array of {len(submissions)} strings, no explanations: the feedback for student 1, then student 2, and so on.""")
+    return "".join(parts)
+
+
+def build_chat_prompt(topic: str, history: List[Dict[str, str]], summary: str = "", summarized: int = 0) -> str:
+    instructions = f"""You are a "Socratic TA," a friendly and expert guide for a Data Structures and Algorithms course that specializes in {topic}.
+A student has given you a problem and is asking for help to build their intuition.
+Your goal is to guide them to the optimal solution by **asking a series of small, leading questions.**
+
+**Your Strict Rules:**
+1.  **NEVER** give the final answer or the optimal code. Your purpose is to make the student *think*.
+2.  **ALWAYS** respond with only **one** small, leading question at a time to guide them.
+3.  Start by guiding them to a simple brute-force solution (e.g., "How would you solve this if you had no concerns about speed?").
+4.  Once they have a brute-force idea, ask questions to help them identify the *bottleneck* or *inefficiency* (e.g., "What is the time complexity of that? Can we do better?").
+5.  Use their answers to guide them, step-by-step, toward the more optimal solution.
+6.  Be encouraging! Use phrases like "Exactly!", "That's a great observation.", "You're on the right track."
+7.  If the student says that "they are not sure" or "they do not know the answer" to your given hints and help **DO not** start explaining the problem from the start
+8.  If the student says that "i have understood the concept" you can stop explaining
+
+You are currently in a conversation with the student. Here is the full chat history.
+Formulate your *next* guiding question based on this history.
+
+"""
+    if not history:
+        history = [{"role": "user", "content": f"Hello! I want to talk about {topic}."}]
+    return _with_history(instructions, history, summary=summary, summarized=summarized)
+
+
+def build_end_conversation_prompt(topic: str, history: List[Dict[str, str]], summary: str = "", summarized: int = 0) -> str:
+    return _with_history(f"Please summarize the following conversation about {topic}:\n\n", history,
+                         summary=summary, summarized=summarized)
+
+
+def build_summarize_prompt(topic: str, history: List[Dict[str, str]], summary: str = "", summarized: int = 0) -> str:
+    instructions = f"You are a summarization assistant. Summarize the conversation history in the simplest manner possible with respect to the topic {topic}. Highlight important concepts and learning tips for the " \
+        "student." \
+        "Restrict yourself from using any bold words.\n\n"
+    return _with_history(instructions, history, summary=summary, summarized=summarized)
+
+
+def build_fold_prompt(topic: str, summary: str, new_messages: List[Dict[str, str]]) -> str:
+    """Prompt asking the model to extend a running summary with the messages exchanged since."""
+    instructions = f"You are a summarization assistant. Below is the running summary of a tutoring conversation about the topic {topic}, " \
+        "followed by the messages exchanged since it was written. Rewrite the summary so it also covers the new messages, " \
+        "in the simplest manner possible. Highlight important concepts and learning tips for the student. " \
+        "Restrict yourself from using any bold words.\n\n" \
+        f"Running summary:\n{summary or '(nothing summarized yet)'}\n\nNew messages:\n"
+    return _with_history(instructions, new_messages)
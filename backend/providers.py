@@ -0,0 +1,201 @@
+"""
+LLM providers behind the call layer in `llm`.
+
+Every endpoint reaches the model through an `LLMProvider`, picked with the
+`LLM_PROVIDER` env var:
+- `gemini` (default): Google Gemini (`GEMINI_MODEL`, key from `GEMINI_API_KEY`).
+- `fake`: a deterministic local model with configurable latency, token rate,
+  chunking and failure rate (`FAKE_LLM_*` env vars), for running the whole
+  backend and its benchmarks offline, without an API key.
+
+Providers only implement the blocking `generate_sync` / `stream_sync` calls; the
+async `generate` / `stream` counterparts run them on a bounded thread pool so
+the event loop keeps serving other students meanwhile.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Optional
+
+from resilience import TransientLLMError
+
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "gemini")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+# Maximum number of blocking model calls that can be in flight at once per worker.
+LLM_MAX_WORKERS = int(os.environ.get("LLM_MAX_WORKERS", "32"))
+
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.2"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.environ.get("FAKE_LLM_TOKENS_PER_SECOND", "0"))
+FAKE_LLM_FAILURE_RATE = float(os.environ.get("FAKE_LLM_FAILURE_RATE", "0"))
+FAKE_LLM_SEED = int(os.environ.get("FAKE_LLM_SEED", "0"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm")
+
+
+class LLMProvider:
+    name = "base"
+
+    def generate_sync(self, prompt: str) -> str:
+        """Blocking call returning the whole answer."""
+        raise NotImplementedError
+
+    def stream_sync(self, prompt: str) -> Iterator[str]:
+        """Blocking iterator over the answer's chunks as the model produces them."""
+        raise NotImplementedError
+
+    def warm_up(self) -> None:
+        """Blocking call opening the connection to the model ahead of the first prompt; nothing by default."""
+
+    async def generate(self, prompt: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, self.generate_sync, prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        The blocking iteration over `stream_sync` runs on the thread pool and hands
+        each chunk back to the event loop through a queue. When the consumer stops
+        early, the thread stops at the next chunk instead of reading the rest of the
+        answer from the model.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            chunks = None
+            try:
+                chunks = self.stream_sync(prompt)
+                for text in chunks:
+                    if stop.is_set():
+                        break
+                    if text:
+                        loop.call_soon_threadsafe(queue.put_nowait, text)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                # Ends a generator over the model's response right away instead of when it is collected
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(_executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+        await producer
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL, api_key: Optional[str] = None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
+        self._genai = genai
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate_sync(self, prompt: str) -> str:
+        return self.model.generate_content(prompt).text
+
+    def stream_sync(self, prompt: str) -> Iterator[str]:
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text
+
+    def warm_up(self) -> None:
+        # Looking the model up sets up the client and its connection without spending generation quota
+        self._genai.get_model(f"models/{self.model_name}")
+
+
+class FakeProvider(LLMProvider):
+    """
+    Local stand-in for Gemini. It blocks like a real network call, so it goes
+    through the same thread pool, and the same seed always gives the same
+    sequence of latencies and failures.
+    """
+    name = "fake"
+
+    def __init__(self, latency: float = FAKE_LLM_LATENCY, tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+                 chunk_tokens: int = 1, jitter: float = 0.0, slow_rate: float = 0.0, slow_latency: float = 2.0,
+                 failure_rate: float = FAKE_LLM_FAILURE_RATE, seed: int = FAKE_LLM_SEED, answer: Optional[str] = None):
+        """
+        latency: seconds until the first token, plus up to `jitter` extra seconds.
+        tokens_per_second: generation speed after the first token; 0 means instant.
+        chunk_tokens: tokens (words) per streamed chunk.
+        slow_rate: fraction of calls whose first token takes `slow_latency` seconds instead.
+        failure_rate: fraction of calls that fail with a transient error.
+        answer: fixed answer text; by default a short Socratic question mentioning the prompt size.
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.answer = answer
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _start(self, prompt: str) -> str:
+        """Counts the call, waits for the first token or fails, and returns the answer."""
+        with self._lock:
+            self.calls += 1
+            slow = self._random.random() < self.slow_rate
+            fail = self._random.random() < self.failure_rate
+            delay = self.slow_latency if slow else self.latency + self._random.random() * self.jitter
+        time.sleep(delay)
+        if fail:
+            raise TransientLLMError("injected upstream failure")
+        return self.respond(prompt)
+
+    def respond(self, prompt: str) -> str:
+        """The answer text for `prompt`; override to shape answers per prompt."""
+        return self.answer or f"What would a brute-force approach look like? ({len(prompt)} chars)"
+
+    def _chunks(self, answer: str) -> Iterator[str]:
+        words = answer.split()
+        for i in range(0, len(words), self.chunk_tokens):
+            piece = words[i:i + self.chunk_tokens]
+            if self.tokens_per_second:
+                time.sleep(len(piece) / self.tokens_per_second)
+            yield " ".join(piece) + " "
+
+    def generate_sync(self, prompt: str) -> str:
+        return "".join(self._chunks(self._start(prompt))).rstrip()
+
+    def stream_sync(self, prompt: str) -> Iterator[str]:
+        return self._chunks(self._start(prompt))
+
+
+def config_problems() -> List[str]:
+    """What is missing from the configuration of the `LLM_PROVIDER` provider, without building it."""
+    if LLM_PROVIDER == "gemini":
+        return [] if os.environ.get("GEMINI_API_KEY") else ["GEMINI_API_KEY is not set"]
+    if LLM_PROVIDER == "fake":
+        return []
+    return [f"Unknown LLM_PROVIDER: {LLM_PROVIDER}"]
+
+
+def get_provider() -> LLMProvider:
+    """Builds the provider configured through `LLM_PROVIDER`."""
+    if LLM_PROVIDER == "gemini":
+        return GeminiProvider()
+    if LLM_PROVIDER == "fake":
+        return FakeProvider()
+    raise ValueError(f"Unknown LLM_PROVIDER: {LLM_PROVIDER}")
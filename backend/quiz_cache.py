@@ -0,0 +1,111 @@
+"""
+Response cache for /generate_quiz.
+
+The quiz prompt only depends on the topic and the grade level, so students of
+the same cohort pasting the same problem would otherwise each pay a full Gemini
+round-trip for an equivalent quiz. Every (topic, grade) key holds a pool of up to
+`QUIZ_CACHE_VARIANTS` distinct quizzes: until the pool is full each request
+generates a new variant, afterwards requests are served a random one from it.
+
+The in-process tier is an LRU with a TTL. Setting `QUIZ_CACHE_DB_PATH` (or
+`SHARED_STATE_PATH`, see `shared`) adds a SQLite tier behind it, shared by every
+uvicorn worker on the host. A pool that isn't full yet is re-read from it, so
+the variants other workers generated are used instead of generating more.
+"""
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from cachetools import TTLCache
+
+from shared import SHARED_STATE_PATH
+
+QUIZ_CACHE_SIZE = int(os.environ.get("QUIZ_CACHE_SIZE", "1024"))
+QUIZ_CACHE_TTL_SECONDS = int(os.environ.get("QUIZ_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+QUIZ_CACHE_VARIANTS = int(os.environ.get("QUIZ_CACHE_VARIANTS", "3"))
+QUIZ_CACHE_DB_PATH = os.environ.get("QUIZ_CACHE_DB_PATH") or SHARED_STATE_PATH
+
+
+def quiz_key(topic: str, grade: str) -> str:
+    """Hash of the topic and grade with case and whitespace differences normalized away."""
+    normalized = json.dumps([" ".join(topic.lower().split()), " ".join(grade.lower().split())])
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class QuizCache:
+    def __init__(self, maxsize: int = QUIZ_CACHE_SIZE, ttl_seconds: int = QUIZ_CACHE_TTL_SECONDS,
+                 variants: int = QUIZ_CACHE_VARIANTS, db_path: Optional[str] = QUIZ_CACHE_DB_PATH):
+        self.ttl_seconds = ttl_seconds
+        self.variants = variants
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            with self._db:
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS quiz_variants ("
+                    "key TEXT NOT NULL, questions TEXT NOT NULL, created REAL NOT NULL, "
+                    "PRIMARY KEY (key, questions))")
+                self._db.execute("CREATE INDEX IF NOT EXISTS quiz_variants_created ON quiz_variants (created)")
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _pool(self, key: str) -> List[str]:
+        pool = self._local.get(key)
+        if pool is None or (len(pool) < self.variants and self._db is not None):
+            pool = []
+            if self._db is not None:
+                rows = self._db.execute(
+                    "SELECT questions FROM quiz_variants WHERE key = ? AND created > ? ORDER BY created",
+                    (key, time.time() - self.ttl_seconds)).fetchall()
+                pool = [questions for questions, in rows]
+            self._local[key] = pool
+        return pool
+
+    def get(self, key: str) -> Optional[List[Dict[str, str]]]:
+        """Returns a random cached variant once the key's pool is full, None if another variant should be generated."""
+        in_memory = key in self._local
+        pool = self._pool(key)
+        if len(pool) < self.variants:
+            self.misses += 1
+            return None
+        if in_memory:
+            self.hits += 1
+        else:
+            self.persistent_hits += 1
+        return json.loads(random.choice(pool))
+
+    def put(self, key: str, questions: List[Dict[str, str]]) -> None:
+        encoded = json.dumps(questions, sort_keys=True)
+        pool = self._pool(key)
+        if encoded in pool or len(pool) >= self.variants:
+            return
+        pool.append(encoded)
+        if self._db is not None:
+            now = time.time()
+            with self._db:
+                self._db.execute("INSERT OR IGNORE INTO quiz_variants (key, questions, created) VALUES (?, ?, ?)",
+                                 (key, encoded, now))
+                # Expired variants are never read again; without this the file only grows
+                self.evicted += self._db.execute("DELETE FROM quiz_variants WHERE created <= ?",
+                                                 (now - self.ttl_seconds,)).rowcount
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+            "keys": len(self._local),
+            "max_keys": self._local.maxsize,
+            "variants_per_key": self.variants,
+            "evicted": self.evicted,
+        }
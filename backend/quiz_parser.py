@@ -0,0 +1,152 @@
+"""
+Parsing of the quiz questions the model writes.
+
+The quiz prompt asks for a JSON array of `{"question": ...}` objects, but the
+model sometimes wraps it in a markdown fence, leaves a trailing comma, uses
+single quotes, or stops mid-way. Instead of giving up (and making the student
+generate the quiz again, another full LLM call), near-valid output is repaired
+locally.
+
+`QuestionStream` parses the array incrementally while the answer streams in and
+hands out each question as soon as its object is complete, so the first question
+can be shown while the model is still writing the last one. It also serves as
+the repair for truncated output: the questions that were completed are kept.
+"""
+import ast
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+
+Question = Dict[str, str]
+
+parse_stats = {"parsed": 0, "repaired": 0, "failed": 0}
+
+
+def _question(value: Any) -> Optional[Question]:
+    """A question in the `{"question": ...}` shape the endpoints use, or None."""
+    if isinstance(value, str) and value.strip():
+        return {"question": value.strip()}
+    if isinstance(value, dict) and isinstance(value.get("question"), str) and value["question"].strip():
+        return value
+    return None
+
+
+def _questions(value: Any) -> List[Question]:
+    if isinstance(value, dict):
+        # {"questions": [...]}, or a single question
+        value = value.get("questions", [value])
+    if not isinstance(value, list):
+        return []
+    return [question for question in map(_question, value) if question is not None]
+
+
+def _strip_fence(text: str) -> str:
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def _loads_lenient(text: str) -> Any:
+    """json.loads, then without trailing commas, then as a Python literal (single quotes); raises ValueError."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError("not JSON")
+
+
+class QuestionStream:
+    """Incremental parser of a JSON array of questions, fed the model's answer chunk by chunk."""
+
+    def __init__(self):
+        self.text = ""
+        self.questions: List[Question] = []
+        self._position = 0
+        self._depth = 0
+        # Nesting depth of the question array once its `[` was seen
+        self._array: Optional[int] = None
+        self._in_string = False
+        self._escaped = False
+        # Start of the array element being read
+        self._start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Question]:
+        """Adds a chunk of the answer and returns the questions it completed."""
+        self.text += chunk
+        found = []
+        text = self.text
+        for i in range(self._position, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._start is not None and self._depth == self._array:
+                        found.extend(self._element(text[self._start:i + 1]))
+                continue
+            if c == '"':
+                self._in_string = True
+                if self._array is not None and self._depth == self._array and self._start is None:
+                    self._start = i
+            elif c in "[{":
+                self._depth += 1
+                if c == "[" and self._array is None:
+                    self._array = self._depth
+                elif self._array is not None and self._depth == self._array + 1 and self._start is None:
+                    self._start = i
+            elif c in "]}":
+                if c == "}" and self._start is not None and self._depth == self._array + 1:
+                    found.extend(self._element(text[self._start:i + 1]))
+                self._depth -= 1
+        self._position = len(text)
+        self.questions.extend(found)
+        return found
+
+    def _element(self, text: str) -> List[Question]:
+        self._start = None
+        try:
+            question = _question(_loads_lenient(text))
+        except ValueError:
+            return []
+        return [question] if question is not None else []
+
+
+def parse_quiz(text: str) -> Optional[List[Question]]:
+    """
+    The questions in the model's complete answer, repairing near-valid JSON;
+    None if there is nothing usable in it.
+    """
+    body = _strip_fence(text)
+    try:
+        questions = _questions(json.loads(body))
+        if questions:
+            parse_stats["parsed"] += 1
+            return questions
+    except json.JSONDecodeError:
+        pass
+    start = min((i for i in (body.find("["), body.find("{")) if i >= 0), default=-1)
+    questions = []
+    if start >= 0:
+        try:
+            questions = _questions(_loads_lenient(body[start:]))
+        except ValueError:
+            # Truncated or otherwise broken: keep the questions that were complete
+            stream = QuestionStream()
+            stream.feed(body)
+            questions = stream.questions
+    if not questions:
+        parse_stats["failed"] += 1
+        return None
+    parse_stats["repaired"] += 1
+    return questions
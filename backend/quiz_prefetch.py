@@ -0,0 +1,127 @@
+"""
+Speculative quiz generation.
+
+Students usually open the quiz tab after discussing a problem, so as soon as the
+first /chat for a new topic arrives the quizzes for every grade level are
+generated in the background. /generate_quiz then hands out a ready quiz instead
+of making the student wait for Gemini.
+
+Speculative work is capped at `QUIZ_PREFETCH_CONCURRENCY` concurrent calls so it
+never crowds out interactive requests, and unclaimed quizzes are dropped after
+`QUIZ_PREFETCH_TTL_SECONDS` or when the pool exceeds `QUIZ_PREFETCH_POOL_SIZE` keys.
+A request for a quiz still being prefetched waits at most `QUIZ_PREFETCH_WAIT_SECONDS`
+for it, and only once its generation has started; otherwise it generates its own
+quiz and the prefetched one is kept for the next request.
+
+Prefetched quizzes and the topics already prefetched are kept in a `SharedState`,
+so with several workers a topic is prefetched by one of them and its quizzes can
+be claimed through any of them.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from quiz_cache import quiz_key
+from shared import InMemorySharedState, SharedState
+
+QUIZ_PREFETCH_ENABLED = os.environ.get("QUIZ_PREFETCH_ENABLED", "1") == "1"
+QUIZ_PREFETCH_CONCURRENCY = int(os.environ.get("QUIZ_PREFETCH_CONCURRENCY", "2"))
+QUIZ_PREFETCH_POOL_SIZE = int(os.environ.get("QUIZ_PREFETCH_POOL_SIZE", "256"))
+QUIZ_PREFETCH_TTL_SECONDS = int(os.environ.get("QUIZ_PREFETCH_TTL_SECONDS", str(60 * 60)))
+QUIZ_PREFETCH_WAIT_SECONDS = float(os.environ.get("QUIZ_PREFETCH_WAIT_SECONDS", "5"))
+
+GRADES = ["High School", "Undergraduate", "Graduate"]
+
+Quiz = List[Dict[str, str]]
+
+
+class QuizPrefetcher:
+    def __init__(self, produce: Callable[[str, str], Awaitable[Optional[Quiz]]],
+                 concurrency: int = QUIZ_PREFETCH_CONCURRENCY, pool_size: int = QUIZ_PREFETCH_POOL_SIZE,
+                 ttl_seconds: int = QUIZ_PREFETCH_TTL_SECONDS, enabled: bool = QUIZ_PREFETCH_ENABLED,
+                 state: Optional[SharedState] = None, wait_seconds: float = QUIZ_PREFETCH_WAIT_SECONDS):
+        """
+        `produce(topic, grade)` generates one quiz, returning None if the model's output was unusable.
+        `state` holds the prefetched quizzes; by default they are kept in this worker.
+        """
+        self.produce = produce
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Ready quizzes under "quiz_prefetch", and under "quiz_prefetch_topic" the topics already
+        # prefetched, so later turns of the same conversation don't trigger it again
+        self.state = state if state is not None else InMemorySharedState(maxsize=pool_size * 2)
+        self._pending: Dict[str, asyncio.Task] = {}
+        # Keys of the pending prefetches past the concurrency cap, i.e. generating
+        self._started: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.gave_up = 0
+
+    def prefetch(self, topic: str) -> None:
+        """Starts generating quizzes for every grade level of `topic` in the background."""
+        if not self.enabled:
+            return
+        if not self.state.add("quiz_prefetch_topic", quiz_key(topic, ""), True, self.ttl_seconds):
+            return
+        for grade in GRADES:
+            key = quiz_key(topic, grade)
+            if key not in self._pending:
+                self._pending[key] = asyncio.create_task(self._run(key, topic, grade))
+
+    async def _run(self, key: str, topic: str, grade: str) -> None:
+        try:
+            async with self._semaphore:
+                self._started.add(key)
+                quiz = await self.produce(topic, grade)
+            if quiz is not None:
+                self.state.set("quiz_prefetch", key, quiz, self.ttl_seconds)
+        except Exception as e:
+            print(f"Error during quiz prefetch: {e}")
+        finally:
+            self._started.discard(key)
+            self._pending.pop(key, None)
+
+    def pending(self, topic: str) -> List[asyncio.Task]:
+        """The prefetches of `topic` still running."""
+        return [task for grade in GRADES if (task := self._pending.get(quiz_key(topic, grade))) is not None]
+
+    def ready_grades(self, topic: str) -> List[str]:
+        """The grade levels of `topic` with a prefetched quiz waiting to be claimed."""
+        return [grade for grade in GRADES if self.state.get("quiz_prefetch", quiz_key(topic, grade)) is not None]
+
+    async def take(self, topic: str, grade: str) -> Optional[Quiz]:
+        """
+        Claims the prefetched quiz for (topic, grade), waiting up to `wait_seconds` for
+        it if it is being generated. Returns None if nothing was prefetched, or it
+        isn't ready in time; the caller then generates the quiz itself.
+        """
+        key = quiz_key(topic, grade)
+        pending = self._pending.get(key)
+        if pending is not None:
+            # A prefetch still queued behind the others could take minutes, and the student is waiting
+            if key not in self._started:
+                self.gave_up += 1
+                self.misses += 1
+                return None
+            try:
+                await asyncio.wait_for(asyncio.shield(pending), self.wait_seconds)
+            except asyncio.TimeoutError:
+                self.gave_up += 1
+                self.misses += 1
+                return None
+        quiz = self.state.pop("quiz_prefetch", key)
+        if quiz is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return quiz
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending": len(self._pending),
+            "gave_up": self.gave_up,
+        }
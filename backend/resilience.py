@@ -0,0 +1,267 @@
+"""
+Retry, timeout, circuit breaker and hedging policy for upstream LLM calls.
+
+- Every call has a deadline that depends on the priority class of the endpoint
+  it serves (see `LLM_DEADLINES`, overridable with `LLM_DEADLINE_<PRIORITY>` env
+  vars, e.g. `LLM_DEADLINE_INTERACTIVE` for /chat).
+- Transient failures (timeouts, connection errors, Gemini 429/5xx) are retried
+  with jittered exponential backoff through tenacity until the deadline or
+  `LLM_MAX_ATTEMPTS` is reached.
+- After `LLM_BREAKER_THRESHOLD` consecutive failures the circuit opens and calls
+  fail fast with a 503 for `LLM_BREAKER_RESET_SECONDS`, then a single trial call
+  decides whether it closes again.
+- With `LLM_HEDGE=1`, a call still running after the observed p95 latency gets a
+  second, identical call fired next to it and whichever answers first wins.
+  This trades a little extra upstream usage for a much shorter tail.
+
+Streams are only retried until their first chunk arrives; after that the
+answer is already on its way to the student.
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, stop_after_delay, \
+    wait_random_exponential
+
+from admission import Overloaded, Priority
+
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_STREAM_IDLE_SECONDS = float(os.environ.get("LLM_STREAM_IDLE_SECONDS", "30"))
+
+# Seconds an upstream call may take, retries included, by the priority of the endpoint it serves
+LLM_DEADLINES = {
+    priority: float(os.environ.get(f"LLM_DEADLINE_{priority.name}", default))
+    for priority, default in {
+        Priority.INTERACTIVE: 30,
+        Priority.REVIEW: 60,
+        Priority.BATCH: 90,
+        Priority.SPECULATIVE: 120,
+    }.items()
+}
+
+_TRANSIENT_GOOGLE_ERRORS = ("TooManyRequests", "ResourceExhausted", "InternalServerError", "BadGateway",
+                            "ServiceUnavailable", "GatewayTimeout", "DeadlineExceeded")
+
+
+class TransientLLMError(Exception):
+    """Raised by model implementations for failures worth retrying."""
+
+
+def _google_errors() -> tuple:
+    # Only the Gemini SDK raises these, so until it was imported (lazily, by the
+    # provider) there is nothing to match and no reason to pay for importing it here
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    if google_exceptions is None:
+        return ()
+    return tuple(getattr(google_exceptions, name) for name in _TRANSIENT_GOOGLE_ERRORS)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether retrying the call may succeed."""
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError, TransientLLMError) + _google_errors())
+
+
+class CircuitOpen(Overloaded):
+    def __init__(self, retry_after: int):
+        super().__init__(503, retry_after, "The tutor is temporarily unavailable, please try again shortly.")
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half-open"
+
+    def check(self) -> None:
+        """Raises `CircuitOpen` unless the call may go ahead."""
+        state = self.state
+        if state == "open":
+            raise CircuitOpen(max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at))))
+        if state == "half-open":
+            if self._trial_running:
+                raise CircuitOpen(1)
+            self._trial_running = True
+
+    def reject_if_open(self) -> None:
+        """Like `check`, but without claiming the half-open trial; for failing fast before queueing."""
+        if self.state == "open":
+            raise CircuitOpen(max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at))))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def abandon_trial(self) -> None:
+        """Lets another call try again when the half-open trial call was cancelled."""
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_running or self.failures >= self.threshold:
+            if self.opened_at is None or self._trial_running:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class LatencyTracker:
+    """Keeps recent upstream latencies to derive the hedging delay from."""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ResilientCaller:
+    def __init__(self, hedge: bool = LLM_HEDGE, max_attempts: int = LLM_MAX_ATTEMPTS):
+        self.hedge = hedge
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _retrying(self, deadline: float) -> AsyncRetrying:
+        return AsyncRetrying(
+            stop=stop_after_attempt(self.max_attempts) | stop_after_delay(deadline),
+            wait=wait_random_exponential(multiplier=0.5, max=8),
+            retry=retry_if_exception(is_transient),
+            before_sleep=self._count_retry,
+            reraise=True,
+        )
+
+    def _count_retry(self, retry_state) -> None:
+        self.retries += 1
+
+    async def _attempt(self, call: Callable[[], Awaitable[str]], timeout: float, hedge: bool = True):
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._hedged(call) if hedge else call(), timeout=max(timeout, 0.001))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.abandon_trial()
+            raise
+        except Exception as e:
+            # Only transient errors say something about upstream health; anything else
+            # (e.g. a blocked prompt) means Gemini did answer.
+            if is_transient(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, call: Callable[[], Awaitable[str]]) -> str:
+        delay = self.latency.percentile(0.95) if self.hedge else None
+        if delay is None:
+            return await call()
+        first = asyncio.ensure_future(call())
+        second = None
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges += 1
+                second = asyncio.ensure_future(call())
+                tasks.add(second)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Every call failed; surface the original call's error
+            return first.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, call: Callable[[], Awaitable[str]], deadline: float) -> str:
+        """Runs `call()` with the retry, timeout, breaker and hedging policy."""
+        self.breaker.check()
+        started = time.monotonic()
+        async for attempt in self._retrying(deadline):
+            with attempt:
+                return await self._attempt(call, deadline - (time.monotonic() - started))
+
+    async def stream(self, call: Callable[[], AsyncIterator[str]], deadline: float) -> AsyncIterator[str]:
+        """Streaming counterpart of `call`; retries only happen before the first chunk."""
+        self.breaker.check()
+        started = time.monotonic()
+        chunks = first = None
+        async for attempt in self._retrying(deadline):
+            with attempt:
+                chunks = call()
+                try:
+                    first = await self._attempt(lambda: self._first_chunk(chunks),
+                                                deadline - (time.monotonic() - started), hedge=False)
+                except BaseException:
+                    await chunks.aclose()
+                    raise
+        if first is None:
+            return
+        yield first
+        while True:
+            try:
+                text = await asyncio.wait_for(chunks.__anext__(), timeout=LLM_STREAM_IDLE_SECONDS)
+            except StopAsyncIteration:
+                return
+            yield text
+
+    @staticmethod
+    async def _first_chunk(chunks: AsyncIterator[str]) -> Optional[str]:
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def stats(self) -> Dict[str, object]:
+        p95 = self.latency.percentile(0.95)
+        return {
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedging": self.hedge,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95_seconds": p95,
+        }
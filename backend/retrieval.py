@@ -0,0 +1,140 @@
+"""
+Relevance-based selection of conversation history.
+
+A code review or quiz grading only needs the few turns that talk about the same
+thing as the code or the quiz, not the whole transcript. For histories longer
+than `RETRIEVAL_MIN_MESSAGES`, the prompts of /verify_code and /submit_quiz get:
+- the first message (the problem statement),
+- the `RETRIEVAL_RECENT_MESSAGES` most recent messages,
+- the `RETRIEVAL_TOP_K` other messages most similar to the code or quiz,
+in their original order.
+
+Similarity is TF-IDF cosine over hashed word features, computed with NumPy in
+the worker; nothing leaves the process. Each session's index is built
+incrementally (the session log is append-only), so a turn only vectorizes the
+messages added since the last call.
+"""
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+
+RETRIEVAL_ENABLED = os.environ.get("RETRIEVAL_ENABLED", "1") == "1"
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "6"))
+RETRIEVAL_RECENT_MESSAGES = int(os.environ.get("RETRIEVAL_RECENT_MESSAGES", "6"))
+RETRIEVAL_MIN_MESSAGES = int(os.environ.get("RETRIEVAL_MIN_MESSAGES", "16"))
+RETRIEVAL_INDEX_SIZE = int(os.environ.get("RETRIEVAL_INDEX_SIZE", "1024"))
+RETRIEVAL_INDEX_TTL_SECONDS = int(os.environ.get("RETRIEVAL_INDEX_TTL_SECONDS", str(60 * 60)))
+
+# Number of hashed features (a power of two); collisions only blur the scores slightly
+FEATURES = 1 << 16
+
+# Lowercased, so `two_sum` and `twoSum` both contribute `two` and `sum`
+_WORD = re.compile(r"[a-z0-9]+")
+_CAMEL = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def features(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed word features of `text` and their sublinear term frequencies (1 + log count)."""
+    words = _WORD.findall(_CAMEL.sub(" ", text).lower())
+    if not words:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    hashed = np.fromiter((zlib.crc32(word.encode("utf-8")) & (FEATURES - 1) for word in words),
+                         dtype=np.int64, count=len(words))
+    indices, counts = np.unique(hashed, return_counts=True)
+    return indices, 1.0 + np.log(counts)
+
+
+class HistoryIndex:
+    """TF-IDF index over the messages of one conversation, extended as the conversation grows."""
+
+    def __init__(self):
+        self.size = 0
+        self._indices: List[np.ndarray] = []
+        self._weights: List[np.ndarray] = []
+        # Concatenated view of the above, rebuilt after an update
+        self._flat: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def update(self, history: List[Dict[str, str]]) -> None:
+        for message in history[self.size:]:
+            indices, weights = features(message["content"])
+            self._indices.append(indices)
+            self._weights.append(weights)
+        if len(history) > self.size:
+            self.size = len(history)
+            self._flat = None
+
+    def scores(self, query: str) -> np.ndarray:
+        """Cosine similarity of `query` to every indexed message."""
+        if self._flat is None:
+            lengths = [len(indices) for indices in self._indices]
+            self._flat = (np.concatenate(self._indices), np.concatenate(self._weights),
+                          np.repeat(np.arange(self.size), lengths))
+        indices, weights, messages = self._flat
+        query_indices, query_weights = features(query)
+        if not len(indices) or not len(query_indices):
+            return np.zeros(self.size)
+        # Feature indices are unique per message, so counting them gives document frequencies
+        df = np.bincount(indices, minlength=FEATURES)
+        idf = np.log((1 + self.size) / (1 + df)) + 1
+        weighted = weights * idf[indices]
+        norms = np.sqrt(np.bincount(messages, weighted ** 2, minlength=self.size))
+        query_vector = np.zeros(FEATURES)
+        query_vector[query_indices] = query_weights * idf[query_indices]
+        dots = np.bincount(messages, weighted * query_vector[indices], minlength=self.size)
+        return dots / (np.maximum(norms, 1e-12) * np.linalg.norm(query_vector))
+
+
+class HistoryRetriever:
+    """Picks the messages worth sending with a prompt, keeping one index per session."""
+
+    def __init__(self, top_k: int = RETRIEVAL_TOP_K, recent: int = RETRIEVAL_RECENT_MESSAGES,
+                 min_messages: int = RETRIEVAL_MIN_MESSAGES, maxsize: int = RETRIEVAL_INDEX_SIZE,
+                 ttl_seconds: int = RETRIEVAL_INDEX_TTL_SECONDS, enabled: bool = RETRIEVAL_ENABLED):
+        self.top_k = top_k
+        self.recent = recent
+        self.min_messages = max(min_messages, top_k + recent + 1)
+        self.enabled = enabled
+        self._indexes: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self.selections = 0
+        self.messages_seen = 0
+        self.messages_kept = 0
+
+    def _index(self, history: List[Dict[str, str]], session_id: Optional[str]) -> HistoryIndex:
+        index = self._indexes.get(session_id) if session_id is not None else None
+        if index is None or index.size > len(history):
+            index = HistoryIndex()
+            if session_id is not None:
+                self._indexes[session_id] = index
+        index.update(history)
+        return index
+
+    def relevant(self, history: List[Dict[str, str]], query: str, session_id: Optional[str] = None) -> List[int]:
+        """Positions in `history` of the messages to keep for a prompt about `query`, in order."""
+        if not self.enabled or len(history) < self.min_messages:
+            return list(range(len(history)))
+        scores = self._index(history, session_id).scores(query)[:len(history)]
+        keep = {0, *range(len(history) - self.recent, len(history))}
+        added = 0
+        for position in np.argsort(-scores, kind="stable"):
+            if added >= self.top_k or scores[position] <= 0:
+                break
+            if position not in keep:
+                keep.add(int(position))
+                added += 1
+        self.selections += 1
+        self.messages_seen += len(history)
+        self.messages_kept += len(keep)
+        return sorted(keep)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "selections": self.selections,
+            "messages_seen": self.messages_seen,
+            "messages_kept": self.messages_kept,
+            "kept_ratio": self.messages_kept / self.messages_seen if self.messages_seen else 0.0,
+            "indexed_sessions": len(self._indexes),
+        }
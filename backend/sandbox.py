@@ -0,0 +1,488 @@
+"""
+Runs student code against test cases (/run_code, and /verify_code with `run_tests`).
+
+Running code is off unless `SANDBOX_ENABLED=1`, since the endpoints take code
+from anyone who can reach the backend.
+
+`SANDBOX_WORKERS` worker interpreters are started once and reused. Each run is
+forked off a warm worker, so it starts in milliseconds instead of paying for a
+new interpreter, runs in a clean process that can't affect later runs, and gets:
+- a wall-clock deadline of `SANDBOX_TIMEOUT_SECONDS` and a matching CPU limit,
+- an address-space limit of `SANDBOX_MEMORY_MB` on top of the worker's own,
+- no file writes, no stdin, and an environment without the backend's secrets,
+- a fresh empty directory it is chrooted into, so no file of the host (the
+  backend's `.env` or databases in particular) can be read or removed,
+- a network namespace of its own without interfaces, i.e. no network access,
+- no capabilities, no further processes and a handful of file descriptors,
+- the `nobody` user when the backend runs as root; otherwise the chroot is done
+  in a user namespace of its own, which needs unprivileged user namespaces.
+A run that can't be confined like that fails instead of running unconfined.
+Modules are looked up on disk, so only those the worker imported beforehand
+(`PRELOADED_MODULES`) can be imported by the code.
+
+Besides checking the test cases, a `make_input(n)` function can be given to time
+the code and measure its peak memory at growing input sizes (`SANDBOX_SIZES`),
+from which the empirical time and space complexity is estimated.
+
+Needs Linux.
+"""
+import asyncio
+import ctypes
+import io
+import json
+import math
+import os
+import queue
+import select
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SANDBOX_ENABLED = os.environ.get("SANDBOX_ENABLED", "0") == "1"
+SANDBOX_WORKERS = int(os.environ.get("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT_SECONDS = float(os.environ.get("SANDBOX_TIMEOUT_SECONDS", "5"))
+SANDBOX_MEMORY_MB = int(os.environ.get("SANDBOX_MEMORY_MB", "256"))
+SANDBOX_SIZES = [int(n) for n in os.environ.get("SANDBOX_SIZES", "100,1000,10000").split(",")]
+OUTPUT_LIMIT = 4096
+VALUE_LIMIT = 1000
+SMALL_PEAK_BYTES = 64 * 1024
+# File descriptors a run may have open; it starts with stdin, stdout, stderr and its result pipe
+FD_LIMIT = 8
+# Imported by the workers, as the code can't import anything from disk
+PRELOADED_MODULES = ["array", "bisect", "collections", "copy", "dataclasses", "decimal", "enum", "fractions",
+                     "functools", "heapq", "itertools", "math", "operator", "random", "re", "statistics",
+                     "string", "typing"]
+
+# Environment the workers run with; everything else (API keys in particular) is left out
+_WORKER_ENV = ("PATH", "LANG", "LC_ALL", "TMPDIR")
+
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+PR_SET_NO_NEW_PRIVS = 38
+_LINUX_CAPABILITY_VERSION_3 = 0x20080522
+NOBODY_ID = 65534
+_libc = ctypes.CDLL(None, use_errno=True) if sys.platform.startswith("linux") else None
+
+
+def available() -> bool:
+    return sys.platform.startswith("linux") and hasattr(os, "fork") and resource is not None
+
+
+# --- Inside the forked child -------------------------------------------------
+
+def _limit(memory_mb: int, timeout: float) -> None:
+    cpu = math.ceil(timeout) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    # Writing past the file size limit then raises an OSError instead of killing the process
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        current = 0
+    if current:
+        limit = current + memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class _CapHeader(ctypes.Structure):
+    _fields_ = [("version", ctypes.c_uint32), ("pid", ctypes.c_int)]
+
+
+class _CapData(ctypes.Structure):
+    _fields_ = [("effective", ctypes.c_uint32), ("permitted", ctypes.c_uint32), ("inheritable", ctypes.c_uint32)]
+
+
+def _libc_call(name: str, *args) -> None:
+    if getattr(_libc, name)(*args) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, f"{name}: {os.strerror(error)}")
+
+
+def _isolate(root: str) -> None:
+    """
+    Confines the child to `root`, an empty directory: chrooted, without network,
+    capabilities or further processes. Raises if any of it fails.
+    """
+    if os.geteuid() == 0:
+        _libc_call("unshare", CLONE_NEWNET)
+        os.chroot(root)
+        os.chdir("/")
+        os.setgroups([])
+        os.setgid(NOBODY_ID)
+        # Leaving uid 0 drops every capability
+        os.setuid(NOBODY_ID)
+    else:
+        # The new user namespace grants the capabilities to chroot and own a network namespace,
+        # which are then dropped; a chrooted process can't create another user namespace
+        _libc_call("unshare", CLONE_NEWUSER | CLONE_NEWNET)
+        os.chroot(root)
+        os.chdir("/")
+        header = _CapHeader(_LINUX_CAPABILITY_VERSION_3, 0)
+        data = (_CapData * 2)()
+        _libc_call("capset", ctypes.byref(header), data)
+    _libc_call("prctl", PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (FD_LIMIT, FD_LIMIT))
+    # Counted per user, and the child itself is one, so it can't fork or start threads
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+
+def _value(value):
+    """JSON-compatible version of a return value, as the test's `expected` would be written."""
+    encoded = json.dumps(value, default=repr)
+    if len(encoded) > VALUE_LIMIT:
+        return encoded[:VALUE_LIMIT] + "..."
+    return json.loads(encoded)
+
+
+def _describe(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+def _args(raw) -> list:
+    return list(raw) if isinstance(raw, (list, tuple)) else [raw]
+
+
+def _run_test(function, test: Dict) -> Dict:
+    args = _args(test.get("args", []))
+    entry = {"args": _value(args)}
+    if "expected" in test:
+        entry["expected"] = test["expected"]
+    started = time.perf_counter()
+    try:
+        output = _value(function(*args))
+    except Exception as e:
+        entry.update(seconds=time.perf_counter() - started, error=_describe(e), passed=False)
+        return entry
+    entry.update(seconds=time.perf_counter() - started, output=output)
+    if "expected" in test:
+        entry["passed"] = output == _value(test["expected"])
+    return entry
+
+
+def _measure(function, make_input, n: int) -> Dict:
+    """Best of three timed runs on fresh inputs of size `n`, then one traced run for peak memory."""
+    best = math.inf
+    for _ in range(3):
+        args = _args(make_input(n))
+        started = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - started)
+    args = _args(make_input(n))
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"n": n, "seconds": best, "peak_bytes": peak}
+
+
+def _affordable(scaling: List[Dict], n: int, budget: float) -> bool:
+    """
+    Whether measuring size `n` likely fits in `budget` seconds, extrapolating from
+    the sizes measured so far (quadratic growth until two sizes give a slope).
+    Skipping large sizes beats hitting the deadline and losing every measurement.
+    """
+    if not scaling:
+        return budget > 0
+    last = scaling[-1]
+    exponent = 2.0
+    if len(scaling) >= 2:
+        exponent = max(_slope([(point["n"], point["seconds"]) for point in scaling[-2:]]) or 0.0, 1.0)
+    # Three timed runs plus a traced one, which tracemalloc makes several times slower
+    return last["seconds"] * (n / last["n"]) ** exponent * 10 < budget
+
+
+def _execute(job: Dict) -> Dict:
+    output = io.StringIO()
+    sys.stdout = sys.stderr = output
+    result = {"status": "ok", "tests": [], "scaling": []}
+    try:
+        namespace = {"__name__": "__submission__"}
+        exec(compile(job["code"], "<submission>", "exec"), namespace)
+        function = namespace.get(job["function"]) if job.get("function") else None
+        if (job["tests"] or job.get("make_input")) and not callable(function):
+            raise NameError(f"function {job.get('function')!r} is not defined")
+        for test in job["tests"]:
+            result["tests"].append(_run_test(function, test))
+        if job.get("make_input"):
+            helpers = {}
+            exec(compile(job["make_input"], "<make_input>", "exec"), helpers)
+            started = time.monotonic()
+            for n in job["sizes"]:
+                if not _affordable(result["scaling"], n, job["timeout"] * 0.7 - (time.monotonic() - started)):
+                    break
+                result["scaling"].append(_measure(function, helpers["make_input"], n))
+    except BaseException as e:
+        result["status"] = "error"
+        result["error"] = _describe(e)
+    result["stdout"] = output.getvalue()[:OUTPUT_LIMIT]
+    return result
+
+
+def _run_forked(job: Dict) -> Dict:
+    """Forks a child that applies the limits and runs the job, and collects its result within the deadline."""
+    read_end, write_end = os.pipe()
+    root = tempfile.mkdtemp(prefix="sandbox-")
+    started = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_end)
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            # Only the standard streams and the result pipe stay open
+            os.dup2(write_end, 3)
+            write_end = 3
+            os.closerange(4, os.sysconf("SC_OPEN_MAX"))
+            _limit(job["memory_mb"], job["timeout"])
+            _isolate(root)
+            data = json.dumps(_execute(job), default=repr).encode("utf-8")
+        except BaseException as e:
+            data = json.dumps({"status": "error", "error": _describe(e)}).encode("utf-8")
+        with os.fdopen(write_end, "wb") as f:
+            f.write(data)
+        os._exit(0)
+
+    os.close(write_end)
+    deadline = started + job["timeout"]
+    chunks, timed_out = [], False
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            os.kill(pid, signal.SIGKILL)
+            break
+        ready, _, _ = select.select([read_end], [], [], remaining)
+        if ready:
+            chunk = os.read(read_end, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    os.close(read_end)
+    _, status = os.waitpid(pid, 0)
+    elapsed = time.monotonic() - started
+    shutil.rmtree(root, ignore_errors=True)
+
+    if timed_out:
+        result = {"status": "timeout", "error": f"Stopped after {job['timeout']:g} seconds"}
+    elif chunks:
+        result = json.loads(b"".join(chunks))
+    elif os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGXCPU:
+        result = {"status": "killed", "error": "CPU time limit exceeded"}
+    elif os.WIFEXITED(status):
+        result = {"status": "error", "error": f"The code exited the process (exit code {os.WEXITSTATUS(status)})"}
+    else:
+        # Usually the memory limit, hit while the child couldn't even report a MemoryError
+        result = {"status": "killed", "error": f"The process was killed by signal {os.WTERMSIG(status)}"}
+    result["wall_seconds"] = elapsed
+    return result
+
+
+def _serve() -> None:
+    """Worker main loop: one JSON job per line on stdin, one JSON result per line on stdout."""
+    for name in PRELOADED_MODULES:
+        __import__(name)
+    for line in sys.stdin:
+        result = _run_forked(json.loads(line))
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+
+# --- In the backend ------------------------------------------------------------
+
+class _Worker:
+    def __init__(self):
+        env = {name: os.environ[name] for name in _WORKER_ENV if name in os.environ}
+        # -I: no user site-packages and no backend modules on sys.path
+        self.process = subprocess.Popen([sys.executable, "-I", os.path.abspath(__file__)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True)
+
+    def call(self, job: Dict, timeout: float) -> Optional[Dict]:
+        """Returns None if the worker died or stopped answering."""
+        try:
+            self.process.stdin.write(json.dumps(job) + "\n")
+            self.process.stdin.flush()
+        except OSError:
+            return None
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        line = self.process.stdout.readline() if ready else ""
+        return json.loads(line) if line else None
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.wait()
+
+
+class SandboxPool:
+    def __init__(self, workers: int = SANDBOX_WORKERS, timeout: float = SANDBOX_TIMEOUT_SECONDS,
+                 memory_mb: int = SANDBOX_MEMORY_MB):
+        self.size = workers
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        # One thread per worker process waits for its answer
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sandbox")
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    def start(self) -> None:
+        """Starts the worker interpreters; runs call it too, so it only saves the first run's startup cost."""
+        with self._lock:
+            while len(self._workers) < self.size:
+                worker = _Worker()
+                self._workers.append(worker)
+                self._idle.put(worker)
+
+    def warm_up(self) -> None:
+        """Blocks until every worker interpreter is up, by running an empty job on each."""
+        self.start()
+        job = {"code": "", "function": None, "tests": [], "make_input": None, "sizes": [],
+               "timeout": self.timeout, "memory_mb": self.memory_mb}
+        # Idle workers are handed out in turn, so this reaches each of them once
+        for _ in range(self.size):
+            self._run(job)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for worker in self._workers:
+                worker.kill()
+            self._workers.clear()
+
+    def _run(self, job: Dict) -> Dict:
+        self.start()
+        worker = self._idle.get()
+        try:
+            result = worker.call(job, job["timeout"] + 5)
+            if result is None:
+                # The worker itself is gone or stuck; replace it
+                worker.kill()
+                with self._lock:
+                    self._workers.remove(worker)
+                    worker = _Worker()
+                    self._workers.append(worker)
+                self.restarts += 1
+                result = {"status": "error", "error": "The sandbox stopped responding"}
+        finally:
+            self._idle.put(worker)
+        return result
+
+    async def run(self, code: str, function: Optional[str] = None, tests: List[Dict] = (),
+                  make_input: Optional[str] = None, sizes: List[int] = SANDBOX_SIZES) -> Dict:
+        """
+        Runs `code`, then calls `function` for every test case ({"args": [...],
+        "expected": ...}, `expected` optional) and, if `make_input` source is given,
+        times it at the input sizes in `sizes`.
+        """
+        job = {"code": code, "function": function, "tests": list(tests), "make_input": make_input,
+               "sizes": sorted(sizes), "timeout": self.timeout, "memory_mb": self.memory_mb}
+        result = await asyncio.get_running_loop().run_in_executor(self._executor, self._run, job)
+        self.runs += 1
+        if result["status"] == "timeout":
+            self.timeouts += 1
+        elif result["status"] != "ok":
+            self.failures += 1
+        if len(result.get("scaling", [])) >= 2:
+            result["complexity"] = estimate_complexity(result["scaling"])
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._workers),
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+        }
+
+
+def _slope(points: List[tuple]) -> Optional[float]:
+    """Least-squares slope of log(y) over log(x)."""
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 1 and y > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def _label(exponent: float) -> str:
+    if exponent < 0.4:
+        return "O(1) or O(log n)"
+    if exponent < 1.4:
+        return "O(n) or O(n log n)"
+    if exponent < 2.4:
+        return "O(n^2)"
+    if exponent < 3.4:
+        return "O(n^3)"
+    return "worse than O(n^3)"
+
+
+def estimate_complexity(scaling: List[Dict]) -> Dict[str, object]:
+    """Growth of time and peak memory with n, as a log-log slope and the nearest complexity class."""
+    estimate = {}
+    time_exponent = _slope([(point["n"], point["seconds"]) for point in scaling])
+    if time_exponent is not None:
+        estimate["time_exponent"] = round(time_exponent, 2)
+        estimate["time"] = _label(time_exponent)
+    memory_exponent = _slope([(point["n"], point["peak_bytes"]) for point in scaling])
+    if max(point["peak_bytes"] for point in scaling) < SMALL_PEAK_BYTES:
+        # A few hundred bytes of bookkeeping don't make a growth rate
+        estimate["memory"] = "O(1)"
+    elif memory_exponent is not None:
+        estimate["memory_exponent"] = round(memory_exponent, 2)
+        estimate["memory"] = _label(memory_exponent)
+    return estimate
+
+
+def summarize(result: Dict) -> List[str]:
+    """Facts about a run for the review prompt."""
+    facts = []
+    if result["status"] != "ok":
+        facts.append(f"Running the code failed: {result.get('error')}.")
+    tests = result.get("tests", [])
+    checked = [test for test in tests if "passed" in test]
+    if checked:
+        passed = sum(1 for test in checked if test["passed"])
+        facts.append(f"It passed {passed} of {len(checked)} test cases.")
+    for test in tests:
+        if test.get("passed") is False:
+            got = f"raised {test['error']}" if "error" in test else f"returned {json.dumps(test.get('output'))}"
+            expected = f", expected {json.dumps(test['expected'])}" if "expected" in test else ""
+            facts.append(f"For arguments {json.dumps(test['args'])} it {got}{expected}.")
+            if len(facts) >= 5:
+                break
+    complexity = result.get("complexity", {})
+    scaling = result.get("scaling", [])
+    if "time" in complexity:
+        facts.append(f"Measured running time grows like {complexity['time']} "
+                     f"(log-log slope {complexity['time_exponent']} from n={scaling[0]['n']} to n={scaling[-1]['n']}).")
+    if "memory" in complexity:
+        facts.append(f"Measured peak memory grows like {complexity['memory']}.")
+    return facts
+
+
+if __name__ == "__main__":
+    _serve()
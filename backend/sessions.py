@@ -0,0 +1,213 @@
+"""
+Server-side conversation sessions.
+
+Instead of re-uploading the whole conversation on every call, the frontend opens
+a session once and then only sends the messages the backend hasn't seen yet.
+Each session is an append-only message log that expires after `SESSION_TTL_SECONDS`
+without activity.
+
+Two backends are available, picked with the `SESSION_BACKEND` env var:
+- `memory` (default): a dict in the worker process.
+- `sqlite`: a SQLite file at `SESSION_DB_PATH`, which survives restarts and is
+  shared by all uvicorn workers on the host (the default with `SHARED_STATE_PATH`).
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from shared import SHARED_STATE_PATH
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite" if SHARED_STATE_PATH else "memory")
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", str(24 * 60 * 60)))
+
+
+class SessionNotFound(KeyError):
+    """Raised when a session id is unknown or has expired."""
+
+
+class SessionStore:
+    """Interface shared by the session backends."""
+
+    def create(self) -> str:
+        raise NotImplementedError
+
+    def append(self, session_id: str, messages: List[Dict[str, str]],
+               offset: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Appends messages to the session log and returns the ones actually appended.
+        `offset` is the position in the log the client believes the first message
+        goes to. Messages the log already holds past that position are skipped, so a
+        retried or double-submitted request doesn't duplicate them.
+        """
+        raise NotImplementedError
+
+    def history(self, session_id: str) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+    def get_summary(self, session_id: str) -> Tuple[str, int]:
+        """Returns the session's running summary and how many messages of the log it covers."""
+        raise NotImplementedError
+
+    def set_summary(self, session_id: str, summary: str, watermark: int) -> None:
+        raise NotImplementedError
+
+    def evict_expired(self) -> int:
+        """Removes sessions idle for longer than the TTL and returns how many were removed."""
+        raise NotImplementedError
+
+
+def _unseen(messages: List[Dict[str, str]], log_length: int, offset: Optional[int]) -> List[Dict[str, str]]:
+    if offset is None or offset >= log_length:
+        return messages
+    return messages[log_length - offset:]
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # Ordered by last activity, so expired sessions are always at the front
+        self._sessions: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+        self._summaries: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, session_id: str) -> List[Dict[str, str]]:
+        touched = self._touched.get(session_id)
+        if touched is None or time.monotonic() - touched > self.ttl_seconds:
+            raise SessionNotFound(session_id)
+        self._touched[session_id] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return self._sessions[session_id]
+
+    def create(self) -> str:
+        self.evict_expired()
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = []
+            self._touched[session_id] = time.monotonic()
+        return session_id
+
+    def append(self, session_id, messages, offset=None):
+        with self._lock:
+            log = self._get(session_id)
+            appended = [dict(message) for message in _unseen(messages, len(log), offset)]
+            log.extend(appended)
+        return appended
+
+    def history(self, session_id):
+        with self._lock:
+            return list(self._get(session_id))
+
+    def get_summary(self, session_id):
+        with self._lock:
+            self._get(session_id)
+            return self._summaries.get(session_id, ("", 0))
+
+    def set_summary(self, session_id, summary, watermark):
+        with self._lock:
+            self._get(session_id)
+            self._summaries[session_id] = (summary, watermark)
+
+    def evict_expired(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        evicted = 0
+        with self._lock:
+            while self._sessions:
+                session_id = next(iter(self._sessions))
+                if self._touched[session_id] > deadline:
+                    break
+                del self._sessions[session_id]
+                del self._touched[session_id]
+                self._summaries.pop(session_id, None)
+                evicted += 1
+        return evicted
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str = SESSION_DB_PATH, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, touched REAL NOT NULL, summary TEXT NOT NULL DEFAULT '', "
+                "summarized INTEGER NOT NULL DEFAULT 0)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, seq))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)")
+            # Session files created before running summaries existed lack their columns
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+            if "summary" not in columns:
+                self._db.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+                self._db.execute("ALTER TABLE sessions ADD COLUMN summarized INTEGER NOT NULL DEFAULT 0")
+
+    def _touch(self, session_id: str) -> None:
+        updated = self._db.execute(
+            "UPDATE sessions SET touched = ? WHERE id = ? AND touched > ?",
+            (time.time(), session_id, time.time() - self.ttl_seconds)).rowcount
+        if not updated:
+            raise SessionNotFound(session_id)
+
+    def create(self) -> str:
+        self.evict_expired()
+        session_id = uuid.uuid4().hex
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO sessions (id, touched) VALUES (?, ?)", (session_id, time.time()))
+        return session_id
+
+    def append(self, session_id, messages, offset=None):
+        with self._lock, self._db:
+            self._touch(session_id)
+            log_length = self._db.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+            appended = _unseen(messages, log_length, offset)
+            self._db.executemany(
+                "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(session_id, log_length + i, message["role"], message["content"])
+                 for i, message in enumerate(appended)])
+        return appended
+
+    def history(self, session_id):
+        with self._lock, self._db:
+            self._touch(session_id)
+            rows = self._db.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def get_summary(self, session_id):
+        with self._lock, self._db:
+            self._touch(session_id)
+            summary, watermark = self._db.execute(
+                "SELECT summary, summarized FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return summary, watermark
+
+    def set_summary(self, session_id, summary, watermark):
+        with self._lock, self._db:
+            self._touch(session_id)
+            self._db.execute("UPDATE sessions SET summary = ?, summarized = ? WHERE id = ?",
+                             (summary, watermark, session_id))
+
+    def evict_expired(self):
+        deadline = time.time() - self.ttl_seconds
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM messages WHERE session_id IN (SELECT id FROM sessions WHERE touched <= ?)", (deadline,))
+            return self._db.execute("DELETE FROM sessions WHERE touched <= ?", (deadline,)).rowcount
+
+
+def get_session_store() -> SessionStore:
+    """Builds the session store configured through `SESSION_BACKEND`."""
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore()
+    if SESSION_BACKEND == "memory":
+        return InMemorySessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND: {SESSION_BACKEND}")
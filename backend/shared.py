@@ -0,0 +1,195 @@
+"""
+State shared by the uvicorn workers of one host.
+
+With `uvicorn main:app --workers N` every worker is a separate process, so state
+kept in a worker's memory is only seen by the requests that worker happens to
+handle: a session created on one worker is unknown to the next, a student gets
+N times their rate limit, and a quiz prefetched by one worker is generated
+again by another. Setting `SHARED_STATE_PATH` keeps that state in one SQLite
+file (WAL mode) instead, which every worker on the host reads and writes; no
+external service is needed. It also makes sessions (`SESSION_BACKEND`) and the
+quiz cache (`QUIZ_CACHE_DB_PATH`) default to SQLite.
+
+`SharedState` is a small key-value interface with TTLs and the few atomic
+operations the backend needs (set-if-absent, take, token bucket). Without
+`SHARED_STATE_PATH` each component uses an `InMemorySharedState` instead: the
+same interface in the worker's memory, which is what a single worker (or a test)
+wants anyway.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from cachetools import TLRUCache
+
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH")
+# Writes between two sweeps of expired keys out of the SQLite file
+EVICT_EVERY_WRITES = 1000
+
+
+def refill(bucket: Optional[Tuple[float, float]], now: float, rate_per_second: float,
+           capacity: int) -> Tuple[Tuple[float, float], float]:
+    """
+    Token bucket step on a (tokens, updated) pair: takes a token if there is one.
+    Returns the new pair and 0, or the unchanged pair and the seconds until a token is available.
+    """
+    tokens, updated = bucket if bucket is not None else (float(capacity), now)
+    tokens = min(capacity, tokens + max(now - updated, 0.0) * rate_per_second)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate_per_second
+
+
+class SharedState:
+    """Interface of the shared state backends. Values are anything JSON-serializable."""
+    # Whether other worker processes see the same state
+    shared = False
+
+    def get(self, namespace: str, key: str) -> Any:
+        """The value, or None if absent or expired."""
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> None:
+        raise NotImplementedError
+
+    def add(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> bool:
+        """Sets the key only if it is absent; returns whether it did, so one caller wins a race."""
+        raise NotImplementedError
+
+    def pop(self, namespace: str, key: str) -> Any:
+        """Removes and returns the value, or None; a value is only ever handed to one caller."""
+        raise NotImplementedError
+
+    def take_token(self, namespace: str, key: str, rate_per_second: float, capacity: int,
+                   ttl_seconds: float) -> float:
+        """Takes a token from the key's bucket and returns 0, or returns the seconds until one is available."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+
+class InMemorySharedState(SharedState):
+    """Stand-in keeping the state in this worker's memory, for a single worker; holds at most `maxsize` keys."""
+
+    def __init__(self, maxsize: int = 100_000):
+        self._entries = TLRUCache(maxsize=maxsize, ttu=lambda key, entry, now: now + entry[1], timer=time.time)
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+        return entry[0] if entry is not None else None
+
+    def set(self, namespace, key, value, ttl_seconds):
+        with self._lock:
+            self._entries[(namespace, key)] = (value, ttl_seconds)
+
+    def add(self, namespace, key, value, ttl_seconds):
+        with self._lock:
+            if (namespace, key) in self._entries:
+                return False
+            self._entries[(namespace, key)] = (value, ttl_seconds)
+            return True
+
+    def pop(self, namespace, key):
+        with self._lock:
+            entry = self._entries.pop((namespace, key), None)
+        return entry[0] if entry is not None else None
+
+    def take_token(self, namespace, key, rate_per_second, capacity, ttl_seconds):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            bucket, wait = refill(entry[0] if entry is not None else None, time.time(), rate_per_second, capacity)
+            self._entries[(namespace, key)] = (bucket, ttl_seconds)
+        return wait
+
+    def stats(self):
+        return {"keys": len(self._entries), "max_keys": self._entries.maxsize}
+
+
+class SQLiteSharedState(SharedState):
+    """State in a SQLite file that every worker process on the host opens."""
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        # Autocommit, with explicit BEGIN IMMEDIATE where a value is read and then written
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.evicted = 0
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # A crash may lose the last writes, which for caches and rate limits is harmless
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS state_expires ON state (expires)")
+
+    def _written(self) -> None:
+        self._writes += 1
+        if self._writes % EVICT_EVERY_WRITES == 0:
+            self.evicted += self._db.execute("DELETE FROM state WHERE expires <= ?", (time.time(),)).rowcount
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM state WHERE namespace = ? AND key = ? AND expires > ?",
+                                   (namespace, key, time.time())).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, namespace, key, value, ttl_seconds):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO state (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                             (namespace, key, json.dumps(value), time.time() + ttl_seconds))
+            self._written()
+
+    def add(self, namespace, key, value, ttl_seconds):
+        now = time.time()
+        with self._lock:
+            # An expired row counts as absent
+            added = self._db.execute(
+                "INSERT INTO state (namespace, key, value, expires) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                "WHERE state.expires <= ?", (namespace, key, json.dumps(value), now + ttl_seconds, now)).rowcount
+            self._written()
+        return added > 0
+
+    def pop(self, namespace, key):
+        with self._lock:
+            row = self._db.execute("DELETE FROM state WHERE namespace = ? AND key = ? RETURNING value, expires",
+                                   (namespace, key)).fetchone()
+        return json.loads(row[0]) if row is not None and row[1] > time.time() else None
+
+    def take_token(self, namespace, key, rate_per_second, capacity, ttl_seconds):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT value FROM state WHERE namespace = ? AND key = ? AND expires > ?",
+                                       (namespace, key, now)).fetchone()
+                bucket, wait = refill(json.loads(row[0]) if row is not None else None, now, rate_per_second, capacity)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO state (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                    (namespace, key, json.dumps(bucket), now + ttl_seconds))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._written()
+        return wait
+
+    def stats(self):
+        with self._lock:
+            keys = self._db.execute("SELECT COUNT(*) FROM state WHERE expires > ?", (time.time(),)).fetchone()[0]
+        return {"keys": keys, "evicted": self.evicted}
+
+
+def get_shared_state() -> Optional[SharedState]:
+    """The state shared by the workers of this host if `SHARED_STATE_PATH` is set, otherwise None."""
+    return SQLiteSharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
@@ -0,0 +1,113 @@
+"""
+Rolling conversation summaries.
+
+Re-summarizing the whole transcript on every "Get Conversation Summary" click
+makes cost and latency grow with the session, and long sessions eventually
+exceed the model's context. Instead each session keeps a running summary plus a
+watermark of how many messages it already covers, and only the messages past
+the watermark are folded into it.
+
+To keep the work per request bounded, the summary is also folded in the
+background whenever `SUMMARY_FOLD_TURNS` unsummarized messages have piled up,
+so a summary request on a 200-turn session only ever folds the last few turns.
+"""
+import asyncio
+import os
+import weakref
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from admission import Priority
+from prompts import build_fold_prompt
+from sessions import SessionNotFound, SessionStore
+
+SUMMARY_FOLD_TURNS = int(os.environ.get("SUMMARY_FOLD_TURNS", "20"))
+
+
+class RollingSummarizer:
+    def __init__(self, store: SessionStore, generate: Callable[[str], Awaitable[str]],
+                 stream: Callable[[str], AsyncIterator[str]], fold_turns: int = SUMMARY_FOLD_TURNS):
+        self.store = store
+        self.generate = generate
+        self.stream = stream
+        self.fold_turns = fold_turns
+        # One fold at a time per session, so concurrent requests don't summarize the same turns twice.
+        # A lock goes away with the last request holding or awaiting it, so idle sessions cost nothing
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._background: Dict[str, asyncio.Task] = {}
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def summary(self, session_id: str, topic: str, priority: Priority = Priority.BATCH,
+                      charge_session: bool = True) -> str:
+        """
+        Returns the session's summary, folding in any messages it doesn't cover yet.
+        Without `charge_session` the fold doesn't spend the session's rate limit tokens.
+        """
+        async with self._lock(session_id):
+            summary, watermark = self.store.get_summary(session_id)
+            history = self.store.history(session_id)
+            if watermark >= len(history):
+                return summary
+            summary = await self.generate(build_fold_prompt(topic, summary, history[watermark:]),
+                                          priority=priority, session_id=session_id if charge_session else None)
+            self.store.set_summary(session_id, summary, len(history))
+            return summary
+
+    async def stream_summary(self, session_id: str, topic: str) -> AsyncIterator[str]:
+        """
+        Streaming variant of `summary`; the cached summary comes back as a single chunk.
+        The fold is admitted before this returns, so `Overloaded` is raised here and can
+        still become an error response instead of breaking off a started stream.
+        """
+        chunks = self._stream_summary(session_id, topic)
+        # Runs up to the admission check; the generator yields nothing else before it
+        await chunks.__anext__()
+        return chunks
+
+    async def _stream_summary(self, session_id: str, topic: str) -> AsyncIterator[str]:
+        async with self._lock(session_id):
+            summary, watermark = self.store.get_summary(session_id)
+            history = self.store.history(session_id)
+            if watermark >= len(history):
+                yield ""
+                yield summary
+                return
+            parts = []
+            chunks = self.stream(build_fold_prompt(topic, summary, history[watermark:]),
+                                 priority=Priority.BATCH, session_id=session_id)
+            yield ""
+            async for text in chunks:
+                parts.append(text)
+                yield text
+            self.store.set_summary(session_id, "".join(parts), len(history))
+
+    def maybe_fold(self, session_id: str, topic: str) -> None:
+        """Folds the summary in the background once enough unsummarized messages have accumulated."""
+        if session_id in self._background:
+            return
+        try:
+            _, watermark = self.store.get_summary(session_id)
+            unsummarized = len(self.store.history(session_id)) - watermark
+        except SessionNotFound:
+            return
+        if unsummarized >= self.fold_turns:
+            self._background[session_id] = asyncio.create_task(self._fold(session_id, topic))
+
+    def background(self, session_id: str) -> Optional[asyncio.Task]:
+        """The session's running background fold, if any."""
+        return self._background.get(session_id)
+
+    async def _fold(self, session_id: str, topic: str) -> None:
+        try:
+            # The student didn't ask for this one, so it mustn't use up their rate limit
+            await self.summary(session_id, topic, priority=Priority.SPECULATIVE, charge_session=False)
+        except SessionNotFound:
+            pass
+        except Exception as e:
+            print(f"Error during background summarization: {e}")
+        finally:
+            self._background.pop(session_id, None)
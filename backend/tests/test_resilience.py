@@ -0,0 +1,167 @@
+"""
+Tests of the circuit breaker and the retry/deadline policy in `resilience`.
+Run from the backend directory:
+    python -m pytest -q tests
+"""
+import asyncio
+import time
+
+import pytest
+from tenacity import wait_fixed
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpen, ResilientCaller, TransientLLMError, is_transient
+
+
+@pytest.fixture(autouse=True)
+def short_backoff(monkeypatch):
+    # The real backoff waits up to seconds between attempts
+    monkeypatch.setattr(resilience, "wait_random_exponential", lambda **_: wait_fixed(0.01))
+
+
+def expire(breaker: CircuitBreaker) -> None:
+    """Moves an open breaker past its reset time."""
+    breaker.opened_at = time.monotonic() - breaker.reset_seconds
+
+
+def flaky(failures: int, error: Exception):
+    """A call failing with `error` the first `failures` times, then answering "ok"."""
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+    return call, calls
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(threshold=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.times_opened == 1
+    with pytest.raises(CircuitOpen) as raised:
+        breaker.check()
+    assert raised.value.status_code == 503
+    assert 1 <= raised.value.retry_after <= 60
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(threshold=3, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.state == "half-open"
+    breaker.check()
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    # Failing fast before queueing doesn't claim the trial or reject during it
+    breaker.reject_if_open()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.check()
+    breaker.check()
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    expire(breaker)
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+
+
+def test_abandoned_trial_lets_another_call_try():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    expire(breaker)
+    breaker.check()
+    breaker.abandon_trial()
+    breaker.check()
+
+
+def test_transient_errors():
+    assert is_transient(TransientLLMError("503"))
+    assert is_transient(asyncio.TimeoutError())
+    assert is_transient(ConnectionResetError())
+    assert not is_transient(ValueError("blocked prompt"))
+
+
+def test_transient_errors_are_retried():
+    caller = ResilientCaller(hedge=False, max_attempts=3)
+    call, calls = flaky(2, TransientLLMError("upstream hiccup"))
+    assert asyncio.run(caller.call(call, deadline=5)) == "ok"
+    assert len(calls) == 3
+    assert caller.retries == 2
+    assert caller.breaker.state == "closed"
+    assert caller.breaker.failures == 0
+
+
+def test_retries_stop_after_max_attempts():
+    caller = ResilientCaller(hedge=False, max_attempts=3)
+    call, calls = flaky(10, TransientLLMError("upstream down"))
+    with pytest.raises(TransientLLMError):
+        asyncio.run(caller.call(call, deadline=5))
+    assert len(calls) == 3
+
+
+def test_non_transient_errors_are_not_retried():
+    caller = ResilientCaller(hedge=False, max_attempts=3)
+    call, calls = flaky(10, ValueError("blocked prompt"))
+    with pytest.raises(ValueError):
+        asyncio.run(caller.call(call, deadline=5))
+    assert len(calls) == 1
+    assert caller.retries == 0
+    # Gemini did answer, so upstream counts as healthy
+    assert caller.breaker.failures == 0
+
+
+def test_retries_stop_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(resilience, "wait_random_exponential", lambda **_: wait_fixed(0.1))
+    caller = ResilientCaller(hedge=False, max_attempts=100)
+    call, calls = flaky(1000, TransientLLMError("upstream down"))
+    started = time.monotonic()
+    with pytest.raises(TransientLLMError):
+        asyncio.run(caller.call(call, deadline=0.35))
+    assert time.monotonic() - started < 1
+    assert 2 <= len(calls) <= 5
+
+
+def test_slow_call_times_out_at_the_deadline():
+    caller = ResilientCaller(hedge=False, max_attempts=3)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(caller.call(hang, deadline=0.2))
+    assert time.monotonic() - started < 1
+    assert caller.timeouts >= 1
+
+
+def test_open_circuit_fails_fast_without_calling_upstream():
+    caller = ResilientCaller(hedge=False, max_attempts=1)
+    caller.breaker.threshold = 2
+    call, calls = flaky(10, TransientLLMError("upstream down"))
+    for _ in range(2):
+        with pytest.raises(TransientLLMError):
+            asyncio.run(caller.call(call, deadline=5))
+    with pytest.raises(CircuitOpen):
+        asyncio.run(caller.call(call, deadline=5))
+    assert len(calls) == 2
@@ -0,0 +1,105 @@
+"""
+Liveness, readiness and warm-up of a backend worker.
+
+Importing the backend does nothing slow: the LLM provider is built on first use
+and the sandbox workers are started by the lifespan hook, so a new uvicorn
+worker accepts connections a fraction of a second after it is spawned.
+
+- GET /healthz answers as soon as the worker serves requests (liveness).
+- GET /readyz answers 503 until the worker has started, the configuration checks
+  pass and, with `WARMUP_ENABLED`, the warm-up has finished; then 200. Load
+  balancers and autoscalers should only route students to ready workers.
+
+The warm-up runs in the background after startup: it builds the provider and
+opens its connection, boots the sandbox workers and primes the per-process
+caches, so the first student on a new worker doesn't pay for any of it. A step
+that fails is reported by /readyz but doesn't keep the worker unready, since the
+same work is simply redone by the first request that needs it; a failed
+configuration check does.
+"""
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "1") == "1"
+
+# A check returns the problems it found; an empty list means it passed
+Check = Callable[[], List[str]]
+Step = Callable[[], None]
+
+
+class Readiness:
+    def __init__(self, enabled: bool = WARMUP_ENABLED):
+        self.enabled = enabled
+        self.created = time.perf_counter()
+        self._checks: Dict[str, Check] = {}
+        self._steps: Dict[str, Step] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.started = False
+        self.warmed = False
+        self.startup_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.step_seconds: Dict[str, float] = {}
+        self.step_errors: Dict[str, str] = {}
+
+    def add_check(self, name: str, check: Check) -> None:
+        self._checks[name] = check
+
+    def add_step(self, name: str, step: Step) -> None:
+        """`step` is blocking; warm-up steps run one after the other on a worker thread."""
+        self._steps[name] = step
+
+    def start(self) -> None:
+        """Called once the worker serves requests; starts the warm-up in the background."""
+        self.started = True
+        self.startup_seconds = time.perf_counter() - self.created
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._warm_up())
+        elif not self.enabled:
+            self.warmed = True
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _warm_up(self) -> None:
+        started = time.perf_counter()
+        for name, step in self._steps.items():
+            step_started = time.perf_counter()
+            try:
+                await asyncio.to_thread(step)
+            except Exception as e:
+                print(f"Error during warm-up step {name}: {e}")
+                self.step_errors[name] = str(e)
+            self.step_seconds[name] = time.perf_counter() - step_started
+        self.warmup_seconds = time.perf_counter() - started
+        self.warmed = True
+
+    def problems(self) -> List[str]:
+        problems = []
+        for name, check in self._checks.items():
+            try:
+                problems.extend(check())
+            except Exception as e:
+                problems.append(f"{name}: {e}")
+        return problems
+
+    def status(self) -> Dict:
+        problems = self.problems()
+        ready = self.started and self.warmed and not problems
+        return {
+            "status": "ready" if ready else "unavailable" if problems else "starting",
+            "problems": problems,
+            "warmed": self.warmed,
+            "warmup_errors": dict(self.step_errors),
+        }
+
+    def stats(self) -> Dict[str, float]:
+        stats = {"started": int(self.started), "warmed": int(self.warmed),
+                 "startup_seconds": self.startup_seconds or 0.0, "warmup_seconds": self.warmup_seconds or 0.0,
+                 "warmup_errors": len(self.step_errors)}
+        stats.update({f"{name}_seconds": seconds for name, seconds in self.step_seconds.items()})
+        return stats
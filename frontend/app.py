@@ -1,60 +1,341 @@
+import json
 import streamlit as st
 import requests
 from streamlit_ace import st_ace
-from fpdf import FPDF
-import warnings  # Import the warnings module
-import base64  # Import base64 module
+import time
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect
 
-BACKEND_URL = "http://localhost:8000"
+from backend_client import BACKEND_CONNECT_TIMEOUT, BACKEND_WS_URL, get_client
 
+JOB_POLL_SECONDS = 1
 
-def get_pdf_download_html(text, filename="summary.pdf"):
-    """Generates a base64-encoded PDF and returns an HTML download link."""
-    try:
-        pdf = FPDF()
-        pdf.add_page()
 
-        # Add a font that supports UTF-8 (like DejaVu)
-        # This is a common requirement for FPDF to handle diverse characters.
-        # We'll try Arial first, but fall back.
+def ensure_session():
+    """Opens a backend session for this conversation if there isn't one yet and returns its id."""
+    if st.session_state.session_id is None:
         try:
-            pdf.set_font("Arial", size=11)
-            # Encode to latin-1, replacing unsupported chars. A common FPDF workaround.
-            safe_text = text.encode('latin-1', 'replace').decode('latin-1')
-        except (AttributeError, UnicodeEncodeError):
-            # Fallback for complex characters - this may still fail on some environments
-            # without a proper unicode font file (e.g., DejaVuSans.ttf)
-            pdf.set_font("Times", size=11)
-            safe_text = str(text).encode(
-                'latin-1', 'replace').decode('latin-1')
-
-        pdf.multi_cell(0, 5, safe_text)
-
-        # Get PDF bytes output
-        # Suppress FPDF deprecation warning
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            pdf_bytes = pdf.output(dest='S').encode('latin-1')
-
-        b64 = base64.b64encode(pdf_bytes).decode('utf-8')
-
-        # Create the HTML download link with Streamlit-like button styling
-        href = f"""
-            <a href="data:application/pdf;base64,{b64}" download="{filename}" 
-               style="display: inline-flex; align-items: center; justify-content: center;
-                      background-color: #0d6efd; color: white; padding: .25rem .75rem; 
-                      font-size: 1rem; font-weight: 400; line-height: 1.6;
-                      border: 1px solid transparent; border-radius: .375rem; 
-                      text-decoration: none; cursor: pointer; user-select: none;">
-                Download Summary as PDF
-            </a>
-        """
-        return href
-    except Exception as e:
-        # If PDF fails, show an error and don't provide the link
-        st.error(f"Error generating PDF: {e}. Please use the TXT download.")
-        return ""
-
+            response = get_client().post("/sessions")
+            if response.status_code == 200:
+                st.session_state.session_id = response.json()["session_id"]
+                st.session_state.synced_messages = 0
+        except requests.exceptions.RequestException:
+            pass
+    return st.session_state.session_id
+
+
+def conversation_history():
+    """
+    The conversation as the backend takes it. Messages are only ever appended, so
+    the list is kept in session state and only the new ones are converted.
+    """
+    cache = st.session_state.history_cache
+    messages = st.session_state.messages
+    if cache["converted"] > len(messages):
+        cache["converted"], cache["history"] = 0, []
+    cache["history"].extend(
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in messages[cache["converted"]:] if msg["role"] in ["user", "agent"]
+    )
+    cache["converted"] = len(messages)
+    return cache["history"]
+
+
+def history_payload():
+    """
+    Conversation context for a backend call.
+    With a session open, only the messages the backend hasn't seen yet are sent;
+    otherwise (e.g. the session could not be created) the full history is.
+    """
+    history = conversation_history()
+    if ensure_session() is None:
+        return {"conversation_history": list(history)}
+    synced = st.session_state.synced_messages
+    return {
+        "session_id": st.session_state.session_id,
+        "new_messages": history[synced:],
+        "history_offset": synced
+    }
+
+
+def mark_synced(payload, replies=0):
+    """Records that the backend session now holds the payload's messages plus `replies` agent replies."""
+    if "session_id" in payload:
+        st.session_state.synced_messages = payload["history_offset"] + len(payload["new_messages"]) + replies
+
+
+def check_session(response, payload):
+    """Drops an expired session so the next call opens a fresh one and resends the whole history."""
+    if response.status_code == 404 and "session_id" in payload:
+        st.session_state.session_id = None
+
+
+def stream_from_backend(path, payload, key="text"):
+    """
+    Calls one of the backend's `/.../stream` endpoints and yields the answer text
+    chunk by chunk as the server-sent events arrive, so it can be fed straight
+    into `st.write_stream`. `key` picks what each event carries, e.g. "question"
+    for the questions of /generate_quiz/stream.
+    """
+    with get_client().post(path, json=payload, stream=True) as response:
+        if response.status_code != 200:
+            check_session(response, payload)
+            raise requests.exceptions.HTTPError(
+                f"Error communicating with backend: {response.text}", response=response)
+        response.encoding = "utf-8"
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = "message"
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    raise requests.exceptions.RequestException(
+                        f"Error communicating with backend: {data.get('detail')}")
+                if event == "message":
+                    yield data[key]
+
+
+def chat_socket():
+    """
+    The conversation's WebSocket to `/ws/chat`, opened on first use and kept across
+    reruns, so chat turns reuse one connection instead of a POST each.
+    Returns None if it can't be opened; callers then fall back to the HTTP endpoints.
+    """
+    if st.session_state.chat_socket is None:
+        url = f"{BACKEND_WS_URL}/ws/chat"
+        if st.session_state.session_id is not None:
+            url += f"?session_id={st.session_state.session_id}"
+        try:
+            socket = connect(url, open_timeout=BACKEND_CONNECT_TIMEOUT)
+            frame = json.loads(socket.recv(timeout=BACKEND_CONNECT_TIMEOUT))
+        except (OSError, TimeoutError, WebSocketException):
+            return None
+        if frame["session_id"] != st.session_state.session_id:
+            # A new session (the old one expired): the whole history gets sent again
+            st.session_state.session_id = frame["session_id"]
+            st.session_state.synced_messages = frame["history_length"]
+        else:
+            resync_history(frame["history_length"])
+            if st.session_state.session_id is None:
+                socket.close()
+                return None
+        st.session_state.chat_socket = socket
+    return st.session_state.chat_socket
+
+
+def resync_history(history_length):
+    """
+    Lines the conversation up with the `history_length` messages the backend session
+    holds, e.g. after a turn was cut off. Replies it recorded that were never shown
+    are fetched and put back in their place; messages it never got are sent again
+    with the next turn.
+    """
+    synced = st.session_state.synced_messages
+    if history_length > synced:
+        try:
+            response = get_client().get(f"/sessions/{st.session_state.session_id}")
+            response.raise_for_status()
+            missing = response.json()["conversation_history"][synced:history_length]
+        except requests.exceptions.RequestException:
+            # Without them the histories can't be lined up; a fresh session gets the whole history
+            st.session_state.session_id = None
+            return
+        st.session_state.messages[synced:synced] = [
+            {"role": msg["role"], "content": msg["content"]} for msg in missing]
+        st.session_state.history_cache = {"converted": 0, "history": []}
+    st.session_state.synced_messages = history_length
+
+
+def drop_chat_socket():
+    if st.session_state.chat_socket is not None:
+        st.session_state.chat_socket.close()
+        st.session_state.chat_socket = None
+
+
+def handle_push(frame):
+    """Notifications the backend pushes when background work for the conversation is done."""
+    if frame["type"] == "quiz_ready":
+        st.session_state.quiz_ready = True
+        st.toast("Your quiz is ready in the Quiz tab.")
+    elif frame["type"] == "summary_ready":
+        st.session_state.summary_ready = True
+
+
+def receive_pushes():
+    """Handles the notifications that arrived since the last interaction."""
+    socket = st.session_state.chat_socket
+    if socket is None:
+        return
+    try:
+        while True:
+            handle_push(json.loads(socket.recv(timeout=0)))
+    except TimeoutError:
+        pass
+    except (OSError, WebSocketException):
+        drop_chat_socket()
+
+
+def socket_frames(frame_type, payload):
+    """
+    Sends one frame over the chat socket and yields the frames answering it,
+    handling any pushed notifications in between. Frames of earlier turns still
+    arriving are skipped. If the caller stops before the turn is over (e.g. a rerun
+    interrupted `st.write_stream`), the socket is dropped, which stops the answer on
+    the backend; the next turn reconnects and resyncs the history.
+    """
+    socket = chat_socket()
+    st.session_state.chat_turn += 1
+    turn = st.session_state.chat_turn
+    finished = False
+    try:
+        socket.send(json.dumps({"type": frame_type, "turn": turn, **payload}))
+        while True:
+            frame = json.loads(socket.recv())
+            if frame["type"] in ("quiz_ready", "summary_ready"):
+                handle_push(frame)
+                continue
+            if frame.get("turn") != turn:
+                continue
+            if frame["type"] == "error":
+                finished = True
+                if frame["status"] == 404:
+                    # The session expired; the next turn opens a fresh one and resends the history
+                    drop_chat_socket()
+                    st.session_state.session_id = None
+                raise requests.exceptions.RequestException(
+                    f"Error communicating with backend: {frame['detail']}")
+            if frame["type"] in ("done", "ack"):
+                finished = True
+                st.session_state.synced_messages = frame["history_length"]
+                yield frame
+                return
+            yield frame
+    except (OSError, WebSocketException) as e:
+        drop_chat_socket()
+        raise requests.exceptions.RequestException(f"Error communicating with backend: {e}")
+    finally:
+        if not finished:
+            drop_chat_socket()
+            if "history_offset" in payload:
+                # The backend has at least the messages sent; resync_history finds out the rest
+                st.session_state.synced_messages = payload["history_offset"] + len(payload["new_messages"])
+
+
+def stream_chat(payload, end_conversation=False):
+    """
+    A chat turn (or, with `end_conversation`, the conversation summary) yielded chunk
+    by chunk for `st.write_stream`: over the chat socket, or /chat/stream (/summarize/stream)
+    without one.
+    """
+    if chat_socket() is None:
+        if end_conversation:
+            payload = {**payload, **history_payload()}
+            yield from stream_from_backend("/summarize/stream", payload)
+            mark_synced(payload)
+        else:
+            payload = {**payload, **history_payload(), "end_conversation": False}
+            yield from stream_from_backend("/chat/stream", payload)
+            mark_synced(payload, replies=1)
+        return
+    frame_type = "end_conversation" if end_conversation else "message"
+    for frame in socket_frames(frame_type, {**payload, **history_payload()}):
+        if frame["type"] == "token":
+            yield frame["text"]
+
+
+def switch_mode(mode):
+    """Tells the backend the conversation switched to `mode`, along with the messages shown for it."""
+    if chat_socket() is None:
+        return  # The messages reach the backend with the next HTTP call
+    try:
+        for _ in socket_frames("mode", {"mode": mode, **history_payload()}):
+            pass
+    except requests.exceptions.RequestException:
+        pass
+
+
+def fetch_pending():
+    """
+    Starts the backend calls this rerun needs that don't depend on each other: the
+    status of the quiz grading job and the export of a new summary. They run
+    concurrently while the page is drawn; the tabs pick up the results.
+    """
+    client = get_client()
+    calls = {}
+    if st.session_state.quiz_job:
+        calls["quiz_job"] = lambda job_id=st.session_state.quiz_job: client.get(f"/jobs/{job_id}")
+    summary = st.session_state.conversation_summary
+    export = st.session_state.summary_export
+    if summary and (export is None or export["summary"] != summary):
+        calls["export"] = lambda: client.post("/export", json={"text": summary})
+    return client.fan_out(calls)
+
+
+def poll_quiz_job(pending=None):
+    """
+    Checks on the job grading the quiz: shows the results once done, or reruns shortly to check again.
+    `pending` is the status request already started by fetch_pending(), if any.
+    """
+    try:
+        if pending is not None:
+            response = pending.result()
+        else:
+            response = get_client().get(f"/jobs/{st.session_state.quiz_job}")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Connection error: {e}")
+        st.session_state.quiz_job = None
+        return
+    job = response.json() if response.status_code == 200 else {"status": "failed", "error": response.text}
+    if job["status"] == "done":
+        st.session_state.quiz_job = None
+        st.session_state.quiz_results = job["result"]["results"]
+        st.session_state.messages.append(
+            {"role": "agent", "content": "Quiz submitted! Here are your results."})
+        st.rerun()
+    elif job["status"] == "failed":
+        st.session_state.quiz_job = None
+        st.error(f"Error submitting quiz: {job['error']}")
+    else:
+        st.info("Grading your quiz... you can keep working in the other tabs meanwhile.")
+        st.session_state.poll_jobs = True
+
+
+def summary_pdf(summary, pending=None):
+    """
+    The summary as a PDF, rendered and cached by the backend's /export. The summary
+    is registered once and the PDF fetched once by this server; reruns reuse the
+    bytes, and the browser never needs to reach the backend itself.
+    `pending` is the registration already started by fetch_pending(), if any.
+    Returns None if the backend can't provide it.
+    """
+    client = get_client()
+    export = st.session_state.summary_export
+    for attempt in range(2):
+        try:
+            if export is None or export["summary"] != summary:
+                if pending is not None and attempt == 0:
+                    response = pending.result()
+                else:
+                    response = client.post("/export", json={"text": summary})
+                response.raise_for_status()
+                export = st.session_state.summary_export = {
+                    "summary": summary, "urls": response.json()["urls"], "pdf": None}
+            if export["pdf"] is None:
+                response = client.get(export["urls"]["pdf"])
+                if response.status_code == 404 and attempt == 0:
+                    # The export expired or the backend restarted; register the summary again
+                    export = st.session_state.summary_export = None
+                    continue
+                response.raise_for_status()
+                export["pdf"] = response.content
+            return export["pdf"]
+        except requests.exceptions.RequestException as e:
+            st.error(f"Error preparing the PDF: {e}")
+            return None
+    return None
 
 
 def main():
@@ -78,6 +359,27 @@ def main():
         st.session_state.quiz_results = None
     if "conversation_summary" not in st.session_state:
         st.session_state.conversation_summary = None  # New state for summary
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = None  # Backend session holding the conversation
+    if "synced_messages" not in st.session_state:
+        st.session_state.synced_messages = 0  # How many messages the backend session has seen
+    if "chat_socket" not in st.session_state:
+        st.session_state.chat_socket = None  # WebSocket carrying the conversation, see chat_socket()
+    if "chat_turn" not in st.session_state:
+        st.session_state.chat_turn = 0  # Id of the last frame sent over the chat socket, see socket_frames()
+    if "quiz_ready" not in st.session_state:
+        st.session_state.quiz_ready = False  # The backend has already generated this topic's quizzes
+    if "quiz_job" not in st.session_state:
+        st.session_state.quiz_job = None  # Backend job grading the submitted quiz
+    if "summary_ready" not in st.session_state:
+        st.session_state.summary_ready = False  # The backend has folded recent turns into the summary
+    if "summary_export" not in st.session_state:
+        st.session_state.summary_export = None  # Summary registered with the backend's /export, and its PDF
+    if "history_cache" not in st.session_state:
+        st.session_state.history_cache = {"converted": 0, "history": []}  # See conversation_history()
+
+    receive_pushes()
+    pending = fetch_pending()
 
     conversation_tab, quiz_tab, summary_tab = st.tabs(
         ["Conversation / Code Editor", "Quiz", "Summary"])
@@ -98,23 +400,12 @@ def main():
                     st.session_state.messages.append(
                         {"role": "user", "content": f"Problem: {problem_text}"})
 
-                    # Send initial problem to backend
+                    # Send initial problem to backend and render the answer as it streams in
                     try:
-                        response = requests.post(
-                            f"{BACKEND_URL}/chat",
-                            json={
-                                "topic": st.session_state.topic,
-                                "conversation_history": [],
-                                "end_conversation": False
-                            }
-                        )
-                        if response.status_code == 200:
-                            agent_response = response.json().get("answer")
-                            st.session_state.messages.append(
-                                {"role": "agent", "content": agent_response})
-                        else:
-                            st.error(
-                                f"Error communicating with backend: {response.text}")
+                        with st.chat_message("agent"):
+                            agent_response = st.write_stream(stream_chat({"topic": st.session_state.topic}))
+                        st.session_state.messages.append(
+                            {"role": "agent", "content": agent_response})
                     except requests.exceptions.RequestException as e:
                         st.error(f"Connection error: {e}")
                     
@@ -141,34 +432,18 @@ def main():
                     st.session_state.messages.append(
                         {"role": "agent", "content": "Great! Now you can try coding your solution below. If you want to go back to discussing the concept, just click the 'Back to Discussion' button."}
                     )
+                    switch_mode("code")
                     st.rerun()
 
                 # REMOVED "go back to concept" from here. It's now a button.
 
                 else:
-                    # Prepare conversation history for backend
-                    conversation_history_for_backend = [
-                        {"role": msg["role"], "content": msg["content"]}
-                        for msg in st.session_state.messages if msg["role"] in ["user", "agent"]
-                    ]
-                    
                     try:
-                        # Send ongoing conversation to backend
-                        response = requests.post(
-                            f"{BACKEND_URL}/chat",
-                            json={
-                                "topic": st.session_state.topic,
-                                "conversation_history": conversation_history_for_backend,
-                                "end_conversation": False
-                            }
-                        )
-                        if response.status_code == 200:
-                            agent_response = response.json().get("answer")
-                            st.session_state.messages.append(
-                                {"role": "agent", "content": agent_response})
-                        else:
-                            st.error(
-                                f"Error communicating with backend: {response.text}")
+                        # Send the new messages to backend and render the answer as it streams in
+                        with st.chat_message("agent"):
+                            agent_response = st.write_stream(stream_chat({"topic": st.session_state.topic}))
+                        st.session_state.messages.append(
+                            {"role": "agent", "content": agent_response})
                     except requests.exceptions.RequestException as e:
                         st.error(f"Connection error: {e}")
 
@@ -184,26 +459,24 @@ def main():
                 st.session_state.messages.append(
                     {"role": "agent", "content": "Okay, let's go back to discussing the concept. What's your next question?"}
                 )
+                switch_mode("discussion")
                 st.rerun()
 
             content = st_ace(language="python", theme="dracula",
                              value="# Write your Python code here")
+            run_tests = st.checkbox("Also run my code against test cases",
+                                    help="Checks your code on generated test cases and measures how its running time grows "
+                                         "(the backend must be started with SANDBOX_ENABLED=1)")
             if st.button("Submit Code for Review"):
                 try:
-                    response = requests.post(
-                        f"{BACKEND_URL}/verify_code",
-                        json={
-                            "code": content,
-                            "conversation_history": [
-                                {"role": msg["role"], "content": msg["content"]}
-                                for msg in st.session_state.messages if msg["role"] in ["user", "agent"]
-                            ]
-                        }
-                    )
-                    if response.status_code == 200:
-                        st.session_state.code_review_feedback = response.json().get("feedback")
-                    else:
-                        st.error(f"Error communicating with backend for code review: {response.text}")
+                    # Stream the review into a temporary bubble; the rerun below redraws it from state
+                    payload = {"code": content, "run_tests": run_tests,
+                               "problem": st.session_state.topic or "", **history_payload()}
+                    with st.empty().container():
+                        with st.chat_message("agent"):
+                            st.session_state.code_review_feedback = st.write_stream(
+                                stream_from_backend("/verify_code/stream", payload))
+                    mark_synced(payload)
                 except requests.exceptions.RequestException as e:
                     st.error(f"Connection error: {e}")
                 
@@ -222,6 +495,8 @@ def main():
     with quiz_tab:
         # Quiz functionality
         if st.session_state.topic and not st.session_state.quiz_active:
+            if st.session_state.quiz_ready:
+                st.caption("Quizzes for this problem are ready, so yours will load right away.")
             if st.button("Take a Quiz!"):
                 st.session_state.quiz_active = True
                 st.rerun() # Use st.rerun
@@ -232,29 +507,26 @@ def main():
                                  "High School", "Undergraduate", "Graduate"])
             if st.button("Generate Quiz"):
                 try:
-                    response = requests.post(
-                        f"{BACKEND_URL}/generate_quiz",
-                        json={
-                            "topic": st.session_state.topic,
-                            "grade": grade,
-                            "conversation_history": [
-                                {"role": msg["role"], "content": msg["content"]}
-                                for msg in st.session_state.messages if msg["role"] in ["user", "agent"]
-                            ]
-                        }
-                    )
-                    if response.status_code == 200:
-                        st.session_state.quiz_questions = response.json().get("questions")
-                        st.session_state.messages.append(
-                            {"role": "agent", "content": "Here's your quiz!"})
-                    else:
-                        st.error(f"Error generating quiz: {response.text}")
+                    payload = {
+                        "topic": st.session_state.topic,
+                        "grade": grade,
+                        **history_payload()
+                    }
+                    # Show each question as soon as it is written; the rerun below turns them into the form
+                    questions = []
+                    for question in stream_from_backend("/generate_quiz/stream", payload, key="question"):
+                        questions.append(question)
+                        st.markdown(f"**Question {len(questions)}:** {question['question']}")
+                    mark_synced(payload)
+                    st.session_state.quiz_questions = questions
+                    st.session_state.messages.append(
+                        {"role": "agent", "content": "Here's your quiz!"})
                 except requests.exceptions.RequestException as e:
                     st.error(f"Connection error: {e}")
                 
                 st.rerun() # Use st.rerun
 
-        if st.session_state.quiz_active and st.session_state.quiz_questions:
+        if st.session_state.quiz_active and st.session_state.quiz_questions and not st.session_state.quiz_job:
             st.subheader("Answer the Quiz Questions")
             with st.form(key='quiz_form'):
                 user_answers = {}
@@ -267,30 +539,28 @@ def main():
                 if submit_quiz:
                     st.session_state.quiz_answers = user_answers
                     try:
-                        response = requests.post(
-                            f"{BACKEND_URL}/submit_quiz",
-                            json={
-                                "topic": st.session_state.topic,
-                                "questions": st.session_state.quiz_questions,
-                                "answers": st.session_state.quiz_answers,
-                                "conversation_history": [
-                                    {"role": msg["role"],
-                                        "content": msg["content"]}
-                                    for msg in st.session_state.messages if msg["role"] in ["user", "agent"]
-                                ]
-                            }
-                        )
-                        if response.status_code == 200:
-                            st.session_state.quiz_results = response.json().get("results")
-                            st.session_state.messages.append(
-                                {"role": "agent", "content": "Quiz submitted! Here are your results."})
+                        payload = {
+                            "topic": st.session_state.topic,
+                            "questions": st.session_state.quiz_questions,
+                            "answers": st.session_state.quiz_answers,
+                            **history_payload()
+                        }
+                        # Graded in the background; poll_quiz_job() below picks up the results
+                        response = get_client().post("/jobs/submit_quiz", json=payload)
+                        if response.status_code == 202:
+                            mark_synced(payload)
+                            st.session_state.quiz_job = response.json()["job_id"]
                         else:
+                            check_session(response, payload)
                             st.error(f"Error submitting quiz: {response.text}")
                     except requests.exceptions.RequestException as e:
                         st.error(f"Connection error: {e}")
                     
                     st.rerun() # Use st.rerun
 
+        if st.session_state.quiz_job:
+            poll_quiz_job(pending.get("quiz_job"))
+
         if st.session_state.quiz_results:
             st.subheader("Quiz Results")
             st.markdown(st.session_state.quiz_results)
@@ -309,56 +579,20 @@ def main():
             st.info(
                 "Start a conversation in the first tab to be able to generate a summary.")
         else:
+            if st.session_state.summary_ready:
+                st.caption("Most of the conversation is already summarized, so this will be quick.")
             if st.button("Get Conversation Summary"):
                 with st.spinner("Generating summary..."):
-                    # Prepare conversation history
-                    conversation_history_for_backend = [
-                        {"role": msg["role"], "content": msg["content"]}
-                        for msg in st.session_state.messages if msg["role"] in ["user", "agent"]
-                    ]
-
-                    # Call the new /summarize endpoint
+                    # Call the /summarize/stream endpoint and show the summary as it is written.
+                    # The placeholder is cleared afterwards; the text area below shows the final version.
                     try:
-                        response = requests.post(
-                            # Assuming this is your new endpoint
-                            f"{BACKEND_URL}/summarize",
-                            # json={
-                            #     "conversation_history": conversation_history_for_backend
-                            # }
-                            json={
-                                "topic": st.session_state.topic,
-                                "conversation_history": [
-                                    {"role": msg["role"],
-                                        "content": msg["content"]}
-                                    for msg in st.session_state.messages if msg["role"] in ["user", "agent"]
-                                ]
-                            }
-
-                        )
-                        if response.status_code == 200:
-                            # --- 2. ADDED THIS LOGIC BLOCK ---
-                            summary_data = response.json().get("summary")
-
-                            if isinstance(summary_data, str):
-                                st.session_state.conversation_summary = summary_data
-                            elif isinstance(summary_data, dict):
-                                # If it's a dict, warn the user and convert to string to prevent crashing
-                                st.warning(
-                                    "Received unexpected summary format (dictionary). Converting to string.")
-                                st.session_state.conversation_summary = str(
-                                    summary_data)
-                            else:
-                                # Handle any other unexpected types
-                                st.warning(
-                                    f"Received unknown summary format ({type(summary_data)}). Converting to string.")
-                                st.session_state.conversation_summary = str(
-                                    summary_data)
-                            # --- End of added block ---
-
-                            # st.success("Summary generated!")
-                        else:
-                            st.error(
-                                f"Error generating summary: {response.text}")
+                        placeholder = st.empty()
+                        with placeholder.container():
+                            st.session_state.conversation_summary = st.write_stream(
+                                stream_chat({"topic": st.session_state.topic}, end_conversation=True))
+                        placeholder.empty()
+                        # The registration started before this summary was written is for the old one
+                        pending.pop("export", None)
                     except requests.exceptions.RequestException as e:
                         st.error(f"Connection error: {e}")
 
@@ -376,17 +610,19 @@ def main():
                 st.divider()
 
                 # --- Download Buttons ---
+                # The PDF is rendered and cached by the backend, and fetched once per summary
+                pdf = summary_pdf(st.session_state.conversation_summary, pending.get("export"))
                 col1, col2 = st.columns(2)
 
-                with col1:
-                    # PDF Download
-                    pdf_html = get_pdf_download_html(
-                        st.session_state.conversation_summary)
-                    if pdf_html: # Only show if PDF generation was successful
-                        st.markdown(pdf_html, unsafe_allow_html=True)
-
+                if pdf is not None:
+                    with col1:
+                        st.download_button(
+                            label="Download Summary as PDF",
+                            data=pdf,
+                            file_name="conversation_summary.pdf",
+                            mime="application/pdf"
+                        )
                 with col2:
-                    # TXT Download (as a fallback)
                     st.download_button(
                         label="Download Summary as TXT",
                         data=st.session_state.conversation_summary,
@@ -397,6 +633,11 @@ def main():
                 st.info(
                     "Click the button above to generate a summary of your conversation.")
 
+    # Check on background jobs again shortly; any interaction meanwhile interrupts the wait
+    if st.session_state.pop("poll_jobs", False):
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
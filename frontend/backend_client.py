@@ -0,0 +1,77 @@
+"""
+The HTTP client the frontend talks to the backend with.
+
+One `BackendClient` is shared by every rerun and every browser session of the
+Streamlit server (`get_client()` is an `st.cache_resource`), so calls reuse
+kept-alive connections from its pool instead of opening a new one each. Every
+call has a connect and a read timeout, and failed connections are retried with
+a short backoff. So are GETs answered with 502/503/504, e.g. while a backend
+worker restarts. POSTs are never resent once they have reached the backend.
+
+Settings are read from the environment:
+- `BACKEND_URL`: where the backend runs (default http://localhost:8000);
+- `BACKEND_CONNECT_TIMEOUT`, `BACKEND_READ_TIMEOUT`: seconds; for a stream the
+  read timeout is the longest wait between two chunks;
+- `BACKEND_RETRIES`: retries of a failed connection;
+- `BACKEND_POOL_SIZE`: connections kept alive, which is also the number of
+  calls `fan_out` runs at once.
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BACKEND_URL = os.environ.get("BACKEND_URL", "http://localhost:8000").rstrip("/")
+BACKEND_WS_URL = BACKEND_URL.replace("http", "ws", 1)
+BACKEND_CONNECT_TIMEOUT = float(os.environ.get("BACKEND_CONNECT_TIMEOUT", "5"))
+BACKEND_READ_TIMEOUT = float(os.environ.get("BACKEND_READ_TIMEOUT", "120"))
+BACKEND_RETRIES = int(os.environ.get("BACKEND_RETRIES", "2"))
+BACKEND_POOL_SIZE = int(os.environ.get("BACKEND_POOL_SIZE", "16"))
+
+
+class BackendClient:
+    def __init__(self, base_url: str = BACKEND_URL, connect_timeout: float = BACKEND_CONNECT_TIMEOUT,
+                 read_timeout: float = BACKEND_READ_TIMEOUT, retries: int = BACKEND_RETRIES,
+                 pool_size: int = BACKEND_POOL_SIZE):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        # urllib3 only retries reads and error statuses for idempotent methods, so a POST is
+        # retried only if it never got through
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=0.2,
+                      status_forcelist=(502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="backend-client")
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, self.url(path), **kwargs)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def fan_out(self, calls: Dict[str, Callable[[], Any]]) -> Dict[str, Future]:
+        """
+        Starts independent calls at once and returns their futures under the same keys;
+        `.result()` returns a call's result or raises its exception. The calls run in
+        other threads, so they must only talk to the backend, not to `st`.
+        """
+        return {name: self._executor.submit(call) for name, call in calls.items()}
+
+
+@st.cache_resource
+def get_client() -> BackendClient:
+    """The client shared by all reruns and sessions of this Streamlit server."""
+    return BackendClient()